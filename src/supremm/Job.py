@@ -1,5 +1,7 @@
 """ Container class for an HPC job """
+import copy
 import datetime
+import os
 from collections import OrderedDict
 
 def safe_strptime(time_string, fmt):
@@ -70,6 +72,14 @@ class Job(object):
     """ Contains the data for a job. """
     # pylint: disable=too-many-instance-attributes
 
+    # Amount of data past the end of a time window that is included in the window
+    # so that the first datapoint after the window boundary is available. This
+    # assumes that pmlogger records the job metrics at least every 10 minutes (the
+    # default PCP configuration logs every 30 seconds). With a longer logging
+    # interval the datapoints between the last one in the overlap and the window
+    # boundary would be missing from the summary
+    WINDOW_OVERLAP = datetime.timedelta(minutes=10)
+
     def __init__(self, job_pk_id, job_id, acct):
         # pylint: disable=too-many-arguments
 
@@ -77,6 +87,8 @@ class Job(object):
         self.job_id = job_id
         self.acct = acct
         self._nodecount = acct['nodes']
+        # Number of nodes the job ran on when only a sample of them is summarized
+        self._totalnodecount = None
 
         self._start_datetime = datetimeconvert(acct['start_time'])
         self._end_datetime = datetimeconvert(acct['end_time'])
@@ -90,20 +102,26 @@ class Job(object):
 
         self._data = {}
         self.jobdir = None
+        self.scratchreservation = None
+        self.shardjobdirs = []
         self._nodebegin = {}
         self._nodeend = {}
 
         self._errors = {}
+        self.shardid = None
+        self.windowstart = None
+        self.windowend = None
 
     def __str__(self):
         """ Return a summary string describing the job """
         return "jobid=%s nodes=%s walltime=%s" % (self.job_id, self._nodecount, self.walltime)
 
-    def setjobdir(self, jobdir):
+    def setjobdir(self, jobdir, scratchreservation=None):
         """
-        Set job dir
+        Set job dir and the scratch space reservation that holds it (if any)
         """
         self.jobdir = jobdir
+        self.scratchreservation = scratchreservation
 
     def addnodearchive(self, nodename, node_archive):
         """
@@ -195,24 +213,122 @@ class Job(object):
         Get the start time for job data on the given node
         """
         if node in self._nodebegin:
-            return self._nodebegin[node]
+            begin = self._nodebegin[node]
         else:
-            return self.start_datetime
+            begin = self.start_datetime
+
+        if self.windowstart is not None:
+            begin = max(begin, self.windowstart)
+
+        return begin
 
     def getnodeend(self, node):
         """
         Get end time for job data on the given node
         """
         if node in self._nodeend:
-            return self._nodeend[node]
+            end = self._nodeend[node]
         else:
-            return self.end_datetime
+            end = self.end_datetime
+
+        if self.windowend is not None:
+            end = min(end, self.windowend + Job.WINDOW_OVERLAP)
+
+        return end
 
     @property
     def nodecount(self):
         """ Total number of nodes assigned to the job """
         return self._nodecount
 
+    @property
+    def totalnodecount(self):
+        """ Number of nodes that the job ran on. This is larger than the nodecount
+            if only a sample of the nodes is summarized """
+        if self._totalnodecount is None:
+            return self._nodecount
+        return self._totalnodecount
+
+    @property
+    def sampled(self):
+        """ Whether only a sample of the nodes is summarized """
+        return self._totalnodecount is not None
+
+    def samplenodes(self, nodenames):
+        """ Restrict the job to the listed nodes. The nodes are renumbered in order so
+            the job looks like one that ran on just those nodes (the nodecount is
+            the number of sampled nodes) and the head node should be listed first """
+        if self._totalnodecount is None:
+            self._totalnodecount = self._nodecount
+
+        wanted = set(nodenames)
+        nodes = OrderedDict()
+        for nodeidx, nodename in enumerate(x for x in self._nodes if x in wanted):
+            node = self._nodes[nodename]
+            nodes[nodename] = JobNode(nodename, nodeidx)
+            nodes[nodename].set_rawarchives(node.rawarchives)
+            nodes[nodename].set_combinedarchive(node.archive)
+
+        self._nodes = nodes
+        self._nodecount = len(nodes)
+        self._nodebegin = dict((name, begin) for name, begin in self._nodebegin.items() if name in nodes)
+        self._nodeend = dict((name, end) for name, end in self._nodeend.items() if name in nodes)
+
+    @property
+    def shardnodecount(self):
+        """ Number of nodes covered by this object. This is the same as the
+            nodecount unless this is a shard of a job """
+        if self.shardid is None:
+            return self._nodecount
+        return len(self._nodes)
+
+    def getshard(self, shardid, nodenames):
+        """ Return a copy of the job that only contains the listed nodes. The
+            node indexes and nodecount are unchanged so the shard can be summarized
+            independently and the results combined with mergeshard() """
+        shard = copy.copy(self)
+        shard.shardid = shardid
+        shard._nodes = OrderedDict((name, copy.deepcopy(self._nodes[name])) for name in nodenames)
+        shard._nodebegin = dict((name, self._nodebegin[name]) for name in nodenames if name in self._nodebegin)
+        shard._nodeend = dict((name, self._nodeend[name]) for name in nodenames if name in self._nodeend)
+        shard._data = {}
+        shard._errors = {}
+        shard.setjobdir(None)
+        shard.shardjobdirs = []
+        return shard
+
+    def getwindow(self, shardid, windowstart, windowend):
+        """ Return a copy of the job that only covers the time between windowstart and
+            windowend (either may be None to mean the start or end of the job). The
+            walltime of the copy is the time remaining in the job after windowstart
+            so that timeseries data are sampled at least as often as for the whole job """
+        shard = self.getshard(shardid, list(self._nodes.keys()))
+        shard.windowstart = windowstart
+        shard.windowend = windowend
+        if windowstart is not None:
+            shard.walltime = self.walltime - int((windowstart - self.start_datetime).total_seconds())
+        return shard
+
+    def mergeshard(self, shard):
+        """ Copy the archive information and errors from a processed shard """
+        for nodename, nodedata in shard._nodes.items():
+            if nodedata.archive != None:
+                self._nodes[nodename].set_combinedarchive(nodedata.archive)
+        self._nodebegin.update(shard._nodebegin)
+        self._nodeend.update(shard._nodeend)
+        for msg, count in shard._errors.items():
+            self._errors[msg] = self._errors.get(msg, 0) + count
+
+    def addshardjobdir(self, shard):
+        """ Record the archive directory and scratch reservation of a shard so that
+            they are cleaned up with the job. The job directory is the parent of the
+            shard directories """
+        if shard.jobdir is None:
+            return
+        self.shardjobdirs.append((shard.jobdir, shard.scratchreservation))
+        if self.jobdir is None:
+            self.jobdir = os.path.dirname(shard.jobdir)
+
     @property
     def start_datetime(self):
         """
@@ -26,6 +26,9 @@ class TimeseriesPatterns(Plugin):
     MIN_WALLTIME = 600
     DATAPOINT_THRESHOLD = MIN_WALLTIME / 30
 
+    # The period detection is slow for long jobs
+    expensive = True
+
     @property
     def mode(self):
         return "all"
@@ -46,6 +49,9 @@ class TimeseriesPatterns(Plugin):
         self.end_time = (job.end_datetime - EPOCH).total_seconds()
         self.section_len = (self.end_time - self.start_time) / self.SECTIONS
 
+        # Set when only a later time window of the job is processed by this instance
+        self.continuation = job.windowstart is not None
+
         self.nodes = {}
         self.section_start_timestamps = [[] for _ in range(self.SECTIONS)]
         self.metricNames = [str.replace(metric, '.', '-') for metric in self.requiredMetrics]
@@ -58,11 +64,53 @@ class TimeseriesPatterns(Plugin):
         if self.end_time - self.start_time < self.MIN_WALLTIME:
             return False
 
-        # associate each metric with its data point, as tuples of (metric, data)
         # sum across the mountpoints to get one total data point
-        metrics = list(zip(self.metricNames, (np.sum(x) for x in data)))
+        sums = np.array([[np.sum(x) for x in data]])
+
+        return self.adddatapoints(nodemeta.nodename, np.array([timestamp]), sums)
+
+    def process_block(self, nodemeta, timestamps, values, description):
+
+        if self.end_time - self.start_time < self.MIN_WALLTIME:
+            return False
+
+        sums = np.empty((len(timestamps), len(description)))
+        for i, (instances, _) in enumerate(description):
+            sums[:, i] = np.sum(values[:, i, :len(instances)], 1)
+
+        return self.adddatapoints(nodemeta.nodename, timestamps, sums)
+
+    def adddatapoints(self, nodename, timestamps, sums):
+        """ Update the section averages for a node with consecutive datapoints.
+            sums has the total for each metric (datapoint x metric) """
+
+        first = 0
+
+        # associate each metric with its data point, as tuples of (metric, data)
+        metrics = list(zip(self.metricNames, sums[0]))
+
+        if nodename not in self.nodes and self.continuation:
+            # The first datapoint in the window was processed as the last datapoint of the
+            # previous window. The average for the first section boundary that is crossed
+            # in this window is corrected when the windows are merged
+            timestamp = float(timestamps[0])
+            sections_passed = min(int((timestamp - self.start_time) // self.section_len), self.SECTIONS - 1)
+            self.nodes[nodename] = {
+                "current_marker": self.start_time + (sections_passed + 1) * self.section_len,
+                "section_start_data": dict(metrics),
+                "section_start_timestamp": timestamp,
+                "section_avgs": {metric: [] for metric in self.metricNames},
+                "last_value": metrics,
+                "section_counter": sections_passed,
+                "data_error": False,
+                "first_crossing": None,
+
+                "datapoints": 0,
+                "all_times": [],
+                "all_data": {metric: [] for metric in self.metricNames}
+            }
+            first = 1
 
-        nodename = nodemeta.nodename
         if nodename not in self.nodes:
             self.section_start_timestamps[0].append(self.start_time)
             self.nodes[nodename] = {
@@ -74,24 +122,36 @@ class TimeseriesPatterns(Plugin):
                 "section_counter": 0,
                 "data_error": False,
 
+                "datapoints": 0,
                 "all_times": [],
                 "all_data": {metric: [] for metric in self.metricNames}
             }
 
+        if first == len(timestamps):
+            return True
+
         node = self.nodes[nodename]
 
-        node['all_times'].append(timestamp)  # this could potentially just be a counter if not doing autoperiod
+        node['datapoints'] += len(timestamps) - first
         if _HAS_AUTOPERIOD:
             # we need to store every data point for now to do period analysis
             # hopefully this won't be needed in the future
-            for metric, data in metrics:
-                node['all_data'][metric].append(data)
+            node['all_times'].extend(timestamps[first:].tolist())
+            for i, metric in enumerate(self.metricNames):
+                node['all_data'][metric].extend(sums[first:, i])
 
         # always store latest value since it is needed in the results stage
         # and we don't know when the processing will end
-        node['last_value'] = metrics
+        node['last_value'] = list(zip(self.metricNames, sums[-1]))
 
-        if timestamp >= node['current_marker'] and timestamp < self.end_time:
+        # Only the datapoints where a section boundary is crossed are looked at
+        while first < len(timestamps):
+            crossing = first + np.searchsorted(timestamps[first:], node['current_marker'])
+            if crossing == len(timestamps) or timestamps[crossing] >= self.end_time:
+                break
+
+            timestamp = float(timestamps[crossing])
+            metrics = list(zip(self.metricNames, sums[crossing]))
 
             # if the data point is too far from the expected section cutoff
             # (i.e. there is a large gap in the data), mark the node as errored
@@ -103,13 +163,51 @@ class TimeseriesPatterns(Plugin):
                 node['section_avgs'][metric].append(avg)
                 node['section_start_data'][metric] = data
 
+            if self.continuation and node['first_crossing'] is None:
+                node['first_crossing'] = (timestamp, dict(metrics))
+
             node['section_start_timestamp'] = timestamp
             node['section_counter'] += 1
             self.section_start_timestamps[node['section_counter']].append(timestamp)
             node['current_marker'] += self.section_len
 
+            first = crossing + 1
+
         return True
 
+    def merge(self, other):
+        self.nodes.update(other.nodes)
+        for section, timestamps in enumerate(other.section_start_timestamps):
+            self.section_start_timestamps[section].extend(timestamps)
+
+    def mergewindow(self, other):
+        for nodename, theirs in other.nodes.items():
+            if nodename not in self.nodes:
+                self.nodes[nodename] = theirs
+                continue
+
+            node = self.nodes[nodename]
+
+            if theirs.get('first_crossing') is not None:
+                timestamp, metrics = theirs['first_crossing']
+                for metric, data in metrics.items():
+                    theirs['section_avgs'][metric][0] = (data - node['section_start_data'][metric]) / (timestamp - node['section_start_timestamp'])
+                    node['section_avgs'][metric].extend(theirs['section_avgs'][metric])
+                node['section_start_data'] = theirs['section_start_data']
+                node['section_start_timestamp'] = theirs['section_start_timestamp']
+                node['section_counter'] = theirs['section_counter']
+                node['data_error'] = theirs['data_error']
+
+            node['current_marker'] = theirs['current_marker']
+            node['last_value'] = theirs['last_value']
+            node['datapoints'] += theirs['datapoints']
+            node['all_times'].extend(theirs['all_times'])
+            for metric, data in theirs['all_data'].items():
+                node['all_data'][metric].extend(data)
+
+        for section, timestamps in enumerate(other.section_start_timestamps):
+            self.section_start_timestamps[section].extend(timestamps)
+
     def results(self):
 
         if self.end_time - self.start_time < self.MIN_WALLTIME:
@@ -125,7 +223,7 @@ class TimeseriesPatterns(Plugin):
         }
 
         for nodename, node in self.nodes.items():
-            if not len(node['all_times']) > self.DATAPOINT_THRESHOLD:
+            if not node['datapoints'] > self.DATAPOINT_THRESHOLD:
                 node['data_error'] = True
                 continue
 
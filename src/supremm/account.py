@@ -3,7 +3,7 @@
 Abstraction of the job accouting data
 """
 
-from supremm.accounting import Accounting, ArchiveCache
+from supremm.accounting import Accounting, ArchiveCache, StatusBatch
 import pymysql as mdb
 from supremm import batch_acct
 from supremm.Job import Job
@@ -144,11 +144,20 @@ class DbLogger(object):
     def __init__(self, conf):
         dbconf = conf.getsection("accountdatabase")
         self.con = mdb.connect(db=dbconf['dbname'], read_default_file=dbconf['defaultsfile'])
+        self._batch = StatusBatch(self._write)
 
     def dolog(self, acct, resource_id, version, ptime):
         """
-        mark a job record as processed
+        mark a job record as processed. The updates are buffered until flush()
         """
+        self._batch.add((version, ptime, resource_id, acct['id'], acct['end_time']))
+
+    def flush(self):
+        """ write the buffered updates """
+        self._batch.flush()
+
+    def _write(self, rows):
+        """ apply the updates for a batch of jobs in one transaction """
 
         query = """ UPDATE process p, job j
                     SET p.process_version = %s, p.process_timestamp = NOW(), p.process_time = %s
@@ -158,10 +167,8 @@ class DbLogger(object):
                         AND j.local_job_id = %s 
                         AND j.end_time_ts = %s """
 
-        data = (version, ptime, resource_id, acct['id'], acct['end_time'])
-
         cur = self.con.cursor()
-        cur.execute(query, data)
+        cur.executemany(query, rows)
         self.con.commit()
 
     def logprocessed(self, acct, resource_id, ptime):
@@ -298,9 +305,10 @@ class DbAcct(Accounting):
 
             yield self.recordtojob(r, list(hostarchives.keys()), hostarchives)
 
-    def get(self, start_time=None, end_time=None):
+    def get(self, start_time=None, end_time=None, opts=None):
         """ 
         read all unprocessed jobs between start_time and end_time (or all time if start/end not specified)
+        The job skip checks are not applied in the query for this accounting database
         """
 
         query = """SELECT 
@@ -346,6 +354,9 @@ class DbAcct(Accounting):
             # elapsed time ignored for pending jobs
             self._dblog.logpending(job.acct, self._resource_id)
 
+    def flush(self):
+        self._dblog.flush()
+
 
 def ingestall(config):
     """ 
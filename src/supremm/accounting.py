@@ -1,6 +1,8 @@
 """ definition of the accounting API and implementations of some base classes that
     include common functions """
 
+import logging
+import threading
 from abc import ABCMeta, abstractmethod
 
 class Accounting(object, metaclass=ABCMeta):
@@ -24,7 +26,7 @@ class Accounting(object, metaclass=ABCMeta):
         pass
 
     @abstractmethod
-    def get(self, start, end):
+    def get(self, start, end, opts=None):
         """ Yields all unprocessed jobs. Optionally specify a time interval to process"""
         pass
 
@@ -33,6 +35,73 @@ class Accounting(object, metaclass=ABCMeta):
         """ log a job as being processed (either successfully or not) """
         pass
 
+    def flush(self):
+        """ write the process status for jobs that markasdone() has buffered. Must
+            be called once all of the jobs have been processed """
+        pass
+
+
+class StatusBatch(object):
+    """ Buffers the process status rows for jobs so that they can be written to
+        the database in one statement. The write function is called with the list
+        of rows once maxrows have been added or maxwait seconds after the first
+        row in the batch was added. The timed writes are done by a background
+        thread so the write function must not share a database connection with
+        the code that adds the rows """
+
+    def __init__(self, writefn, maxrows=100, maxwait=30):
+        self._writefn = writefn
+        self._maxrows = maxrows
+        self._maxwait = maxwait
+        self._rows = []
+        self._lock = threading.RLock()
+        self._timer = None
+
+    def add(self, row):
+        """ buffer a row and write the batch if it is due """
+        with self._lock:
+            self._rows.append(row)
+
+            if len(self._rows) >= self._maxrows:
+                self.flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self._maxwait, self._timedflush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _timedflush(self):
+        """ write the rows that have waited for maxwait seconds. The rows are kept
+            for the next flush if the write fails """
+        with self._lock:
+            self._timer = None
+            rows = self._rows
+            self._rows = []
+            if not rows:
+                return
+            try:
+                self._writefn(rows)
+            except Exception as exc:
+                logging.error("Unable to write the process status for %s jobs: %s", len(rows), exc)
+                self._rows = rows + self._rows
+
+    def flush(self):
+        """ write the buffered rows. If the write fails the rows are kept for the
+            next flush and the exception is raised """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            rows = self._rows
+            self._rows = []
+            if not rows:
+                return
+            try:
+                self._writefn(rows)
+            except Exception as exc:
+                logging.error("Unable to write the process status for %s jobs: %s", len(rows), exc)
+                self._rows = rows + self._rows
+                raise
+
 class ArchiveCache(object, metaclass=ABCMeta):
     """ abstract base class describing the job archive cache interface """
 
@@ -1,15 +1,19 @@
 import logging
 from abc import ABC, abstractmethod
 
+from supremm.deadline import JobDeadline, deadlinesettings
 from supremm.errors import ProcessingError
+from supremm.nodesample import samplesettings, stratifiedsample
 from supremm.proc_common import instantiatePlugins
 
 class Datasource(ABC):
     """ Definition of the Datasource API """
 
-    def __init__(self, preprocs, plugins):
+    def __init__(self, preprocs, plugins, resconf=None):
         self._allpreprocs = preprocs
         self._allplugins = plugins
+        self._deadlinesettings = deadlinesettings(resconf)
+        self._samplesettings = samplesettings(resconf)
 
     @property
     def allpreprocs(self):
@@ -27,6 +31,27 @@ class Datasource(ABC):
     def allplugins(self, plugins):
         self._allplugins = plugins
 
+    def jobdeadline(self):
+        """ The time budget for summarizing a job (or a shard of a job) on the
+            resource. None if the resource has no budget """
+        if self._deadlinesettings is None:
+            return None
+        return JobDeadline(**self._deadlinesettings)
+
+    def samplenodes(self, job):
+        """ Only summarize a stratified sample of the nodes of a job that ran on
+            more nodes than the threshold for the resource. The statistics over a
+            few tens of nodes are nearly the same as over thousands """
+        if self._samplesettings is None or job.sampled or job.nodecount <= self._samplesettings['threshold']:
+            return
+
+        nodenames = list(job.nodenames())
+        if len(nodenames) <= self._samplesettings['samplesize']:
+            return
+
+        job.samplenodes(stratifiedsample(nodenames, self._samplesettings['samplesize'], str(job.job_id)))
+        logging.info("Summarizing %s of the %s nodes of %s", job.nodecount, job.totalnodecount, job.job_id)
+
     @abstractmethod
     def presummarize(self, job, config, resconf, opts):
 
@@ -70,6 +95,8 @@ class Datasource(ABC):
             jobmeta.error = ProcessingError.TIME_TOO_LONG
             jobmeta.missingnodes = job.nodecount
             logging.info("Skipping %s, skipped_too_long", job.job_id)
+        else:
+            self.samplenodes(job)
 
         return jobmeta
 
@@ -80,6 +107,25 @@ class Datasource(ABC):
         analytics = instantiatePlugins(self.allplugins, job)
         return preprocessors, analytics
 
+    def shardjob(self, job, config, resconf, opts):
+        """ Split a job into shards that each contain a subset of the nodes so that
+            they can be summarized in parallel. An empty list means that the job
+            should be summarized as a whole. This is called in the main process so
+            it should only do the checks that decide whether to split the job and
+            leave the data access to summarizeshard(). """
+        return []
+
+    def summarizeshard(self, shard, config, resconf, opts):
+        """ Summarize the nodes in a shard. Called in the worker process. The
+            default does nothing and the job is summarized by mergeshards() """
+        return JobMeta()
+
+    def mergeshards(self, job, shardresults, config, opts):
+        """ Combine the summaries of all of the shards of a job. Returns the same
+            information as summarizejob(). The default summarizes the whole job
+            in one go """
+        return self.summarizejob(job, JobMeta(), config, opts)
+
     @abstractmethod
     def cleanup(self, job, opts):
         pass
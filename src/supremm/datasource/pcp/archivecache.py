@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+    On-disk cache of the per-node archives that pmlogextract creates for a job
+"""
+import glob
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+
+class MergedArchiveCache(object):
+    """ Stores the merged node archives in a directory so that they can be reused
+        when a job is processed again. The entries are keyed on the node, the time
+        bounds and the names, sizes and modification times of the raw archive files
+        so a change to any of the inputs gives a new entry. The least recently used
+        entries are removed by evict() when the cache is larger than maxbytes. This
+        scans the whole cache so it is called once per job rather than per node. """
+
+    ARCHIVE_NAME = "archive"
+
+    def __init__(self, cachedir, maxbytes):
+        self._cachedir = cachedir
+        self._maxbytes = maxbytes
+        self._stored = False
+
+    @staticmethod
+    def archivefiles(archive):
+        """ The files that make up a pcp archive (.meta, .index, .0 etc.) """
+        return sorted(glob.glob(glob.escape(archive) + ".*"))
+
+    def key(self, nodename, begin, end, nodearchives):
+        """ The cache key for the merged archive of a node """
+        digest = hashlib.sha256()
+        digest.update("{0}\n{1}\n{2}\n".format(nodename, begin.isoformat(), end.isoformat()).encode())
+        for archive in sorted(nodearchives):
+            for filename in self.archivefiles(archive):
+                stat = os.stat(filename)
+                digest.update("{0} {1} {2}\n".format(filename, stat.st_size, stat.st_mtime_ns).encode())
+
+        return digest.hexdigest()
+
+    def _entrydir(self, key):
+        return os.path.join(self._cachedir, key[:2], key)
+
+    def fetch(self, key, node_archive):
+        """ Link the cached archive to node_archive. Returns False if the archive
+            is not in the cache """
+        entrydir = self._entrydir(key)
+        cached = os.path.join(entrydir, self.ARCHIVE_NAME)
+        files = self.archivefiles(cached)
+        if not files:
+            return False
+
+        try:
+            for filename in files:
+                suffix = filename[len(cached):]
+                os.link(filename, node_archive + suffix)
+            # The modification time of the entry is used for the LRU eviction
+            os.utime(entrydir)
+        except OSError as exc:
+            # Either evicted by another process or the cache is on a different filesystem
+            logging.debug("Unable to use cached archive %s: %s", cached, exc)
+            for filename in self.archivefiles(node_archive):
+                os.unlink(filename)
+            return False
+
+        return True
+
+    def store(self, key, node_archive):
+        """ Add a merged archive to the cache. The cache may be over its budget
+            until evict() is called """
+        entrydir = self._entrydir(key)
+        if os.path.exists(entrydir):
+            return
+
+        tmpdir = None
+        try:
+            os.makedirs(os.path.dirname(entrydir), exist_ok=True)
+            # The entry is created under a temporary name and then renamed so that
+            # other processes never see a partial entry
+            tmpdir = tempfile.mkdtemp(dir=os.path.dirname(entrydir))
+            for filename in self.archivefiles(node_archive):
+                suffix = filename[len(node_archive):]
+                target = os.path.join(tmpdir, self.ARCHIVE_NAME + suffix)
+                try:
+                    os.link(filename, target)
+                except OSError:
+                    shutil.copy2(filename, target)
+            os.rename(tmpdir, entrydir)
+        except OSError as exc:
+            logging.warning("Unable to add %s to the archive cache: %s", node_archive, exc)
+            if tmpdir is not None:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+            return
+
+        self._stored = True
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache fits in the budget.
+            Does nothing if no archives have been stored since the last call """
+        if not self._stored:
+            return
+        self._stored = False
+
+        entries = []
+        total = 0
+        for entrydir in glob.glob(os.path.join(self._cachedir, "*", "*")):
+            if os.path.basename(entrydir).startswith("tmp"):
+                # Entry that is being added
+                continue
+            try:
+                size = sum(os.path.getsize(f) for f in glob.glob(os.path.join(entrydir, "*")))
+                entries.append((os.path.getmtime(entrydir), size, entrydir))
+            except OSError:
+                continue
+            total += size
+
+        entries.sort()
+        while total > self._maxbytes and entries:
+            _, size, entrydir = entries.pop(0)
+            logging.debug("Evicting %s from the archive cache", entrydir)
+            shutil.rmtree(entrydir, ignore_errors=True)
+            total -= size
+
+
+def getarchivecache(conf):
+    """ Returns the merged archive cache if one is configured """
+    pathconf = conf.getsection("summary")
+    if not pathconf or 'archive_cache_dir' not in pathconf:
+        return None
+
+    maxbytes = int(float(pathconf.get('archive_cache_size_mb', 10240)) * 1024 * 1024)
+    return MergedArchiveCache(pathconf['archive_cache_dir'], maxbytes)
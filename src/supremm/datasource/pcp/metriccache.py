@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+    Cache of the metrics that the plugins resolve to in the PCP archives
+"""
+import collections
+import hashlib
+import logging
+import struct
+
+from supremm.nodesample import hostclass
+
+# Metadata record type for the metric descriptors, these hold the pmID, type,
+# instance domain, semantics, units and names of each metric
+TYPE_DESC = 1
+
+_RECORD_HEADER = struct.Struct(">ii")
+
+
+def pmnssignature(archive, hostname):
+    """ Signature of the metric namespace of an archive. This is the host class
+        and a hash of the metric descriptor records in the .meta file. Archives
+        with the same signature have the same metric names, pmIDs and types.
+        Returns None if the metadata cannot be read """
+    try:
+        with open(archive + ".meta", "rb") as fp:
+            meta = fp.read()
+    except OSError as exc:
+        logging.debug("No metric namespace signature for %s: %s", archive, exc)
+        return None
+
+    digest = hashlib.sha1()
+    # Each record is a length, type, payload and a trailing copy of the length.
+    # The first record is the archive label
+    offset = 0
+    first = True
+    while offset + _RECORD_HEADER.size <= len(meta):
+        length, rtype = _RECORD_HEADER.unpack_from(meta, offset)
+        if length < _RECORD_HEADER.size + 4 or offset + length > len(meta):
+            logging.debug("Unexpected record in %s.meta at offset %s", archive, offset)
+            return None
+        if rtype == TYPE_DESC and not first:
+            digest.update(meta[offset + _RECORD_HEADER.size:offset + length - 4])
+        offset += length
+        first = False
+
+    return hostclass(hostname) + ":" + digest.hexdigest()
+
+
+def metricskey(plugin):
+    """ The metrics that a plugin asks for, in a hashable form """
+    required = plugin.requiredMetrics
+    if len(required) > 0 and not isinstance(required[0], str):
+        required = tuple(tuple(x) for x in required)
+    else:
+        required = tuple(required)
+    return (required, tuple(plugin.optionalMetrics))
+
+
+class MetricResolutionCache(object):
+    """ Remembers which of the alternative metric lists of a plugin was found in
+        archives with a given metric namespace signature along with the pmIDs and
+        types of the metrics. Nodes with the same hardware and PCP configuration
+        resolve the same way so the name lookups only need to be done once. A
+        plugin whose metrics were not found is stored with no metrics. The least
+        recently used entries are dropped when there are more than maxentries. """
+
+    def __init__(self, maxentries=4096):
+        self._entries = collections.OrderedDict()
+        self._maxentries = maxentries
+
+    def get(self, signature, plugin):
+        """ Returns the (pmids, metricnames, mtypes) tuple for the plugin or None
+            if it is not in the cache """
+        key = (signature, metricskey(plugin))
+        resolution = self._entries.get(key)
+        if resolution is not None:
+            self._entries.move_to_end(key)
+        return resolution
+
+    def store(self, signature, plugin, pmids, metricnames, mtypes):
+        """ Add the metrics that a plugin resolved to """
+        self._entries[(signature, metricskey(plugin))] = (tuple(pmids), list(metricnames), list(mtypes))
+        while len(self._entries) > self._maxentries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
@@ -2,20 +2,28 @@
 """
     pcp archive processing functions
 """
+import ctypes
 import errno
+import glob
 import logging
 import datetime
 import os
 import shutil
 import subprocess
 import math
+import tempfile
 import time
 import traceback
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from pcp import pmapi
 import cpmapi as c_pmapi
 
+from supremm.datasource.pcp.archivecache import getarchivecache
+from supremm.datasource.pcp.scratchspace import ScratchSpace, estimatesize, getscratchspace
+
 def get_datetime_from_timeval(tv):
     """
     Converts a PCP timeval object into a datetime object.
@@ -91,20 +99,74 @@ def extract_and_merge_logs(job, conf, resconf, opts):
     return pmlogextract(job, conf, resconf, opts)
 
 
-def getlibextractcmdline(startdate, enddate, inputarchives, outputarchive):
-    """ build the pmlogextract commmandline """
+# The handle for libpcp_pmlogextract.so.1. False if it could not be loaded
+_libextract = None
 
-    # The time format used by the archive merging tool.
-    pcp_time_format = "@ %Y-%m-%d %H:%M:%S UTC"
+def loadlibextract():
+    """ Returns the pmlogextract library or None if it is not available """
+    global _libextract
 
-    cmdline = ["-S", startdate.strftime(pcp_time_format),
-               "-T", enddate.strftime(pcp_time_format)]
+    if _libextract is None:
+        try:
+            _libextract = ctypes.CDLL("libpcp_pmlogextract.so.1")
+            _libextract.pmlogextract.argtypes = [ctypes.c_int, ctypes.POINTER(ctypes.c_char_p)]
+            _libextract.pmlogextract.restype = ctypes.c_int
+        except (OSError, AttributeError) as exc:
+            logging.error("Unable to load libpcp_pmlogextract.so.1, pmlogextract will be run as a separate process: %s", exc)
+            _libextract = False
 
-    cmdline.extend(inputarchives)
+    return _libextract if _libextract else None
 
-    cmdline.append(outputarchive)
+def checklibextract(startdate, enddate, inputarchives, outputarchive):
+    """ Returns a description of the problem if pmlogextract would reject the
+        arguments, otherwise None """
 
-    return cmdline
+    if startdate >= enddate:
+        return "pmlogextract: invalid time window {0} to {1}".format(startdate, enddate)
+
+    for archive in inputarchives:
+        if not glob.glob(glob.escape(archive) + ".meta*"):
+            return "pmlogextract: cannot open input archive {0}".format(archive)
+
+    if glob.glob(glob.escape(outputarchive) + ".*"):
+        return "pmlogextract: output archive {0} already exists".format(outputarchive)
+
+    return None
+
+def libpmlogextract(lib, cmdline):
+    """ Run pmlogextract from the library. Returns the return code and the
+        messages that were written to stderr.
+
+        The library runs the main() of pmlogextract, which may call exit() and
+        keeps global state between calls. Each extraction is therefore run in a
+        forked child process that exits when it is done. Unlike running the
+        pmlogextract program, no new executable is loaded """
+
+    argv = [arg.encode() for arg in cmdline]
+    argarray = (ctypes.c_char_p * len(argv))(*argv)
+
+    with tempfile.TemporaryFile() as errfile:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            returncode = 1
+            try:
+                os.dup2(errfile.fileno(), 2)
+                returncode = lib.pmlogextract(len(argv), argarray)
+            finally:
+                os._exit(returncode & 0xff)
+
+        _, status = os.waitpid(pid, 0)
+        if os.WIFSIGNALED(status):
+            returncode = -os.WTERMSIG(status)
+        else:
+            returncode = os.WEXITSTATUS(status)
+
+        errfile.seek(0)
+        errdata = errfile.read()
+
+    return returncode, errdata
 
 def getextractcmdline(startdate, enddate, inputarchives, outputarchive):
     """ build the pmlogextract commmandline """
@@ -122,8 +184,9 @@ def getextractcmdline(startdate, enddate, inputarchives, outputarchive):
 
     return cmdline
 
-def genoutputdir(job, conf, resconf):
-    """ compute the per job archive directory path based on config options """
+def genoutputdir(job, conf, resconf, basedir=None):
+    """ compute the per job archive directory path based on config options. The
+        directory is placed under basedir instead of archive_out_dir if set """
     
     if 'job_output_dir' in resconf:
         jobdir = resconf['job_output_dir']
@@ -136,12 +199,93 @@ def genoutputdir(job, conf, resconf):
         subdir = pathconf['subdir_out_format'].replace("%r", resconf['name']) .replace("%j", job.job_id)
         subdir = job.end_datetime.strftime(subdir)
 
-        jobdir = os.path.join(pathconf['archive_out_dir'], subdir)
+        jobdir = os.path.join(basedir or pathconf['archive_out_dir'], subdir)
 
     logging.debug("jobdir is %s", jobdir)
 
     return jobdir
 
+def allocjobdir(job, conf, resconf):
+    """ Choose the per job archive directory. The directory is on the scratch
+        space if one is configured and the job archives fit in the space that is
+        left, otherwise (or if their size cannot be estimated) it is in archive_out_dir. Sets the job directory and
+        the scratch reservation on the job. A job shard has a subdirectory of the
+        job directory """
+
+    scratch = None if 'job_output_dir' in resconf else getscratchspace(conf)
+
+    if scratch is not None:
+        size = estimatesize(job)
+        jobdir = shardoutputdir(job, genoutputdir(job, conf, resconf, scratch.scratchdir))
+        reservation = None if size is None else scratch.reserve(jobdir, size)
+        if reservation is not None:
+            logging.debug("Using scratch space for %s (%s bytes)", job.job_id, size)
+            job.setjobdir(jobdir, reservation)
+            return jobdir
+
+    jobdir = shardoutputdir(job, genoutputdir(job, conf, resconf))
+    job.setjobdir(jobdir)
+    return jobdir
+
+def shardoutputdir(job, jobdir):
+    """ The archive directory for a job shard """
+    if job.shardid is None:
+        return jobdir
+    return os.path.join(jobdir, "shard{0}".format(job.shardid))
+
+def releasejobdir(job):
+    """ Return the scratch space used by the job (and job shard) archive directories """
+    reservations = [job.scratchreservation] + [x for _, x in job.shardjobdirs]
+    for reservation in reservations:
+        if reservation is not None:
+            ScratchSpace.release(reservation)
+    job.scratchreservation = None
+    job.shardjobdirs = []
+
+def directarchive(nodename, nodearchives):
+    """ Returns the name of a PCP multi-archive context that reads the raw archives
+        for a node directly, or None if the archives cannot be combined this way
+        (for example if they overlap in time) """
+    archive = ",".join(nodearchives)
+    try:
+        pmapi.pmContext(c_pmapi.PM_CONTEXT_ARCHIVE, archive)
+    except pmapi.pmErr as exp:
+        logging.debug("Cannot read the archives for %s directly: %s", nodename, exp)
+        return None
+
+    return archive
+
+def archivefilesystem(nodearchives):
+    """ Identifier for the filesystem that holds the raw archives for a node """
+    try:
+        return os.stat(os.path.dirname(nodearchives[0])).st_dev
+    except (OSError, IndexError):
+        return None
+
+def runextract(pcp_cmd, fslimit=None):
+    """ Run the pmlogextract command. Returns the return code and the messages
+        that were written to stderr """
+    if fslimit is not None:
+        fslimit.acquire()
+    try:
+        logging.debug("Calling %s", " ".join(pcp_cmd))
+        proc = subprocess.Popen(pcp_cmd, stderr=subprocess.PIPE)
+        (_, errdata) = proc.communicate()
+    finally:
+        if fslimit is not None:
+            fslimit.release()
+
+    return proc.returncode, errdata
+
+def removejobdir(jobdir):
+    """ delete the per job archive directory and its contents if it exists """
+    if os.path.exists(jobdir):
+        try:
+            shutil.rmtree(jobdir, ignore_errors=True)
+            logging.debug("Job directory %s existed and was deleted.", jobdir)
+        except EnvironmentError:
+            pass
+
 def pmlogextract(job, conf, resconf, opts):
     """
     Takes a job description and merges logs for the time it ran.
@@ -157,15 +301,14 @@ def pmlogextract(job, conf, resconf, opts):
 
     logging.info("START resource=%s %s", resconf['name'], str(job))
 
-    # Generate the path to the job's log directory.
-    jobdir = genoutputdir(job, conf, resconf)
+    # Generate the path to the job's log directory. The shards of a job that
+    # has been split already have their own directory
+    if job.jobdir is None:
+        jobdir = allocjobdir(job, conf, resconf)
+    else:
+        jobdir = job.jobdir
 
-    if os.path.exists(jobdir):
-        try:
-            shutil.rmtree(jobdir, ignore_errors=True)
-            logging.debug("Job directory %s existed and was deleted.", jobdir)
-        except EnvironmentError:
-            pass
+    removejobdir(jobdir)
 
     # Create the directory the job logs will be stored in. If an error
     # occurs, log an error and stop.
@@ -182,42 +325,100 @@ def pmlogextract(job, conf, resconf, opts):
             logging.error("Job directory %s could not be created. Error: %s %s", jobdir, str(e), traceback.format_exc())
             return 1
 
-    job.setjobdir(jobdir)
-
     node_error = 0
     nodes_seen = 0;
 
+    # Call the library version of pmlogextract to avoid fork calls in MPI
+    lib = loadlibextract() if opts['libextract'] else None
+
+    # The pmlogextract processes for the nodes are run concurrently (up to
+    # extract_parallel at a time and extract_per_fs for the archives on each
+    # filesystem). The results are recorded in node order.
+    executor = None
+    fslimits = {}
+
+    # Merged archives from an earlier run are reused if the cache is enabled
+    cache = getarchivecache(conf)
+    cachekeys = {}
+    if lib is None and opts['extract_parallel'] > 1:
+        executor = ThreadPoolExecutor(opts['extract_parallel'])
+
+    extractions = []
+
     # For every node the job ran on...
     for nodename, nodearchives in job.rawarchives():
         nodes_seen += 1
 
+        if opts['direct_read']:
+            # The summarizer reads the data for the node from the raw archives
+            node_archive = directarchive(nodename, nodearchives)
+            if node_archive is not None:
+                job.addnodearchive(nodename, node_archive)
+                continue
+
         # Merge the job logs for the node.
         node_archive = os.path.join(jobdir, nodename)
 
-        # Call the library version of pmlogextract to avoid fork calls in MPI
-        if opts['libextract']:
-            sys.exit(1)
+        if cache is not None:
+            cachekey = cache.key(nodename, job.getnodebegin(nodename), job.getnodeend(nodename), nodearchives)
+            if cache.fetch(cachekey, node_archive):
+                logging.debug("Using cached archive for %s", nodename)
+                job.addnodearchive(nodename, node_archive)
+                continue
+            cachekeys[nodename] = cachekey
+
+        if lib is not None:
+            pcp_cmd = getextractcmdline(job.getnodebegin(nodename), job.getnodeend(nodename), nodearchives, node_archive)
+
+            problem = checklibextract(job.getnodebegin(nodename), job.getnodeend(nodename), nodearchives, node_archive)
+            if problem is not None:
+                extractions.append((nodename, node_archive, pcp_cmd, (1, problem)))
+                continue
+
+            logging.debug("Calling library %s", " ".join(pcp_cmd))
+            extractions.append((nodename, node_archive, pcp_cmd, libpmlogextract(lib, pcp_cmd)))
+        elif executor is not None:
+            pcp_cmd = getextractcmdline(job.getnodebegin(nodename), job.getnodeend(nodename), nodearchives, node_archive)
+
+            fslimit = None
+            if opts['extract_per_fs'] > 0:
+                fskey = archivefilesystem(nodearchives)
+                if fskey not in fslimits:
+                    fslimits[fskey] = threading.Semaphore(opts['extract_per_fs'])
+                fslimit = fslimits[fskey]
+
+            extractions.append((nodename, node_archive, pcp_cmd, executor.submit(runextract, pcp_cmd, fslimit)))
         else:
             pcp_cmd = getextractcmdline(job.getnodebegin(nodename), job.getnodeend(nodename), nodearchives, node_archive)
+            extractions.append((nodename, node_archive, pcp_cmd, runextract(pcp_cmd)))
 
-            logging.debug("Calling %s", " ".join(pcp_cmd))
-            proc = subprocess.Popen(pcp_cmd, stderr=subprocess.PIPE)
-            (_, errdata) = proc.communicate()
+    if executor is not None:
+        executor.shutdown(wait=True)
 
-            if errdata != None and len(errdata) > 0:
-                logging.warning(errdata)
-                job.record_error(errdata)
+    for nodename, node_archive, pcp_cmd, outcome in extractions:
+        if executor is not None:
+            outcome = outcome.result()
+        returncode, errdata = outcome
 
-            if proc.returncode:
-                errmsg = "pmlogextract return code: %s source command was: %s" % (proc.returncode, " ".join(pcp_cmd))
-                logging.warning(errmsg)
-                node_error -= 1
-                job.record_error(errmsg)
-            else:
-                job.addnodearchive(nodename, node_archive)
+        if errdata != None and len(errdata) > 0:
+            logging.warning(errdata)
+            job.record_error(errdata)
+
+        if returncode:
+            errmsg = "pmlogextract return code: %s source command was: %s" % (returncode, " ".join(pcp_cmd))
+            logging.warning(errmsg)
+            node_error -= 1
+            job.record_error(errmsg)
+        else:
+            job.addnodearchive(nodename, node_archive)
+            if nodename in cachekeys:
+                cache.store(cachekeys[nodename], node_archive)
+
+    if cache is not None:
+        cache.evict()
     
     # We care about errors, but also how many nodes didn't have archives at all
-    nodes_missing = job.nodecount - nodes_seen
+    nodes_missing = job.shardnodecount - nodes_seen
     node_error -= nodes_missing
 
     return node_error
@@ -17,6 +17,10 @@ cdef extern from "pcp/pmapi.h":
     int PM_ERR_SIGN      =  "PM_ERR_SIGN"
     enum: PM_ERR_VALUE
 
+    # pmValueSet.valfmt -- value storage format
+    enum: PM_VAL_INSITU
+    enum: PM_VAL_HDR_SIZE
+
     # pmDesc.type -- data type of metric values 
     int PM_TYPE_NOSUPPORT        = "PM_TYPE_NOSUPPORT"
     int PM_TYPE_32               = "PM_TYPE_32"
@@ -37,7 +41,9 @@ cdef extern from "pcp/pmapi.h":
     ctypedef unsigned int pmID
     ctypedef unsigned int pmInDom
     ctypedef struct pmValueBlock:
-        pass
+        unsigned int vtype
+        unsigned int vlen
+        char vbuf[1]
     ctypedef union myvalue:
         pmValueBlock* pval
         int lval
@@ -2,7 +2,8 @@
 
 from pcp import pmapi
 from libc.stdlib cimport free, malloc
-from libc.stdint cimport uintptr_t
+from libc.stdint cimport uintptr_t, int32_t, uint32_t, int64_t, uint64_t
+from libc.string cimport memcpy
 from cpython cimport PyObject_GetBuffer, PyBuffer_Release, PyBUF_SIMPLE
 import cpmapi as c_pmapi
 import numpy
@@ -65,120 +66,213 @@ cdef object strinnerloop(int numval, c_pcp.pmResult* res, int i):
         free(atom.cp)
     return numpy.array(tmp_data)
 
-cdef numpy.ndarray[double, ndim=1, mode="c"] int32innerloop(int numval, c_pcp.pmResult* res, int i):
-    cdef Py_ssize_t j
-    cdef c_pcp.pmAtomValue atom
-    cdef int status
-    cdef numpy.ndarray[double, ndim=1, mode="c"] tmp_data = numpy.empty(numval, dtype=numpy.float64)
-    tmp_data = tmp_data # To update cython reference
-    for j in xrange(numval):
-        status = c_pcp.pmExtractValue(res.vset[i].valfmt, &res.vset[i].vlist[j], c_pcp.PM_TYPE_32, &atom, c_pcp.PM_TYPE_32)
-        if status < 0:
-            raise pmapi.pmErr(status)
-        tmp_data[j] = <double>atom.l
-    return tmp_data
-
-cdef numpy.ndarray[double, ndim=1, mode="c"] uint32innerloop(int numval, c_pcp.pmResult* res, int i):
-    cdef Py_ssize_t j
-    cdef int status
-    cdef c_pcp.pmAtomValue atom
-    cdef numpy.ndarray[double, ndim=1, mode="c"] tmp_data = numpy.empty(numval, dtype=numpy.float64)
-    tmp_data = tmp_data
-    for j in xrange(numval):
-        inst = res.vset[i].vlist[j].inst
-        status = c_pcp.pmExtractValue(res.vset[i].valfmt, &res.vset[i].vlist[j], c_pcp.PM_TYPE_U32, &atom, c_pcp.PM_TYPE_U32)
-        if status < 0:
-            raise pmapi.pmErr(status)
-        tmp_data[j] = <double>atom.ul
-    return tmp_data
-
-cdef numpy.ndarray[double, ndim=1, mode="c"] int64innerloop(int numval, c_pcp.pmResult* res, int i):
-    cdef Py_ssize_t j
+cdef inline bint isnumeric(int dtype):
+    return (dtype == c_pcp.PM_TYPE_32 or dtype == c_pcp.PM_TYPE_U32 or
+            dtype == c_pcp.PM_TYPE_64 or dtype == c_pcp.PM_TYPE_U64 or
+            dtype == c_pcp.PM_TYPE_DOUBLE or dtype == c_pcp.PM_TYPE_FLOAT)
+
+cdef inline int decodevalue(int valfmt, c_pcp.pmValue* val, int dtype, double* out):
+    """ Convert a value to a double. The common representations (32 bit values
+        stored in the pmValue and 64 bit and floating point values in a
+        pmValueBlock) are decoded directly and pmExtractValue is used for
+        anything else. Returns a negative PCP error code on failure """
+    cdef c_pcp.pmValueBlock* vb
     cdef c_pcp.pmAtomValue atom
     cdef int status
-    cdef numpy.ndarray[double, ndim=1, mode="c"] tmp_data = numpy.empty(numval, dtype=numpy.float64)
-    tmp_data = tmp_data
-    for j in xrange(numval):
-        inst = res.vset[i].vlist[j].inst
-        status = c_pcp.pmExtractValue(res.vset[i].valfmt, &res.vset[i].vlist[j], c_pcp.PM_TYPE_64, &atom, c_pcp.PM_TYPE_64)
-        if status < 0:
-            raise pmapi.pmErr(status)
-        tmp_data[j] = <double>atom.ll
-    return tmp_data
+    cdef int64_t i64
+    cdef uint64_t u64
+    cdef double d
+    cdef float f
+
+    if valfmt == c_pcp.PM_VAL_INSITU:
+        if dtype == c_pcp.PM_TYPE_32:
+            out[0] = <double>(<int32_t>val.value.lval)
+            return 0
+        elif dtype == c_pcp.PM_TYPE_U32:
+            out[0] = <double>(<uint32_t>val.value.lval)
+            return 0
+    else:
+        vb = val.value.pval
+        # The values in a pmValueBlock are not aligned
+        if dtype == c_pcp.PM_TYPE_64 and vb.vlen == c_pcp.PM_VAL_HDR_SIZE + sizeof(int64_t):
+            memcpy(&i64, vb.vbuf, sizeof(int64_t))
+            out[0] = <double>i64
+            return 0
+        elif dtype == c_pcp.PM_TYPE_U64 and vb.vlen == c_pcp.PM_VAL_HDR_SIZE + sizeof(uint64_t):
+            memcpy(&u64, vb.vbuf, sizeof(uint64_t))
+            out[0] = <double>u64
+            return 0
+        elif dtype == c_pcp.PM_TYPE_DOUBLE and vb.vlen == c_pcp.PM_VAL_HDR_SIZE + sizeof(double):
+            memcpy(&d, vb.vbuf, sizeof(double))
+            out[0] = d
+            return 0
+        elif dtype == c_pcp.PM_TYPE_FLOAT and vb.vlen == c_pcp.PM_VAL_HDR_SIZE + sizeof(float):
+            memcpy(&f, vb.vbuf, sizeof(float))
+            out[0] = <double>f
+            return 0
+
+    status = c_pcp.pmExtractValue(valfmt, val, dtype, &atom, c_pcp.PM_TYPE_DOUBLE)
+    if status < 0:
+        return status
+    out[0] = atom.d
+    return 0
 
-cdef numpy.ndarray[double, ndim=1, mode="c"] uint64innerloop(int numval, c_pcp.pmResult* res, int i):
+cdef int decodevalueset(c_pcp.pmValueSet* vset, int dtype, double* out) except -1:
+    """ Convert all of the values in a value set to doubles """
     cdef Py_ssize_t j
-    cdef c_pcp.pmAtomValue atom
     cdef int status
-    cdef numpy.ndarray[double, ndim=1, mode="c"] tmp_data = numpy.empty(numval, dtype=numpy.float64)
-    tmp_data = tmp_data
-    for j in xrange(numval):
-        inst = res.vset[i].vlist[j].inst
-        status = c_pcp.pmExtractValue(res.vset[i].valfmt, &res.vset[i].vlist[j], c_pcp.PM_TYPE_U64, &atom, c_pcp.PM_TYPE_U64)
+    for j in xrange(vset.numval):
+        status = decodevalue(vset.valfmt, &vset.vlist[j], dtype, &out[j])
         if status < 0:
             raise pmapi.pmErr(status)
-        tmp_data[j] = <double>atom.ull
-    return tmp_data
+    return 0
 
-cdef numpy.ndarray[double, ndim=1, mode="c"] doubleinnerloop(int numval, c_pcp.pmResult* res, int i):
-    cdef Py_ssize_t j
-    cdef c_pcp.pmAtomValue atom
-    cdef int status
-    cdef numpy.ndarray[double, ndim=1, mode="c"] tmp_data = numpy.empty(numval, dtype=numpy.float64)
-    cdef double* tmp_datap = &tmp_data[0]
-    for j in xrange(numval):
-        inst = res.vset[i].vlist[j].inst
-        status = c_pcp.pmExtractValue(res.vset[i].valfmt, &res.vset[i].vlist[j], c_pcp.PM_TYPE_DOUBLE, &atom, c_pcp.PM_TYPE_DOUBLE)
-        if status < 0:
-            raise pmapi.pmErr(status)
-        tmp_datap[j] = atom.d
-    return tmp_data
+cdef object numericvalues(c_pcp.pmValueSet* vset, int dtype, numpy.ndarray[double, ndim=1, mode="c"] out):
+    """ Fill the output array with the values of a value set """
+    decodevalueset(vset, dtype, &out[0])
+    return out
 
-cdef numpy.ndarray[double, ndim=1, mode="c"] floatinnerloop(int numval, c_pcp.pmResult* res, int i):
+cdef bint sameinstances(c_pcp.pmValueSet* a, c_pcp.pmValueSet* b):
+    """ Whether two value sets have the values for the same instances in the same order """
     cdef Py_ssize_t j
-    cdef c_pcp.pmAtomValue atom
-    cdef int status
-    cdef numpy.ndarray[double, ndim=1, mode="c"] tmp_data = numpy.empty(numval, dtype=numpy.float64)
-    cdef double* tmp_datap = &tmp_data[0]
-    for j in xrange(numval):
-        inst = res.vset[i].vlist[j].inst
-        status = c_pcp.pmExtractValue(res.vset[i].valfmt, &res.vset[i].vlist[j], c_pcp.PM_TYPE_FLOAT, &atom, c_pcp.PM_TYPE_FLOAT)
-        if status < 0:
-            raise pmapi.pmErr(status)
-        tmp_datap[j] = atom.f
-    return tmp_data
+    if a.numval != b.numval:
+        return False
+    for j in xrange(a.numval):
+        if a.vlist[j].inst != b.vlist[j].inst:
+            return False
+    return True
+
+cdef class ValueBuffers:
+    """ Output arrays that extractValues reuses from one record to the next. The
+        data that are returned are views of these arrays so they are overwritten
+        by the next call """
+    cdef object block
+    cdef list rows
 
-# All numeric types return numpy.float64 (c double) arrays
-# Functions are seperated based on type to handle any quirks from converting to double
-cdef object extractValuesInnerLoop(Py_ssize_t numval, c_pcp.pmResult* res, int dtype, int i):
+    def __cinit__(self):
+        self.block = numpy.empty(0, dtype=numpy.float64)
+        self.rows = []
+
+    cdef object getblock(self, Py_ssize_t nrows, Py_ssize_t ncols):
+        """ contiguous 2-D array with nrows x ncols entries """
+        if self.block.shape[0] < nrows * ncols:
+            self.block = numpy.empty(nrows * ncols, dtype=numpy.float64)
+        return self.block[:nrows * ncols].reshape(nrows, ncols)
+
+    cdef object getrow(self, Py_ssize_t k, Py_ssize_t n):
+        """ 1-D array with n entries for the k'th metric """
+        while len(self.rows) <= k:
+            self.rows.append(numpy.empty(0, dtype=numpy.float64))
+        if self.rows[k].shape[0] < n:
+            self.rows[k] = numpy.empty(n, dtype=numpy.float64)
+        return self.rows[k][:n]
+
+cdef object extractValuesInnerLoop(Py_ssize_t numval, c_pcp.pmResult* res, int dtype, int i, ValueBuffers buffers, Py_ssize_t k):
     """extracts values and wraps them in numpy arrays"""
     if dtype == c_pcp.PM_TYPE_STRING:
         return strinnerloop(numval, res, i)
-    elif dtype == c_pcp.PM_TYPE_32:
-        return int32innerloop(numval, res, i)
-    elif dtype == c_pcp.PM_TYPE_U32:
-        return uint32innerloop(numval, res, i)
-    elif dtype == c_pcp.PM_TYPE_64:
-        return int64innerloop(numval, res, i)
-    elif dtype == c_pcp.PM_TYPE_U64:
-        return uint64innerloop(numval, res, i)
-    elif dtype == c_pcp.PM_TYPE_DOUBLE:
-        return doubleinnerloop(numval, res, i)
-    elif dtype == c_pcp.PM_TYPE_FLOAT:
-        return floatinnerloop(numval, res, i)
+    elif isnumeric(dtype):
+        # All numeric types return numpy.float64 (c double) arrays
+        if buffers is None:
+            out = numpy.empty(numval, dtype=numpy.float64)
+        else:
+            out = buffers.getrow(k, numval)
+        return numericvalues(res.vset[i], dtype, out)
     else: # Don't know how to handle data type
         return []
 
-cdef char* lookup(int val, int len, int* instlist, char** namelist):
-    cdef int i
-    for i in xrange(len):
-        if instlist[i] == val:
-            return namelist[i]
-    return NULL
+cdef class InDomCache:
+    """ Instance domain information for an archive context. The instance names
+        of an indom are read once and only read again when a record has an
+        instance that has not been seen before. The descriptions that the
+        extract functions return are reused for as long as the instances of a
+        metric do not change so they must not be modified """
+    cdef dict indoms
+    cdef dict names
+    cdef dict descriptions
 
-def extractValues(context, result, py_metric_id_array, mtypes, logerr):
+    def __cinit__(self):
+        self.indoms = {}
+        self.names = {}
+        self.descriptions = {}
+
+    cdef int lookupindom(self, c_pcp.pmID pmid, c_pcp.pmInDom* indom):
+        """ the indom of a metric. Returns a negative PCP error code on failure """
+        cdef c_pcp.pmDesc metric_desc
+        cdef int status
+        if pmid not in self.indoms:
+            status = c_pcp.pmLookupDesc(pmid, &metric_desc)
+            if status < 0:
+                return status
+            self.indoms[pmid] = metric_desc.indom
+        indom[0] = self.indoms[pmid]
+        return 0
+
+    cdef object loadnames(self, c_pcp.pmInDom indom):
+        """ read the instance names of an indom. None if they are not available """
+        cdef int* ivals
+        cdef char** inames
+        cdef int status
+        cdef Py_ssize_t j
+
+        names = None
+        status = c_pcp.pmGetInDom(indom, &ivals, &inames)
+        if status >= 0:
+            names = {}
+            for j in xrange(status):
+                names[ivals[j]] = inames[j].decode('utf8')
+            free(ivals)
+            free(inames)
+
+        self.names[indom] = names
+        return names
+
+    cdef object getnames(self, c_pcp.pmInDom indom, c_pcp.pmValueSet* vset):
+        """ dict of instance id to name for the indom. The names are read again if
+            the value set has an instance that is not known """
+        cdef Py_ssize_t j
+        if indom in self.names:
+            names = self.names[indom]
+            if names is None:
+                if indom == c_pcp.PM_INDOM_NULL:
+                    return None
+            else:
+                for j in xrange(vset.numval):
+                    if vset.vlist[j].inst not in names:
+                        break
+                else:
+                    return names
+        return self.loadnames(indom)
+
+    cdef object getdescription(self, c_pcp.pmID pmid, c_pcp.pmValueSet* vset):
+        """ the stored description of a metric or None if the instances in the value
+            set are not the same as when it was stored """
+        cdef int[::1] ids
+        cdef Py_ssize_t j
+        cached = self.descriptions.get(pmid)
+        if cached is None:
+            return None
+        ids = cached[0]
+        if ids.shape[0] != vset.numval:
+            return None
+        for j in xrange(vset.numval):
+            if ids[j] != vset.vlist[j].inst:
+                return None
+        return cached[1]
+
+    cdef void setdescription(self, c_pcp.pmID pmid, c_pcp.pmValueSet* vset, description):
+        """ store the description of a metric for the instances in the value set """
+        cdef Py_ssize_t j
+        cdef int[::1] ids = numpy.empty(vset.numval, dtype=numpy.intc)
+        for j in xrange(vset.numval):
+            ids[j] = vset.vlist[j].inst
+        self.descriptions[pmid] = (ids, description)
+
+def extractValues(context, result, py_metric_id_array, mtypes, logerr, indices=None, buffers=None, indoms=None):
     """
     returns data, description
+    if indices is set then only the listed entries of the result are extracted
+    (in the order given) otherwise all entries are extracted
     data is in format:  list (entry for each pmid)
                            |--> numpy array for pmid 0
                                    |--> inst 0 value
@@ -187,6 +281,14 @@ def extractValues(context, result, py_metric_id_array, mtypes, logerr):
                            |--> numpy array for pmid 1
                                    ...
 
+    if buffers (a ValueBuffers instance) is set then the numeric values are
+    written to its arrays and data contains views of them that are only valid
+    until the next call. If all of the entries have values for the same
+    instances then data is a single 2-D array (entry x instance).
+
+    indoms is the InDomCache for the context. The instance names are looked up
+    for every call if it is not set.
+
     description in format:   list (entry for each pmid)
                                 |--> tuple (for pmid 0)
                                         |--> numpy array (entry for each inst)
@@ -208,16 +310,17 @@ def extractValues(context, result, py_metric_id_array, mtypes, logerr):
     cdef c_pcp.pmResult* res = <c_pcp.pmResult*>buf.buf
     cdef int ninstances
     cdef int numpmid = res.numpmid
-    cdef Py_ssize_t i, j
+    cdef Py_ssize_t i, j, k
+    cdef Py_ssize_t numindices
     cdef int ctx = context._ctx
     cdef int status
-    cdef int* ivals
-    cdef char** inames
-    cdef char* name
-    cdef c_pcp.pmDesc metric_desc
-    cdef c_pcp.pmAtomValue atom
+    cdef int inst
+    cdef c_pcp.pmInDom indom
     cdef int dtype
     cdef int allempty = 1
+    cdef bint shared
+    cdef double[:, ::1] blockview
+    cdef ValueBuffers valuebuffers = buffers
 
     if numpmid < 0:
         logerr("negative number of pmid's")
@@ -230,7 +333,16 @@ def extractValues(context, result, py_metric_id_array, mtypes, logerr):
         metric_id_array[i] = py_metric_id_array[i] # Implicit py object to c data type conversion
     c_pcp.pmUseContext(ctx)
 
-    for i in xrange(numpmid):
+    if indices is None:
+        indices = range(numpmid)
+    numindices = len(indices)
+
+    # The values are only extracted once all of the entries are known to be
+    # present. The values are written to a single 2-D array if the entries
+    # share the instances
+    shared = buffers is not None and numindices > 0
+    for k in xrange(numindices):
+        i = indices[k]
         ninstances = res.vset[i].numval
         if ninstances == c_pcp.PM_ERR_VALUE:
             # Data missing at this timestep
@@ -240,55 +352,80 @@ def extractValues(context, result, py_metric_id_array, mtypes, logerr):
             logerr("pmError ({})".format(<bytes>c_pcp.pmErrStr(ninstances)))
             PyBuffer_Release(&buf)
             return None, None
-        # No instances, but there needs to be placeholders
-        elif ninstances == 0:
-            data.append(numpy.empty(0, dtype=numpy.float64))
+        if shared and (ninstances == 0 or not isnumeric(mtypes[i]) or not sameinstances(res.vset[indices[0]], res.vset[i])):
+            shared = False
+
+    if shared:
+        data = valuebuffers.getblock(numindices, res.vset[indices[0]].numval)
+        blockview = data
+        for k in xrange(numindices):
+            i = indices[k]
+            decodevalueset(res.vset[i], mtypes[i], &blockview[k, 0])
+    else:
+        for k in xrange(numindices):
+            i = indices[k]
+            ninstances = res.vset[i].numval
+            if ninstances == 0:
+                # No instances, but there needs to be placeholders
+                data.append(numpy.empty(0, dtype=numpy.float64))
+            else:
+                data.append(extractValuesInnerLoop(ninstances, res, mtypes[i], i, valuebuffers, k))
+                if isinstance(data[k], list):
+                    logerr("unkown data type on extraction")
+
+    cdef InDomCache cache = indoms if indoms is not None else InDomCache()
+
+    for k in xrange(numindices):
+        i = indices[k]
+        ninstances = res.vset[i].numval
+        if ninstances == 0:
             description.append([numpy.empty(0, dtype=numpy.int64), []])
-        else:
-            dtype = mtypes[i]
-            tmp_names = []
-            tmp_idx = numpy.empty(ninstances, dtype=int)
-
-            # extractValueInnerLoop does own looping
-            data.append(extractValuesInnerLoop(ninstances, res, dtype, i))
-            if len(data[i]) > 0:
-                allempty = 0
-            elif data[i] == []:
-                logerr("unkown data type on extraction")
-
-            status = c_pcp.pmLookupDesc(metric_id_array[i], &metric_desc)
-            if status < 0:
+            continue
+
+        if len(data[k]) > 0:
+            allempty = 0
+
+        desc = cache.getdescription(metric_id_array[i], res.vset[i])
+        if desc is not None:
+            description.append(desc)
+            continue
+
+        status = cache.lookupindom(metric_id_array[i], &indom)
+        if status < 0:
+            PyBuffer_Release(&buf)
+            return None, None
+
+        names = cache.getnames(indom, res.vset[i])
+        if names is None:
+            if len(data[k]) != 0: # Found data, so insert placeholder description
+                desc = [numpy.empty(0, dtype=numpy.int64), []]
+                cache.setdescription(metric_id_array[i], res.vset[i], desc)
+                description.append(desc)
+                continue
+            else:
                 PyBuffer_Release(&buf)
                 return None, None
-            status = c_pcp.pmGetInDom(metric_desc.indom, &ivals, &inames)
-            if status < 0:
-                if len(data[i]) != 0: # Found data, so insert placeholder description
-                    description.append([numpy.empty(0, dtype=numpy.int64), []])
-                else:
-                    PyBuffer_Release(&buf)
-                    return None, None
-            elif ninstances > status: # Missing a few indoms - try again
-                mem.add(ivals)
-                mem.add(inames)
-                PyBuffer_Release(&buf)
-                return True, True
-            else:
-                mem.add(ivals)
-                mem.add(inames)
-                for j in xrange(ninstances):
-                    if res.vset[i].vlist[j].inst == 4294967295:
-                        logerr("inst is -1")
-                        continue
-                    # TODO - find way to just look for one name not generate list then find it in list
-                    name = lookup(res.vset[i].vlist[j].inst, status, ivals, inames)
-                    if name == NULL:
-                        logerr("instance is not pcp archive")
-                        continue # Possibly add logging here
-                    tmp_names.append(name.decode('utf8'))
-                    tmp_idx[j] = res.vset[i].vlist[j].inst
-                        
-                description.append([tmp_idx, tmp_names])
+        elif ninstances > len(names): # Missing a few indoms - try again
+            PyBuffer_Release(&buf)
+            return True, True
 
+        tmp_names = []
+        tmp_idx = numpy.empty(ninstances, dtype=int)
+        for j in xrange(ninstances):
+            inst = res.vset[i].vlist[j].inst
+            if inst == -1:
+                logerr("inst is -1")
+                continue
+            name = names.get(inst)
+            if name is None:
+                logerr("instance is not pcp archive")
+                continue # Possibly add logging here
+            tmp_names.append(name)
+            tmp_idx[j] = inst
+
+        desc = [tmp_idx, tmp_names]
+        cache.setdescription(metric_id_array[i], res.vset[i], desc)
+        description.append(desc)
 
     PyBuffer_Release(&buf)
     if allempty:
@@ -296,9 +433,178 @@ def extractValues(context, result, py_metric_id_array, mtypes, logerr):
 
     return data, description
 
-def extractpreprocValues(context, result, py_metric_id_array, mtypes):
+cdef class BlockFetcher:
+    """ Reads consecutive archive records for a set of metrics into dense arrays.
+        A block ends after the requested number of records or when the instances
+        of a metric change, in which case the record starts the next block. The
+        records are handled as extractValues and the analytic callback loop do:
+        records with missing values are skipped and the data end at the first
+        record with no values or an error """
+    cdef object context
+    cdef object metric_id_array
+    cdef object mtypes
+    cdef object logerr
+    cdef InDomCache indoms
+    cdef object pending
+    cdef bint done
+
+    def __init__(self, context, metric_id_array, mtypes, logerr, indoms=None):
+        self.context = context
+        self.metric_id_array = metric_id_array
+        self.mtypes = mtypes
+        self.logerr = logerr
+        self.indoms = indoms if indoms is not None else InDomCache()
+        self.pending = None
+        self.done = False
+
+    cdef object nextresult(self):
+        """ the next record to process or None at the end of the archive """
+        if self.pending is not None:
+            result = self.pending
+            self.pending = None
+            return result
+        try:
+            return self.context.pmFetch(self.metric_id_array)
+        except pmapi.pmErr as exp:
+            if exp.args[0] == c_pmapi.PM_ERR_EOL:
+                self.done = True
+                return None
+            raise
+
+    cdef int checkrecord(self, c_pcp.pmResult* res, list ids):
+        """ 1 if the record can be added to the block, 0 if it should be skipped,
+            -1 if it starts a new block and -2 if the data end here """
+        cdef Py_ssize_t m, j
+        cdef int numval
+        cdef int[::1] mids
+        cdef int status = 1
+        cdef bint empty = True
+
+        for m in xrange(len(ids)):
+            numval = res.vset[m].numval
+            if numval == c_pcp.PM_ERR_VALUE:
+                return 0
+            elif numval < 0:
+                self.logerr("pmError ({})".format(<bytes>c_pcp.pmErrStr(numval)))
+                return -2
+            mids = ids[m]
+            if numval != mids.shape[0]:
+                status = -1
+            else:
+                for j in xrange(numval):
+                    if res.vset[m].vlist[j].inst != mids[j]:
+                        status = -1
+                        break
+            if numval > 0 and isnumeric(self.mtypes[m]):
+                empty = False
+
+        if empty:
+            return -2
+        return status
+
+    def close(self):
+        """ release the record that was read ahead """
+        if self.pending is not None:
+            self.context.pmFreeResult(self.pending)
+            self.pending = None
+
+    def fetch(self, Py_ssize_t maxrecords, windowend=None, nodeend=None):
+        """
+        returns timestamps, values, description for up to maxrecords records or
+        None if there are no more data
+        timestamps is a 1-D array with the time of each record
+        values is a 3-D array (record x metric x instance). Entries are NaN
+        where a metric has fewer instances than the others or is not numeric
+        description is in the format that extractValues returns
+        The records after nodeend are not read. The data end with the first
+        record at or after windowend.
+        """
+        cdef Py_buffer buf
+        cdef c_pcp.pmResult* res
+        cdef Py_ssize_t t = 0
+        cdef Py_ssize_t m, j
+        cdef Py_ssize_t nmetrics = len(self.metric_id_array)
+        cdef Py_ssize_t width
+        cdef int status
+        cdef int[::1] mids
+        cdef double[:, :, ::1] view
+        cdef double[::1] times
+
+        ids = None
+        values = None
+        description = None
+
+        while t < maxrecords and not self.done:
+            result = self.nextresult()
+            if result is None:
+                break
+
+            timestamp = float(result.contents.timestamp)
+            if nodeend is not None and timestamp > nodeend:
+                self.context.pmFreeResult(result)
+                self.done = True
+                break
+
+            PyObject_GetBuffer(result.contents, &buf, PyBUF_SIMPLE)
+            res = <c_pcp.pmResult*>buf.buf
+            try:
+                if t == 0:
+                    data, description = extractValues(self.context, result, self.metric_id_array, self.mtypes, self.logerr, None, None, self.indoms)
+                    if data is None:
+                        self.done = True
+                        continue
+                    elif data is True:
+                        self.logerr("missing indom")
+                        continue
+
+                    ids = []
+                    width = 1
+                    for m in xrange(nmetrics):
+                        mids = numpy.empty(res.vset[m].numval, dtype=numpy.intc)
+                        for j in xrange(res.vset[m].numval):
+                            mids[j] = res.vset[m].vlist[j].inst
+                        ids.append(mids)
+                        width = max(width, res.vset[m].numval)
+
+                    values = numpy.full((maxrecords, nmetrics, width), numpy.nan)
+                    view = values
+                    timestamps = numpy.empty(maxrecords, dtype=numpy.float64)
+                    times = timestamps
+                else:
+                    status = self.checkrecord(res, ids)
+                    if status == -2:
+                        self.done = True
+                        continue
+                    elif status == -1:
+                        self.pending = result
+                        result = None
+                        break
+                    elif status == 0:
+                        self.logerr("missing indom")
+                        continue
+
+                for m in xrange(nmetrics):
+                    if res.vset[m].numval > 0 and isnumeric(self.mtypes[m]):
+                        decodevalueset(res.vset[m], self.mtypes[m], &view[t, m, 0])
+                times[t] = timestamp
+                t += 1
+
+                if windowend is not None and timestamp >= windowend:
+                    self.done = True
+            finally:
+                PyBuffer_Release(&buf)
+                if result is not None:
+                    self.context.pmFreeResult(result)
+
+        if t == 0:
+            return None
+
+        return timestamps[:t], values[:t], description
+
+def extractpreprocValues(context, result, py_metric_id_array, mtypes, indices=None, indoms=None):
     """
     populate and return data, description from pcp archive for preproc's
+    if indices is set then only the listed entries of the result are extracted
     data is in format: list (entry for each pmid)
                         |--> list (entry for each instance)
                                 |--> list (pmid 0, instance 0)
@@ -317,6 +623,9 @@ def extractpreprocValues(context, result, py_metric_id_array, mtypes):
                             |--> dict (metric id 1)
                                     ...
                             ...
+
+    indoms is the InDomCache for the context. The dicts are shared between calls
+    if it is set so must not be modified.
     """
     data = []
     description = []
@@ -328,14 +637,14 @@ def extractpreprocValues(context, result, py_metric_id_array, mtypes):
     cdef int mid_len = len(py_metric_id_array)
     cdef int numpmid = res.numpmid
     cdef int ninstances
-    cdef Py_ssize_t i, j
+    cdef Py_ssize_t i, j, k
+    cdef Py_ssize_t numindices
     cdef int ctx = context._ctx
     cdef int status
-    cdef int* ivals
-    cdef char** inames
-    cdef c_pcp.pmDesc metric_desc
+    cdef c_pcp.pmInDom indom
     cdef c_pcp.pmAtomValue atom
     cdef int dtype
+    cdef InDomCache cache = indoms if indoms is not None else InDomCache()
 
     if mid_len < 0:
         PyBuffer_Release(&buf)
@@ -346,28 +655,28 @@ def extractpreprocValues(context, result, py_metric_id_array, mtypes):
     for i in xrange(mid_len):
         metric_id_array[i] = py_metric_id_array[i] # Implicit py object to c data type conversion
     c_pcp.pmUseContext(ctx)
-    
+
+    if indices is None:
+        indices = range(numpmid)
+    numindices = len(indices)
+
     # Initialize description
-    for i in xrange(mid_len):
-        c_pcp.pmLookupDesc(metric_id_array[i], &metric_desc)
-        if  metric_desc.indom == c_pcp.PM_INDOM_NULL: # Missing indom - skip
+    for k in xrange(numindices):
+        i = indices[k]
+        status = cache.lookupindom(metric_id_array[i], &indom)
+        if status < 0 or indom == c_pcp.PM_INDOM_NULL: # Missing indom - skip
             description.append({})
             continue
-        status = c_pcp.pmGetInDom(metric_desc.indom, &ivals, &inames)
-        if status <= 0:
+        names = cache.getnames(indom, res.vset[i])
+        if names is None:
             description.append({})
         else:
-            mem.add(ivals)
-            mem.add(inames)
-            tmp_dict = dict()
-            for j in xrange(status):
-                tmp_dict[ivals[j]] = str(inames[j], 'utf-8')
-            description.append(tmp_dict)
+            description.append(names)
 
     # Initialize data
-    for i in xrange(numpmid):
+    for k in xrange(numindices):
+        i = indices[k]
         ninstances = res.vset[i].numval
-        c_pcp.pmLookupDesc(metric_id_array[i], &metric_desc)
 
         tmp_data = []
         dtype = mtypes[i]
@@ -383,6 +692,24 @@ def extractpreprocValues(context, result, py_metric_id_array, mtypes):
     PyBuffer_Release(&buf)
     return numpy.array(data), description
 
+def hasvalues(result, indices):
+    """ returns whether the result contains any values (or errors) for the listed entries.
+        Used when several analytics share a fetch to skip records that only have
+        data for other analytics """
+    cdef Py_buffer buf
+    PyObject_GetBuffer(result.contents, &buf, PyBUF_SIMPLE)
+    cdef c_pcp.pmResult* res = <c_pcp.pmResult*>buf.buf
+    cdef Py_ssize_t i
+    cdef int found = 0
+
+    for i in indices:
+        if i < res.numpmid and res.vset[i].numval != 0:
+            found = 1
+            break
+
+    PyBuffer_Release(&buf)
+    return found == 1
+
 def loadrequiredmetrics(context, requiredMetrics):
     """ required metrics are those that must be present for the analytic to be run """
     mem = Pool()
@@ -1,19 +1,22 @@
 import os
+import math
+import calendar
 import shutil
 import time
 import logging
 import datetime
 
-from supremm.datasource.datasource import Datasource
-from supremm.datasource.pcp.pcparchive import extract_and_merge_logs
+from supremm.datasource.datasource import Datasource, JobMeta
+from supremm.datasource.pcp.pcparchive import extract_and_merge_logs, releasejobdir
 from supremm.datasource.pcp.pcpsummarize import PCPSummarize
 from supremm.errors import ProcessingError
+from supremm.plugin import mergeable, windowmergeable
 
 class PCPDatasource(Datasource):
     """ Instance of a PCP datasource class """
 
-    def __init__(self, preprocs, plugins):
-        super().__init__(preprocs, plugins)
+    def __init__(self, preprocs, plugins, resconf=None):
+        super().__init__(preprocs, plugins, resconf)
 
     def presummarize(self, job, conf, resconf, opts):
         jobmeta = super().presummarize(job, conf, resconf, opts)
@@ -54,15 +57,132 @@ class PCPDatasource(Datasource):
     def summarizejob(self, job, jobmeta, conf, opts):
         preprocessors, analytics = super().summarizejob(job, jobmeta, conf, opts)
 
-        s = PCPSummarize(preprocessors, analytics, job, conf, opts["fail_fast"])
+        s = PCPSummarize(preprocessors, analytics, job, conf, opts["fail_fast"], opts["fused_scan"], direct=opts["direct_read"], sampleinterval=opts["sample_interval"], deadline=self.jobdeadline())
 
-        enough_nodes = False
+        enough_nodes = self.enoughnodes(job, jobmeta)
 
-        if 0 == jobmeta.result or (job.nodecount !=0 and (jobmeta.missingnodes / job.nodecount < 0.05)):
-            enough_nodes = True
+        if enough_nodes:
             logging.info("Success for %s files in %s (%s/%s)", job.job_id, job.jobdir, jobmeta.missingnodes, job.nodecount)
             s.process()
-        elif jobmeta.error == None and job.nodecount != 0 and (jobmeta.missingnodes / job.nodecount >= 0.5):
+
+        return self.summaryresult(s, job, jobmeta, enough_nodes, opts)
+
+    def shardjob(self, job, conf, resconf, opts):
+        """ Split a job with many nodes into shards of contiguous nodes or a job
+            with a very long walltime into consecutive time windows. The job is
+            only split if all of the plugins support merging and it passes the checks
+            that are done before the archives are extracted. Each shard chooses its
+            own archive directory when it is extracted in the worker """
+
+        if opts['extractonly']:
+            return []
+
+        nodespershard = opts['node_parallel']
+        windowtime = opts['time_parallel']
+
+        if nodespershard > 0 and job.nodecount > nodespershard:
+            bywindow = False
+            nshards = min(opts['threads'], int(math.ceil(float(job.nodecount) / nodespershard)))
+            supported = mergeable
+        elif windowtime > 0 and job.walltime > windowtime:
+            bywindow = True
+            nshards = min(opts['threads'], int(math.ceil(float(job.walltime) / windowtime)))
+            supported = windowmergeable
+        else:
+            return []
+
+        if nshards < 2:
+            return []
+
+        notmergeable = [x.__name__ for x in self.allpreprocs + self.allplugins if not supported(x)]
+        if notmergeable:
+            logging.debug("Not splitting %s, no merge support in %s", job.job_id, ",".join(notmergeable))
+            return []
+
+        jobmeta = super().presummarize(job, conf, resconf, opts)
+        if jobmeta.result != 0 or not job.has_any_archives() or not job.has_enough_raw_archives():
+            # Summarize the job as normal so that the skip is recorded
+            return []
+
+        if bywindow:
+            logging.info("Splitting %s into %s time windows", job.job_id, nshards)
+            # The window boundaries are whole seconds to match the precision of the pmlogextract time bounds
+            bounds = [None] + [job.start_datetime + datetime.timedelta(seconds=(i * job.walltime) // nshards) for i in range(1, nshards)] + [None]
+            shards = [job.getwindow(i, bounds[i], bounds[i + 1]) for i in range(nshards)]
+        else:
+            logging.info("Splitting %s into %s shards", job.job_id, nshards)
+            nodenames = list(job.nodenames())
+            shardsize = int(math.ceil(float(len(nodenames)) / nshards))
+            shards = [job.getshard(i, nodenames[i * shardsize:(i + 1) * shardsize]) for i in range(nshards) if i * shardsize < len(nodenames)]
+
+        return shards
+
+    def summarizeshard(self, shard, conf, resconf, opts):
+        mergestart = time.time()
+
+        jobmeta = JobMeta()
+        jobmeta.result = extract_and_merge_logs(shard, conf, resconf, opts)
+        jobmeta.missingnodes = -1.0 * jobmeta.result
+        jobmeta.mdata["mergetime"] = time.time() - mergestart
+
+        preprocessors, analytics = super().summarizejob(shard, jobmeta, conf, opts)
+
+        windowend = None
+        if shard.windowend is not None:
+            windowend = calendar.timegm(shard.windowend.utctimetuple())
+
+        s = PCPSummarize(preprocessors, analytics, shard, conf, opts["fail_fast"], opts["fused_scan"], windowend, opts["direct_read"], opts["sample_interval"], self.jobdeadline())
+        s.process()
+
+        return s, jobmeta
+
+    def mergeshards(self, job, shardresults, conf, opts):
+        jobmeta = JobMeta()
+        jobmeta.mdata["mergetime"] = 0.0
+
+        # The plugins expect the nodes to be processed in order
+        shardresults = sorted(shardresults, key=lambda x: x[0].shardid)
+
+        # A node is missing from a job that was split by time if its
+        # archives are missing for any of the time windows
+        bywindow = any(shard.windowend is not None for shard, _ in shardresults)
+
+        for shard, (_, shardmeta) in shardresults:
+            job.mergeshard(shard)
+            if bywindow and jobmeta.result <= 0 and shardmeta.result <= 0:
+                jobmeta.result = min(jobmeta.result, shardmeta.result)
+            else:
+                jobmeta.result += shardmeta.result
+            jobmeta.mdata["mergetime"] = max(jobmeta.mdata["mergetime"], shardmeta.mdata["mergetime"])
+
+        jobmeta.missingnodes = -1.0 * jobmeta.result
+
+        preprocessors, analytics = super().summarizejob(job, jobmeta, conf, opts)
+
+        s = PCPSummarize(preprocessors, analytics, job, conf, opts["fail_fast"], opts["fused_scan"], sampleinterval=opts["sample_interval"])
+
+        enough_nodes = self.enoughnodes(job, jobmeta)
+
+        if enough_nodes:
+            logging.info("Success for %s files in %s (%s/%s)", job.job_id, job.jobdir, jobmeta.missingnodes, job.nodecount)
+            for _, (shardsummary, _) in shardresults:
+                if bywindow:
+                    s.mergewindow(shardsummary)
+                else:
+                    s.merge(shardsummary)
+
+        return self.summaryresult(s, job, jobmeta, enough_nodes, opts)
+
+    @staticmethod
+    def enoughnodes(job, jobmeta):
+        """ Whether enough of the node archives were extracted to summarize the job """
+        return 0 == jobmeta.result or (job.nodecount != 0 and (jobmeta.missingnodes / job.nodecount < 0.05))
+
+    @staticmethod
+    def summaryresult(s, job, jobmeta, enough_nodes, opts):
+        """ Set the job metadata based on the summarization outcome """
+
+        if not enough_nodes and jobmeta.error == None and job.nodecount != 0 and (jobmeta.missingnodes / job.nodecount >= 0.5):
             # Don't overwrite existing error
             # Don't have enough node data to even try summarization
             jobmeta.mdata["skipped_pmlogextract_error"] = True
@@ -93,6 +213,12 @@ class PCPDatasource(Datasource):
         return s, jobmeta.mdata, success or force_success, jobmeta.error
 
     def cleanup(self, opts, job):
-        if opts['dodelete'] and job.jobdir is not None and os.path.exists(job.jobdir):
+        if opts['dodelete']:
             # Clean up
-            shutil.rmtree(job.jobdir, ignore_errors=True)
+            for jobdir, _ in job.shardjobdirs:
+                if os.path.exists(jobdir):
+                    shutil.rmtree(jobdir, ignore_errors=True)
+            if job.jobdir is not None and os.path.exists(job.jobdir):
+                shutil.rmtree(job.jobdir, ignore_errors=True)
+
+        releasejobdir(job)
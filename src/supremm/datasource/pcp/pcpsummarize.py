@@ -2,6 +2,7 @@
 """ Summarize module for PCP datasource """
 
 import datetime
+import calendar
 
 from ctypes import c_uint
 from pcp import pmapi
@@ -9,15 +10,22 @@ import cpmapi as c_pmapi
 import time
 import logging
 import traceback
-from supremm.plugin import NodeMetadata
+from supremm.plugin import NodeMetadata, blockprocessing
 from supremm.rangechange import RangeChange, DataCache
 from supremm.summarize import Summarize
+from supremm.deadline import SAMPLED, TRUNCATED
 from supremm.datasource.pcp.pcpcinterface import pcpcinterface
+from supremm.datasource.pcp.metriccache import MetricResolutionCache, pmnssignature
 
 import numpy
 import copy
 
 
+def totimeval(seconds):
+    """ convert a time in seconds since the epoch to a timeval """
+    sec = int(seconds)
+    return pmapi.timeval(sec, int((seconds - sec) * 1000000))
+
 class ArchiveMeta(NodeMetadata):
     """ container for achive metadata """
     def __init__(self, nodename, nodeidx, archivedata):
@@ -29,24 +37,58 @@ class ArchiveMeta(NodeMetadata):
     nodeindex = property(lambda self: self._nodeidx)
     archive = property(lambda self: self._archivedata)
 
+# The metrics that the plugins resolved to, shared by all of the jobs that are
+# processed by this process
+METRIC_CACHE = MetricResolutionCache()
+
 class PCPSummarize(Summarize):
     """
     Summarize class is responsible for iteracting with the pmapi python code
     and managing the calls to the various analytics to process the data
     """
 
-    def __init__(self, preprocessors, analytics, job, config, fail_fast=False):
+    # Maximum number of datapoints passed to process_block() in one call
+    BLOCK_SIZE = 512
+
+    def __init__(self, preprocessors, analytics, job, config, fail_fast=False, fused=False, windowend=None, direct=False, sampleinterval=None, deadline=None):
         super().__init__(preprocessors, analytics, job, config, fail_fast)
         self.start = time.time()
         self.archives_processed = 0
+        self.windows_merged = 0
+        self.config = config
         self.rangechange = RangeChange(config)
+        self.fused = fused
+        # When set only the data before this time (seconds since the epoch) are
+        # processed. The analytics also see the first datapoint after the window
+        # end since it is shared with the start of the following window.
+        self.windowend = windowend
+        # When set the node archives are the raw archives rather than ones that
+        # were extracted for the job, so the data are limited to the node begin
+        # and end times here. nodeend is the end time for the current node.
+        self.direct = direct
+        self.nodeend = None
+        # When set the archives are read in interpolated mode with one record
+        # every sampleinterval seconds rather than every logged record
+        self.sampleinterval = sampleinterval
+        self.deadline = deadline
+        # Reusable output arrays for the analytics that accept views of them
+        self.valuebuffers = {}
+        # Instance domain information for the archive that is being processed
+        self.indomcache = None
+        # Metric namespace signature of the archive that is being processed
+        self.signature = None
 
     def process(self):
         """ Main entry point. All archives are processed """
         success = 0
         self.archives_processed = 0
+        self.valuebuffers = {}
 
         for nodename, nodeidx, archive in self.job.nodearchives():
+            self.checkdeadline()
+            if self.skipnode(nodeidx):
+                self.skippednode()
+                continue
             try:
                 self.processarchive(nodename, nodeidx, archive)
                 self.archives_processed += 1
@@ -61,8 +103,34 @@ class PCPSummarize(Summarize):
                 if self.fail_fast:
                     raise
 
+        # The buffers and indom cache are not kept with the results
+        self.valuebuffers = {}
+        self.indomcache = None
+        self.signature = None
+
         return success == 0
 
+    def merge(self, other):
+        """ Combine the results from a summarization of another subset of the job's nodes """
+        super().merge(other)
+        self.archives_processed += other.archives_processed
+
+    def mergewindow(self, other):
+        """ Combine the results from a summarization of the following time window of the job """
+        super().mergewindow(other)
+        # Each node archive is processed once per time window
+        if self.windows_merged == 0 or other.archives_processed < self.archives_processed:
+            self.archives_processed = other.archives_processed
+        self.windows_merged += 1
+
+    def pastwindow(self, result):
+        """ Whether a fetched record is at or after the end of the time window """
+        return self.windowend is not None and float(result.contents.timestamp) >= self.windowend
+
+    def pastend(self, result):
+        """ Whether a fetched record is after the end of the job on the node """
+        return self.nodeend is not None and float(result.contents.timestamp) > self.nodeend
+
     def complete(self):
         """ A job is complete if archives exist for all assigned nodes and they have
             been processed sucessfullly
@@ -71,9 +139,11 @@ class PCPSummarize(Summarize):
 
     def good_enough(self):
         """ A job is good_enough if archives for 95% of nodes have
-            been processed sucessfullly
+            been processed sucessfullly. The nodes that were left out by the node
+            stride because the job was over its time budget are counted too, the
+            ones that were dropped when the summarization was truncated are not
         """
-        return self.archives_processed >= 0.95 * float(self.job.nodecount)
+        return self.archives_processed + self.nodes_subsampled >= 0.95 * float(self.job.nodecount)
 
     def get(self):
         """ Return a dict with the summary information """
@@ -85,15 +155,15 @@ class PCPSummarize(Summarize):
             self.adderror("job", je)
 
         if self.job.nodecount > 0:
-            for analytic in self.alltimestamps:
+            for analytic in self.running(self.alltimestamps):
                 if analytic.status != "uninitialized":
                     if analytic.mode == "all":
-                        output[analytic.name] = analytic.results()
+                        output[analytic.name] = self.results(analytic)
                     if analytic.mode == "timeseries":
-                        timeseries[analytic.name] = analytic.results()
-            for analytic in self.firstlast:
+                        timeseries[analytic.name] = self.results(analytic)
+            for analytic in self.running(self.firstlast):
                 if analytic.status != "uninitialized":
-                    output[analytic.name] = analytic.results()
+                    output[analytic.name] = self.results(analytic)
 
         output['summarization'] = {
             "version": self.version,
@@ -103,6 +173,8 @@ class PCPSummarize(Summarize):
             "complete": self.complete(),
             "datasource": "pcp"
         }
+        self.adddegradations(output['summarization'])
+        self.addsampling(output['summarization'])
 
         output['created'] = datetime.datetime.utcnow()
 
@@ -130,12 +202,22 @@ class PCPSummarize(Summarize):
 
         return output
 
-    def runcallback(self, analytic, result, mtypes, ctx, mdata, metric_id_array):
+    def runcallback(self, analytic, result, mtypes, ctx, mdata, metric_id_array, indices=None, rangechange=None):
         """ get the data and call the analytic """
 
+        if rangechange is None:
+            rangechange = self.rangechange
+
         def logerr(err):
             self.logerror(mdata.nodename, analytic.name, err)
-        data, description = pcpcinterface.extractValues(ctx, result, metric_id_array, mtypes, logerr)
+
+        buffers = None
+        if analytic.zerocopy:
+            if analytic.name not in self.valuebuffers:
+                self.valuebuffers[analytic.name] = pcpcinterface.ValueBuffers()
+            buffers = self.valuebuffers[analytic.name]
+
+        data, description = pcpcinterface.extractValues(ctx, result, metric_id_array, mtypes, logerr, indices, buffers, self.indomcache)
 
         if data is None and description is None:
             return False
@@ -145,7 +227,7 @@ class PCPSummarize(Summarize):
             return True
 
         try:
-            self.rangechange.normalise_data(float(result.contents.timestamp), data)
+            rangechange.normalise_data(float(result.contents.timestamp), data)
             retval = analytic.process(mdata, float(result.contents.timestamp), data, description)
             return retval
         except Exception as e:
@@ -153,10 +235,10 @@ class PCPSummarize(Summarize):
             self.logerror(mdata.nodename, analytic.name, str(e))
             return False
 
-    def runpreproccall(self, preproc, result, mtypes, ctx, mdata, metric_id_array):
+    def runpreproccall(self, preproc, result, mtypes, ctx, mdata, metric_id_array, indices=None):
         """ Call the pre-processor data processing function """
 
-        data, description = pcpcinterface.extractpreprocValues(ctx, result, metric_id_array, mtypes)
+        data, description = pcpcinterface.extractpreprocValues(ctx, result, metric_id_array, mtypes, indices, self.indomcache)
 
         if data is None and description is None:
             return False
@@ -169,7 +251,7 @@ class PCPSummarize(Summarize):
 
         preproc.hoststart(mdata.nodename)
 
-        metric_id_array, metricnames = pcpcinterface.getmetricstofetch(ctx, preproc)
+        metric_id_array, metricnames, mtypes = self.getmetricstofetch(ctx, preproc)
 
         # Range correction is not performed for the pre-processors. They always
         # see the original data
@@ -180,18 +262,21 @@ class PCPSummarize(Summarize):
             preproc.hostend()
             return
 
-        mtypes = pcpcinterface.getmetrictypes(ctx, metric_id_array)
-
         done = False
 
         while not done:
             try:
                 result = ctx.pmFetch(metric_id_array)
 
-                if False == self.runpreproccall(preproc, result, mtypes, ctx, mdata, metric_id_array):
+                if self.pastend(result) or self.pastwindow(result):
+                    # The remaining data are after the job or belong to the next time window
+                    done = True
+                elif False == self.runpreproccall(preproc, result, mtypes, ctx, mdata, metric_id_array):
                     # A return value of false from process indicates the computation
                     # failed and no more data should be sent.
                     done = True
+                elif self.overbudget(ctx, float(result.contents.timestamp)):
+                    done = True
 
                 ctx.pmFreeResult(result)
 
@@ -215,7 +300,7 @@ class PCPSummarize(Summarize):
         """ fetch the data from the archive, reformat as a python data structure
         and call the analytic process function """
 
-        metric_id_array, metricnames = pcpcinterface.getmetricstofetch(ctx, analytic)
+        metric_id_array, metricnames, mtypes = self.getmetricstofetch(ctx, analytic)
 
         if len(metric_id_array) == 0:
             logging.debug("Skipping %s (%s)" % (type(analytic).__name__, analytic.name))
@@ -223,7 +308,10 @@ class PCPSummarize(Summarize):
 
         self.rangechange.set_fetched_metrics(metricnames)
 
-        mtypes = pcpcinterface.getmetrictypes(ctx, metric_id_array)
+        if blockprocessing(analytic):
+            self.processblocks(ctx, mdata, analytic, metric_id_array, mtypes)
+            analytic.status = "complete"
+            return
 
         done = False
 
@@ -232,10 +320,16 @@ class PCPSummarize(Summarize):
             try:
                 result = ctx.pmFetch(metric_id_array)
 
-                if False == self.runcallback(analytic, result, mtypes, ctx, mdata, metric_id_array):
+                if self.pastend(result):
+                    done = True
+                elif False == self.runcallback(analytic, result, mtypes, ctx, mdata, metric_id_array):
                     # A return value of false from process indicates the computation
                     # failed and no more data should be sent.
                     done = True
+                elif self.pastwindow(result):
+                    done = True
+                elif self.overbudget(ctx, float(result.contents.timestamp)) or analytic.name in self.skipped:
+                    done = True
 
             except pmapi.pmErr as exp:
                 if exp.args[0] == c_pmapi.PM_ERR_EOL:
@@ -250,6 +344,223 @@ class PCPSummarize(Summarize):
 
         analytic.status = "complete"
 
+    def processblocks(self, ctx, mdata, analytic, metric_id_array, mtypes):
+        """ fetch the data from the archive in blocks of consecutive records and
+        call the analytic process_block function """
+
+        def logerr(err):
+            self.logerror(mdata.nodename, analytic.name, err)
+
+        fetcher = pcpcinterface.BlockFetcher(ctx, metric_id_array, mtypes, logerr, self.indomcache)
+        try:
+            while True:
+                block = fetcher.fetch(self.BLOCK_SIZE, self.windowend, self.nodeend)
+                if block is None:
+                    break
+
+                timestamps, values, description = block
+                try:
+                    self.rangechange.normalise_block(values, description)
+                    retval = analytic.process_block(mdata, timestamps, values, description)
+                except Exception as e:
+                    logging.exception("%s %s @ %s", self.job.job_id, analytic.name, timestamps[0])
+                    self.logerror(mdata.nodename, analytic.name, str(e))
+                    break
+
+                if retval == False:
+                    # A return value of false from process indicates the computation
+                    # failed and no more data should be sent.
+                    break
+
+                if self.overbudget(ctx, float(timestamps[-1])) or analytic.name in self.skipped:
+                    break
+        except pmapi.pmErr as exp:
+            logging.warning("%s (%s) raised exception %s", type(analytic).__name__, analytic.name, str(exp))
+            analytic.status = "failure"
+            raise exp
+        finally:
+            fetcher.close()
+
+    def getfusedmetrics(self, ctx, analytics):
+        """ build the union of the metrics needed by the list of analytics so that
+        they can all be served by a single pass through the archive. Returns the
+        metric id array to fetch, the metric types and, for each analytic, either
+        None (if its metrics are not available) or a tuple of the indices of its
+        metrics in the fetched result and the metric names """
+
+        pmids = []
+        mtypes = []
+        position = {}
+        selections = []
+
+        for analytic in analytics:
+            metric_id_array, metricnames, metrictypes = self.getmetricstofetch(ctx, analytic)
+            if len(metric_id_array) == 0:
+                selections.append(None)
+                continue
+
+            indices = []
+            for pmid, mtype in zip(metric_id_array, metrictypes):
+                if pmid not in position:
+                    position[pmid] = len(pmids)
+                    pmids.append(pmid)
+                    mtypes.append(mtype)
+                indices.append(position[pmid])
+            selections.append((indices, metricnames))
+
+        metricarray = (c_uint * len(pmids))()
+        for i, pmid in enumerate(pmids):
+            metricarray[i] = pmid
+
+        return metricarray, mtypes, selections
+
+    def processfusedpreprocs(self, ctx, mdata):
+        """ single pass through the archive that calls all of the pre-processors
+        for each fetched record """
+
+        for preproc in self.preprocs:
+            preproc.hoststart(mdata.nodename)
+
+        # Range correction is not performed for the pre-processors
+        self.rangechange.set_fetched_metrics([])
+
+        metric_id_array, mtypes, selections = self.getfusedmetrics(ctx, self.preprocs)
+
+        active = []
+        for preproc, selection in zip(self.preprocs, selections):
+            if selection is None:
+                logging.debug("Skipping %s (%s)" % (type(preproc).__name__, preproc.name))
+                preproc.hostend()
+            else:
+                active.append((preproc, selection[0]))
+
+        if len(active) == 0:
+            return
+
+        while len(active) > 0:
+            result = None
+            try:
+                result = ctx.pmFetch(metric_id_array)
+
+                if self.pastend(result) or self.pastwindow(result):
+                    # The remaining data are after the job or belong to the next time window
+                    break
+
+                stillactive = []
+                for preproc, indices in active:
+                    if not pcpcinterface.hasvalues(result, indices):
+                        # record only contains data for the other pre-processors
+                        stillactive.append((preproc, indices))
+                    elif False == self.runpreproccall(preproc, result, mtypes, ctx, mdata, metric_id_array, indices):
+                        preproc.status = "complete"
+                        preproc.hostend()
+                    else:
+                        stillactive.append((preproc, indices))
+                active = stillactive
+
+                if self.overbudget(ctx, float(result.contents.timestamp)):
+                    break
+
+            except pmapi.pmErr as exp:
+                if exp.args[0] == c_pmapi.PM_ERR_EOL:
+                    break
+                for preproc, _ in active:
+                    preproc.status = "failure"
+                    preproc.hostend()
+                raise exp
+            except Exception as exp:
+                for preproc, _ in active:
+                    preproc.status = "failure"
+                    preproc.hostend()
+                raise exp
+            finally:
+                if result != None:
+                    ctx.pmFreeResult(result)
+
+        for preproc, _ in active:
+            preproc.status = "complete"
+            preproc.hostend()
+
+    def processfusedanalytics(self, ctx, mdata):
+        """ single pass through the archive that calls all of the analytics that
+        need every timestamp. Each analytic has its own range change state since the
+        normalization is done in-place on the extracted data """
+
+        analytics = [x for x in self.running(self.alltimestamps) if not blockprocessing(x)]
+        metric_id_array, mtypes, selections = self.getfusedmetrics(ctx, analytics)
+
+        active = []
+        for analytic, selection in zip(analytics, selections):
+            if selection is None:
+                logging.debug("Skipping %s (%s)" % (type(analytic).__name__, analytic.name))
+                continue
+            indices, metricnames = selection
+            rangechange = RangeChange(self.config)
+            rangechange.set_fetched_metrics(metricnames)
+            active.append((analytic, indices, rangechange))
+
+        if len(active) == 0:
+            return
+
+        processed = [x[0] for x in active]
+
+        while len(active) > 0:
+            result = None
+            try:
+                result = ctx.pmFetch(metric_id_array)
+                if self.pastend(result):
+                    break
+                pastwindow = self.pastwindow(result)
+
+                stillactive = []
+                for analytic, indices, rangechange in active:
+                    if not pcpcinterface.hasvalues(result, indices):
+                        # record only contains data for the other analytics
+                        stillactive.append((analytic, indices, rangechange))
+                    elif False != self.runcallback(analytic, result, mtypes, ctx, mdata, metric_id_array, indices, rangechange) and not pastwindow:
+                        stillactive.append((analytic, indices, rangechange))
+
+                if self.overbudget(ctx, float(result.contents.timestamp)):
+                    break
+                active = [x for x in stillactive if x[0].name not in self.skipped]
+
+            except pmapi.pmErr as exp:
+                if exp.args[0] == c_pmapi.PM_ERR_EOL:
+                    break
+                for analytic, _, _ in active:
+                    logging.warning("%s (%s) raised exception %s", type(analytic).__name__, analytic.name, str(exp))
+                    analytic.status = "failure"
+                raise exp
+            finally:
+                if result != None:
+                    ctx.pmFreeResult(result)
+
+        for analytic in processed:
+            analytic.status = "complete"
+
+    def getmetricstofetch(self, ctx, analytic):
+        """ returns the metric id array, metric names and metric types for the
+        analytic. The metrics are looked up once for all the archives with the same
+        metric namespace. The analytics with derived metrics are always looked up
+        since the derived metrics are registered with each context """
+
+        cacheable = self.signature is not None and len(analytic.derivedMetrics) == 0
+
+        resolution = METRIC_CACHE.get(self.signature, analytic) if cacheable else None
+        if resolution is not None:
+            pmids, metricnames, mtypes = resolution
+            return (c_uint * len(pmids))(*pmids), list(metricnames), list(mtypes)
+
+        metric_id_array, metricnames = pcpcinterface.getmetricstofetch(ctx, analytic)
+        mtypes = []
+        if len(metric_id_array) > 0:
+            mtypes = pcpcinterface.getmetrictypes(ctx, metric_id_array)
+
+        if cacheable:
+            METRIC_CACHE.store(self.signature, analytic, metric_id_array, metricnames, mtypes)
+
+        return metric_id_array, metricnames, mtypes
+
     def logerror(self, archive, analyticname, pmerrorcode):
         """
         Store the detail of archive processing errors
@@ -262,17 +573,19 @@ class PCPSummarize(Summarize):
         """ fetch the data from the archive, reformat as a python data structure
         and call the analytic process function """
 
-        metric_id_array, metricnames = pcpcinterface.getmetricstofetch(ctx, analytic)
+        metric_id_array, metricnames, mtypes = self.getmetricstofetch(ctx, analytic)
 
         if len(metric_id_array) == 0:
             return
 
         self.rangechange.set_fetched_metrics(metricnames)
 
-        mtypes = pcpcinterface.getmetrictypes(ctx, metric_id_array)
-
         try:
             result = ctx.pmFetch(metric_id_array)
+            if self.pastend(result):
+                # No data for these metrics during the job
+                ctx.pmFreeResult(result)
+                return
             firstimestamp = copy.deepcopy(result.contents.timestamp)
 
             if False == self.runcallback(analytic, result, mtypes, ctx, mdata, metric_id_array):
@@ -283,17 +596,38 @@ class PCPSummarize(Summarize):
             ctx.pmFreeResult(result)
             result = None
 
-            if self.rangechange.passthrough == False:
+            if self.rangechange.passthrough == False and self.rangechange.wrapperiod() is not None:
+                # the counters can only wrap once between records that are closer together
+                # than the wrap period so only a subset of the timestamps are needed
+                datacache = DataCache()
+                try:
+                    self.fetchstrided(ctx, mdata, metric_id_array, mtypes, datacache, firstimestamp)
+                except pmapi.pmErr as exp:
+                    logging.warning("%s (%s) raised exception %s", type(analytic).__name__, analytic.name, str(exp))
+                    analytic.status = "failure"
+                    raise exp
+
+                if False == datacache.docallback(analytic):
+                    analytic.status = "failure"
+                    return
+
+            elif self.rangechange.passthrough == False:
                 # need to process every timestamp and only pass the last one to the plugin
                 done = False
                 datacache = DataCache()
                 while not done:
                     try:
                         result = ctx.pmFetch(metric_id_array)
-                        if False == self.runcallback(datacache, result, mtypes, ctx, mdata, metric_id_array):
+                        if self.pastend(result):
+                            done = True
+                        elif False == self.runcallback(datacache, result, mtypes, ctx, mdata, metric_id_array):
                             # A return value of false from process indicates the computation
                             # failed and no more data should be sent.
                             done = True
+                        elif self.pastwindow(result):
+                            done = True
+                        elif self.overbudget(ctx, float(result.contents.timestamp)):
+                            done = True
                     except pmapi.pmErr as exp:
                         if exp.args[0] == c_pmapi.PM_ERR_EOL:
                             done = True
@@ -311,9 +645,7 @@ class PCPSummarize(Summarize):
                     return
 
             else:
-                ctx.pmSetMode(c_pmapi.PM_MODE_BACK, ctx.pmGetArchiveEnd(), 0)
-
-                result = ctx.pmFetch(metric_id_array)
+                result = self.fetchlast(ctx, metric_id_array)
 
                 if result.contents.timestamp.tv_sec == firstimestamp.tv_sec and result.contents.timestamp.tv_usec == firstimestamp.tv_usec:
                     # This achive must only contain one data point for these metrics
@@ -340,22 +672,161 @@ class PCPSummarize(Summarize):
                 logging.exception("%s", analytic.name)
                 raise e
 
+    def fetchstrided(self, ctx, mdata, metric_id_array, mtypes, datacache, firstimestamp):
+        """ pass the records after firstimestamp to the datacache, jumping through
+        the archive at a stride of half the wrap period of the counters. The range
+        change gets the total increase of a counter as long as it wraps at most once
+        between the records that it sees. The records are read one at a time where
+        the jump lands more than a wrap period after the previous record and after
+        the last jump that fits in the data. The jumps use the same mode as
+        setmode() so that an interpolated sample interval is kept """
+
+        wrapperiod = self.rangechange.wrapperiod()
+        stride = wrapperiod / 2.0
+        position = firstimestamp
+        jumping = True
+
+        while True:
+            result = None
+            previous = float(position)
+            try:
+                step = True
+                seek = False
+                if jumping:
+                    seek = True
+                    target = previous + stride
+                    if self.windowend is not None and previous < self.windowend:
+                        # The first record after the window is needed
+                        target = min(target, self.windowend)
+                    self.setmode(ctx, totimeval(target))
+                    try:
+                        result = ctx.pmFetch(metric_id_array)
+                    except pmapi.pmErr as exp:
+                        if exp.args[0] != c_pmapi.PM_ERR_EOL:
+                            raise exp
+
+                    if result is None or self.pastend(result):
+                        # The rest of the records are read in turn
+                        jumping = False
+                    elif float(result.contents.timestamp) - previous >= wrapperiod:
+                        logging.debug("%s: %s second gap in the data", mdata.nodename, float(result.contents.timestamp) - previous)
+                    else:
+                        step = False
+
+                    if step and result is not None:
+                        ctx.pmFreeResult(result)
+                        result = None
+
+                if step:
+                    # Read the record after the previous one
+                    if seek:
+                        self.setmode(ctx, position)
+                    result = ctx.pmFetch(metric_id_array)
+                    while float(result.contents.timestamp) <= previous:
+                        ctx.pmFreeResult(result)
+                        result = None
+                        result = ctx.pmFetch(metric_id_array)
+
+                    if self.pastend(result):
+                        return
+
+                position = copy.deepcopy(result.contents.timestamp)
+
+                if False == self.runcallback(datacache, result, mtypes, ctx, mdata, metric_id_array):
+                    return
+                if self.pastwindow(result):
+                    return
+
+            except pmapi.pmErr as exp:
+                if exp.args[0] == c_pmapi.PM_ERR_EOL:
+                    return
+                raise exp
+            finally:
+                if result is not None:
+                    ctx.pmFreeResult(result)
+
+    def fetchlast(self, ctx, metric_id_array):
+        """ fetch the last record for the metrics. If only a time window of the
+        job is being processed then this is the first record after the window """
+
+        if self.windowend is not None:
+            ctx.pmSetMode(c_pmapi.PM_MODE_FORW, totimeval(self.windowend), 0)
+            try:
+                result = ctx.pmFetch(metric_id_array)
+                if not self.pastend(result):
+                    return result
+                ctx.pmFreeResult(result)
+            except pmapi.pmErr as exp:
+                if exp.args[0] != c_pmapi.PM_ERR_EOL:
+                    raise exp
+
+        if self.nodeend is not None:
+            ctx.pmSetMode(c_pmapi.PM_MODE_BACK, pmapi.timeval(int(self.nodeend), 0), 0)
+        else:
+            ctx.pmSetMode(c_pmapi.PM_MODE_BACK, ctx.pmGetArchiveEnd(), 0)
+
+        return ctx.pmFetch(metric_id_array)
+
+    def overbudget(self, ctx, timestamp):
+        """ check the time budget after the record at timestamp has been processed.
+        Once the job is over its budget the rest of the archive is read at the
+        degraded sample interval. Returns whether the rest of the archive is skipped """
+        if self.deadline is None:
+            return False
+
+        if SAMPLED in self.checkdeadline():
+            ctx.pmSetMode(c_pmapi.PM_MODE_INTERP, totimeval(timestamp + self.sampleinterval), int(self.sampleinterval * 1000))
+
+        return TRUNCATED in self.degradations
+
+    def setmode(self, ctx, start):
+        """ position the archive context at start for reading forwards """
+        if self.sampleinterval is None:
+            ctx.pmSetMode(c_pmapi.PM_MODE_FORW, start, 0)
+        else:
+            # The interval is in milliseconds
+            ctx.pmSetMode(c_pmapi.PM_MODE_INTERP, start, int(self.sampleinterval * 1000))
+
     def processarchive(self, nodename, nodeidx, archive):
         """ process the archive """
-        # TODO need to benchmark code to see if there is a benefit to interleaving the calls to
-        # pmFetch for the different contexts. This version runs all the pmFetches for each analytic
-        # in turn.
+        # In the default mode all the pmFetches for each analytic are run in turn.
+        # In fused mode a single pass is made through the archive for the
+        # pre-processors and a single pass for all of the analytics that need
+        # every timestamp. The firstlast analytics only read a couple of records
+        # so are always run individually.
         context = pmapi.pmContext(c_pmapi.PM_CONTEXT_ARCHIVE, archive)
         mdata = ArchiveMeta(nodename, nodeidx, context.pmGetArchiveLabel())
-
-        for preproc in self.preprocs:
-            context.pmSetMode(c_pmapi.PM_MODE_FORW, mdata.archive.start, 0)
-            self.processforpreproc(context, mdata, preproc)
-
-        for analytic in self.alltimestamps:
-            context.pmSetMode(c_pmapi.PM_MODE_FORW, mdata.archive.start, 0)
-            self.processforanalytic(context, mdata, analytic)
-
-        for analytic in self.firstlast:
-            context.pmSetMode(c_pmapi.PM_MODE_FORW, mdata.archive.start, 0)
+        self.indomcache = pcpcinterface.InDomCache()
+        self.signature = pmnssignature(archive, mdata.archive.get_hostname())
+
+        start = mdata.archive.start
+        if self.direct:
+            start = pmapi.timeval(calendar.timegm(self.job.getnodebegin(nodename).utctimetuple()), 0)
+            self.nodeend = calendar.timegm(self.job.getnodeend(nodename).utctimetuple())
+
+        if self.fused:
+            if len(self.preprocs) > 0:
+                self.setmode(context, start)
+                self.processfusedpreprocs(context, mdata)
+
+            if any(not blockprocessing(x) for x in self.running(self.alltimestamps)):
+                self.setmode(context, start)
+                self.processfusedanalytics(context, mdata)
+
+            # The analytics that take blocks of data read the archive on their own
+            for analytic in self.running(self.alltimestamps):
+                if blockprocessing(analytic):
+                    self.setmode(context, start)
+                    self.processforanalytic(context, mdata, analytic)
+        else:
+            for preproc in self.preprocs:
+                self.setmode(context, start)
+                self.processforpreproc(context, mdata, preproc)
+
+            for analytic in self.running(self.alltimestamps):
+                self.setmode(context, start)
+                self.processforanalytic(context, mdata, analytic)
+
+        for analytic in self.running(self.firstlast):
+            self.setmode(context, start)
             self.processfirstlast(context, mdata, analytic)
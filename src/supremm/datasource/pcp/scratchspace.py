@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+    Placement of the extracted job archives on a fast scratch filesystem
+"""
+import fcntl
+import glob
+import hashlib
+import logging
+import os
+import struct
+import time
+
+# Suffixes of the compressed archive files that libpcp reads
+COMPRESSED_SUFFIXES = (".xz", ".lzma", ".bz2", ".bz", ".gz", ".Z", ".z")
+
+# Time in seconds that a reservation is held for before its job directory is created
+RESERVE_GRACE = 600
+
+
+def _varint(data, pos):
+    """ Decode an xz variable length integer. Returns the value and the next position """
+    value = 0
+    for i in range(9):
+        byte = data[pos + i]
+        value |= (byte & 0x7F) << (7 * i)
+        if byte & 0x80 == 0:
+            return value, pos + i + 1
+    raise ValueError("Invalid xz integer")
+
+
+def xzuncompressedsize(filename):
+    """ The uncompressed size of an .xz file. This is read from the index at the end
+        of each stream so the file is not decompressed. Returns None if the file
+        is not in the expected format """
+    try:
+        with open(filename, "rb") as fp:
+            fp.seek(0, os.SEEK_END)
+            end = fp.tell()
+            total = 0
+            while end > 0:
+                # Skip any stream padding
+                fp.seek(end - 4)
+                if fp.read(4) == b"\0\0\0\0":
+                    end -= 4
+                    continue
+
+                fp.seek(end - 12)
+                footer = fp.read(12)
+                if len(footer) != 12 or footer[10:] != b"YZ":
+                    return None
+                indexsize = (struct.unpack("<I", footer[4:8])[0] + 1) * 4
+                indexstart = end - 12 - indexsize
+                if indexstart < 12:
+                    return None
+
+                fp.seek(indexstart)
+                index = fp.read(indexsize)
+                if index[0] != 0:
+                    return None
+
+                nrecords, pos = _varint(index, 1)
+                blocks = 0
+                for _ in range(nrecords):
+                    unpadded, pos = _varint(index, pos)
+                    uncompressed, pos = _varint(index, pos)
+                    blocks += (unpadded + 3) & ~3
+                    total += uncompressed
+
+                # The previous stream (if any) ends before this stream's header
+                end = indexstart - blocks - 12
+                if end < 0:
+                    return None
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return total
+
+
+def estimatesize(job):
+    """ Upper bound for the size of the extracted archives of a job. The archives
+        that pmlogextract writes only cover the time the job ran so they are no
+        larger than the raw archives they are read from. pmlogextract writes
+        uncompressed archives so compressed raw archives are counted at their
+        uncompressed size. Returns None if that is unknown """
+    total = 0
+    for _, nodearchives in job.rawarchives():
+        for archive in nodearchives:
+            for filename in glob.glob(glob.escape(archive) + ".*"):
+                if filename.endswith(".xz"):
+                    size = xzuncompressedsize(filename)
+                    if size is None:
+                        return None
+                    total += size
+                elif filename.endswith(COMPRESSED_SUFFIXES):
+                    return None
+                else:
+                    try:
+                        total += os.path.getsize(filename)
+                    except OSError:
+                        pass
+    return total
+
+
+class ScratchSpace(object):
+    """ Hands out space for job archive directories from a size budget on a
+        scratch directory (for example a local SSD or tmpfs). The reservations
+        are files in the scratch directory so the budget is shared by all of the
+        worker processes. A reservation is held until it is released or its job
+        directory is removed, so it does not depend on which process extracted
+        or summarizes the job. """
+
+    def __init__(self, scratchdir, maxbytes):
+        self._scratchdir = scratchdir
+        self._maxbytes = maxbytes
+        self._reservedir = os.path.join(scratchdir, ".reservations")
+
+    @property
+    def scratchdir(self):
+        """ The directory that the job archive directories are placed in """
+        return self._scratchdir
+
+    def _reservations(self):
+        """ The size of each active reservation. A reservation is active while
+            its job directory exists (or for RESERVE_GRACE seconds after it was
+            made, before the directory is created). The other reservations are
+            removed """
+        active = {}
+        now = time.time()
+        for filename in glob.glob(os.path.join(self._reservedir, "*.res")):
+            try:
+                with open(filename, "r") as fp:
+                    size, jobdir = fp.read().rstrip("\n").split(" ", 1)
+                    size = int(size)
+                made = os.path.getmtime(filename)
+            except (OSError, ValueError):
+                continue
+
+            if not os.path.isdir(jobdir) and now - made > RESERVE_GRACE:
+                logging.debug("Removing stale scratch reservation %s for %s", filename, jobdir)
+                self.release(filename)
+                continue
+
+            active[filename] = size
+
+        return active
+
+    def reserve(self, jobdir, size):
+        """ Reserve size bytes for jobdir. Returns the reservation or None if
+            there is not enough space left in the budget or on the filesystem.
+            The other reservations are taken from the free space on the filesystem
+            too since their archives may not have been written yet """
+        try:
+            os.makedirs(self._reservedir, exist_ok=True)
+            with open(os.path.join(self._reservedir, "lock"), "w") as lockfile:
+                fcntl.flock(lockfile, fcntl.LOCK_EX)
+
+                reservation = os.path.join(self._reservedir, hashlib.sha1(jobdir.encode()).hexdigest() + ".res")
+                active = self._reservations()
+                used = sum(active.values()) - active.get(reservation, 0)
+
+                stat = os.statvfs(self._scratchdir)
+                if used + size > self._maxbytes or used + size > stat.f_bavail * stat.f_frsize:
+                    logging.debug("Scratch space full (%s used, %s requested)", used, size)
+                    return None
+
+                with open(reservation, "w") as fp:
+                    fp.write("{0} {1}\n".format(size, jobdir))
+        except OSError as exc:
+            logging.warning("Unable to reserve scratch space in %s: %s", self._scratchdir, exc)
+            return None
+
+        return reservation
+
+    @staticmethod
+    def release(reservation):
+        """ Return the space held by a reservation to the budget """
+        try:
+            os.unlink(reservation)
+        except OSError:
+            pass
+
+
+def getscratchspace(conf):
+    """ Returns the scratch space if one is configured """
+    pathconf = conf.getsection("summary")
+    if not pathconf or 'scratch_dir' not in pathconf:
+        return None
+
+    maxbytes = int(float(pathconf.get('scratch_size_mb', 1024)) * 1024 * 1024)
+    return ScratchSpace(pathconf['scratch_dir'], maxbytes)
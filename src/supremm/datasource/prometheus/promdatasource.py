@@ -13,7 +13,7 @@ class PromDatasource(Datasource):
     """ Instance of a Prometheus datasource class """
 
     def __init__(self, preprocs, plugins, resconf):
-        super().__init__(preprocs, plugins)
+        super().__init__(preprocs, plugins, resconf)
 
         self._client = PromClient(resconf)
         self._mapping = MappingManager(self.client)
@@ -55,7 +55,7 @@ class PromDatasource(Datasource):
         # Instantiate preproc, plugins
         preprocessors, analytics = super().summarizejob(job, jobmeta, config, opts)
 
-        s = PromSummarize(preprocessors, analytics, job, config, self.mapping, opts["fail_fast"])
+        s = PromSummarize(preprocessors, analytics, job, config, self.mapping, opts["fail_fast"], opts["sample_interval"], self.jobdeadline())
 
         enough_nodes = False
 
@@ -1,4 +1,5 @@
 import os
+import math
 import logging
 import urllib.parse as urlparse
 import datetime
@@ -69,14 +70,14 @@ class PromClient():
 
         return r.json()
 
-    def query_range(self, query, start, end):
+    def query_range(self, query, start, end, step='30s'):
         """ Query a time range with a specified granularity """
 
         params = {
             'query': query,
             'start': start,
             'end': end,
-            'step': '30s'
+            'step': step
         }
 
         endpoint = "/api/v1/query_range"
@@ -169,10 +170,13 @@ class Context():
         while iterating through a Prometheus response
     """
 
-    def __init__(self, start, end, client):
+    def __init__(self, start, end, client, step=None):
         self.start = start
         self.end = end
         self.client = client
+        # When set the data are evaluated every step seconds rather than
+        # returned as the raw samples
+        self.step = step
 
         self.reqMetrics = None
         self.timestamp = start
@@ -236,8 +240,15 @@ class Context():
         self.init_internal_state()
         if self.mode == "all" or self.mode == "timeseries":
             for start, end in self.chunk_timerange():
-                # Append a time range to an instant query to get raw data
-                yield [self.client.query(m.apply_range(start, end), end) for m in required_metrics]
+                if self.step is not None:
+                    # The evaluation times are multiples of the step from the job start.
+                    # Each chunk starts at the first one after the end of the previous chunk
+                    if start > self.start:
+                        start = self.start + (math.floor((start - self.start) / self.step) + 1) * self.step
+                    yield [self.client.query_range(m.query, start, end, self.step) for m in required_metrics]
+                else:
+                    # Append a time range to an instant query to get raw data
+                    yield [self.client.query(m.apply_range(start, end), end) for m in required_metrics]
                 self.reset_internal_state()
 
         elif self.mode == "firstlast":
@@ -255,13 +266,9 @@ class Context():
             yield self.start, self.end
             return
 
-        done = False
-        while not done:
+        while chunk_start.timestamp() < self.end:
             chunk_end = chunk_start + datetime.timedelta(hours=CHUNK_SIZE)
-            if chunk_end.timestamp() > self.end:
-                yield chunk_start.timestamp(), self.end
-                done = True
-            yield chunk_start.timestamp(), chunk_end.timestamp()
+            yield chunk_start.timestamp(), min(chunk_end.timestamp(), self.end)
             chunk_start = chunk_end
 
     def extractpreproc_values(self, result):
@@ -21,10 +21,14 @@ class NodeMeta(NodeMetadata):
     nodeindex = property(lambda self: self._nodeidx)
 
 class PromSummarize(Summarize):
-    def __init__(self,  preprocessors, analytics, job, config, mapping, fail_fast=False):
+    def __init__(self,  preprocessors, analytics, job, config, mapping, fail_fast=False, sampleinterval=None, deadline=None):
         super(PromSummarize, self).__init__(preprocessors, analytics, job, config, fail_fast)
         self.start = time.time()
 
+        # When set the plugins get one datapoint every sampleinterval seconds
+        self.sampleinterval = sampleinterval
+        self.deadline = deadline
+
         # Translation PCP -> Prometheus metric names
         self.mapping = mapping
         self.mapping.currentjob = job
@@ -40,15 +44,15 @@ class PromSummarize(Summarize):
             self.adderror("job", je)
 
         if self.job.nodecount > 0:
-            for analytic in self.alltimestamps:
+            for analytic in self.running(self.alltimestamps):
                 if analytic.status != "uninitialized":
                     if analytic.mode == "all":
-                        output[analytic.name] = analytic.results()
+                        output[analytic.name] = self.results(analytic)
                     if analytic.mode == "timeseries":
-                        timeseries[analytic.name] = analytic.results()
-            for analytic in self.firstlast:
+                        timeseries[analytic.name] = self.results(analytic)
+            for analytic in self.running(self.firstlast):
                 if analytic.status != "uninitialized":
-                    output[analytic.name] = analytic.results()
+                    output[analytic.name] = self.results(analytic)
 
         output['summarization'] = {
             "version": self.version,
@@ -58,6 +62,8 @@ class PromSummarize(Summarize):
             "complete": self.complete(),
             "datasource": "prometheus",
         }
+        self.adddegradations(output['summarization'])
+        self.addsampling(output['summarization'])
 
         output['created'] = datetime.datetime.utcnow()
 
@@ -109,17 +115,23 @@ class PromSummarize(Summarize):
 
     def good_enough(self):
         """ A job is good_enough if 95% of nodes have
-            been processed sucessfullly
+            been processed sucessfullly. The nodes that were left out by the node
+            stride because the job was over its time budget are counted too, the
+            ones that were dropped when the summarization was truncated are not
         """
-        return self.nodes_processed >= 0.95 * float(self.job.nodecount)
+        return self.nodes_processed + self.nodes_subsampled >= 0.95 * float(self.job.nodecount)
 
     def process(self):
         """ Main entry point. All nodes are processed. """
         success = 0
 
-        for nodename in self.job.nodenames():
-            idx = self.nodes_processed
-            mdata = NodeMeta(nodename, idx)
+        for nodeidx, nodename in enumerate(self.job.nodenames()):
+            self.checkdeadline()
+            if self.skipnode(nodeidx):
+                self.skippednode()
+                continue
+
+            mdata = NodeMeta(nodename, nodeidx)
 
             self.mapping.populate_queries(nodename)
             try:
@@ -138,17 +150,22 @@ class PromSummarize(Summarize):
         """ Process a single node from a job """
 
         start, end = self.job.start_datetime.timestamp(), self.job.end_datetime.timestamp()
-        ctx = Context(start, end, self.mapping.client)
+        ctx = Context(start, end, self.mapping.client, self.sampleinterval)
 
         for preproc in self.preprocs:
             ctx.mode = preproc.mode
             self.processforpreproc(ctx, mdata, preproc)
 
         for analytic in self.alltimestamps:
+            self.checkdeadline()
+            if analytic.name in self.skipped:
+                continue
+            # The data are sampled from here on if the job went over its time budget
+            ctx.step = self.sampleinterval
             ctx.mode = analytic.mode
             self.processforanalytic(ctx, mdata, analytic)
 
-        for analytic in self.firstlast:
+        for analytic in self.running(self.firstlast):
             ctx.mode = analytic.mode
             self.processfirstlast(ctx, mdata, analytic)
 
@@ -0,0 +1,53 @@
+""" Time budget for the summarization of a job """
+import time
+
+# The ways that the summarization of a job is degraded when it is over its budget
+SAMPLED = "sampled"
+SKIPPED_PLUGINS = "skipped_plugins"
+NODE_SUBSAMPLED = "node_subsampled"
+TRUNCATED = "truncated"
+
+
+class JobDeadline(object):
+    """ Tracks the time spent summarizing a job against its time budget. Rather
+        than stopping the summarization when the budget runs out it is degraded in
+        stages so the time that a job can take is bounded:
+            at the budget the data are read at sampleinterval and the
+            expensive plugins are skipped,
+            at 1.5 times the budget only one in nodestride of the remaining nodes
+            are processed,
+            at twice the budget the remaining nodes are not processed. """
+
+    STAGES = ((1.0, (SAMPLED, SKIPPED_PLUGINS)), (1.5, (NODE_SUBSAMPLED,)), (2.0, (TRUNCATED,)))
+
+    def __init__(self, budget, sampleinterval=300, nodestride=4):
+        self.budget = budget
+        self.sampleinterval = sampleinterval
+        self.nodestride = nodestride
+        self.start = time.time()
+        self._stage = 0
+
+    def check(self):
+        """ Returns the degradations that apply from now on. This is an empty list
+            until the next stage is reached """
+        elapsed = time.time() - self.start
+
+        degradations = []
+        while self._stage < len(self.STAGES) and elapsed >= self.STAGES[self._stage][0] * self.budget:
+            degradations.extend(self.STAGES[self._stage][1])
+            self._stage += 1
+
+        return degradations
+
+
+def deadlinesettings(resconf):
+    """ The JobDeadline arguments for a resource. Returns None if there is no time
+        budget for the jobs on the resource """
+    if not resconf or not resconf.get('job_time_budget'):
+        return None
+
+    return {
+        "budget": float(resconf['job_time_budget']),
+        "sampleinterval": float(resconf.get('degraded_sample_interval', 300)),
+        "nodestride": max(1, int(resconf.get('degraded_node_stride', 4)))
+    }
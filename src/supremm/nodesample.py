@@ -0,0 +1,80 @@
+""" Stratified sampling of the nodes of large jobs """
+import numbers
+import random
+import re
+from collections import OrderedDict
+
+
+def hostclass(hostname):
+    """ The class of a host is its name without the digits so that the nodes of
+        a cluster named node001, node002 etc. are in the same class """
+    return re.sub(r"[0-9]+", "", hostname.split(".")[0])
+
+
+def stratifiedsample(nodenames, samplesize, seed):
+    """ Returns samplesize of the nodes in their original order. The first node
+        (the head node) is always included. The other nodes are grouped by host
+        class and each group contributes in proportion to its size (largest
+        remainder rounding) so that every type of node in the job is represented.
+        The nodes within a group are chosen at random using seed so the same
+        nodes are sampled if the job is processed again """
+    nodenames = list(nodenames)
+    if samplesize >= len(nodenames):
+        return nodenames
+
+    strata = OrderedDict()
+    for nodename in nodenames[1:]:
+        strata.setdefault(hostclass(nodename), []).append(nodename)
+
+    remaining = samplesize - 1
+    population = len(nodenames) - 1
+
+    quotas = dict((name, float(remaining * len(members)) / population) for name, members in strata.items())
+    allocation = dict((name, int(quota)) for name, quota in quotas.items())
+    leftover = remaining - sum(allocation.values())
+    for name in sorted(strata, key=lambda x: allocation[x] - quotas[x])[:leftover]:
+        allocation[name] += 1
+
+    rng = random.Random(seed)
+    chosen = set(nodenames[:1])
+    for name, members in strata.items():
+        chosen.update(rng.sample(members, allocation[name]))
+
+    return [x for x in nodenames if x in chosen]
+
+
+def scaletotals(results, paths, scale):
+    """ Multiply the values at each of the paths in a plugin's results by scale.
+        The paths are the Plugin.totals of the plugin. Counts stay integers """
+    for path in paths:
+        _scale(results, path, scale)
+
+
+def _scale(data, path, scale):
+    """ Scale the value at path within data (if it is present) """
+    if not isinstance(data, dict):
+        return
+
+    keys = list(data.keys()) if path[0] == "*" else [path[0]]
+    for key in keys:
+        if key not in data:
+            continue
+        if len(path) > 1:
+            _scale(data[key], path[1:], scale)
+        elif isinstance(data[key], numbers.Integral):
+            data[key] = int(round(data[key] * scale))
+        elif isinstance(data[key], numbers.Real):
+            data[key] = float(data[key] * scale)
+
+
+def samplesettings(resconf):
+    """ The node sampling settings for a resource. Returns None if the nodes of
+        the jobs on the resource are not sampled """
+    if not resconf or not resconf.get('node_sample_threshold'):
+        return None
+
+    threshold = int(resconf['node_sample_threshold'])
+    return {
+        "threshold": threshold,
+        "samplesize": max(1, min(threshold, int(resconf.get('node_sample_size', 64))))
+    }
@@ -1,8 +1,13 @@
 
 import sys
 import os
-from pymongo import MongoClient
-from pymongo.errors import InvalidDocument
+import logging
+import queue
+import threading
+import time
+from pymongo import MongoClient, ReplaceOne
+from pymongo.errors import InvalidDocument, BulkWriteError
+from pymongo.write_concern import WriteConcern
 import json
 
 class factory(object):
@@ -69,7 +74,7 @@ class FileOutput(object):
     def __enter__(self):
         return self
 
-    def process(self, summary, mdata):
+    def process(self, summary, mdata, ondone=None):
         """
         json print
         """
@@ -79,6 +84,8 @@ class FileOutput(object):
         if self._completejson:
             self._jsonarray.append(summary)
             self._jsonarray.append(mdata)
+        if ondone is not None:
+            ondone()
 
     def __exit__(self, exception_type, exception_val, trace):
         if self._fragjson:
@@ -88,41 +95,197 @@ class FileOutput(object):
                 json.dump(self._jsonarray, f, indent=4, default=str)
 
 
+def getwriteconcern(outconf):
+    """ The write concern from the "write_concern" setting. This is either the
+        value for w or a dict with the WriteConcern() parameters """
+    setting = outconf.get('write_concern')
+    if setting is None:
+        return None
+    if isinstance(setting, dict):
+        return WriteConcern(**setting)
+    return WriteConcern(w=setting)
+
+
 class MongoOutput(object):
-    """ Support for mongodb output """
+    """ Support for mongodb output.
+
+        If "bulk_size" is set in the output database configuration then the
+        documents are written by a background thread using unordered bulk
+        writes. A bulk write is sent when bulk_size jobs are waiting or
+        when the oldest has waited for "bulk_interval" seconds. At most
+        "bulk_queue" jobs wait for the writer before process() blocks.
+    """
     def __init__(self, outconf, resconf):
         self._uri = outconf['uri']
         self._dname = outconf.get('dbname', outconf.get('db', 'supremm'))
         self._collection = "resource_" + str(resconf['resource_id'])
         self._timeseries = "timeseries-" + self._collection
+        self._writeconcern = getwriteconcern(outconf)
+        self._bulksize = int(outconf.get('bulk_size', 0))
+        self._bulkinterval = float(outconf.get('bulk_interval', 10))
+        self._queue = queue.Queue(int(outconf.get('bulk_queue', 4 * max(self._bulksize, 1))))
+        self._persisted = queue.Queue()
+        self._writer = None
+        self._writererror = None
         self._client = None
         self._outdb = None
 
     def __enter__(self):
         self._client = MongoClient(host=self._uri)
         self._outdb = self._client[self._dname]
+        if self._bulksize > 0:
+            self._writer = threading.Thread(target=self._writeloop)
+            self._writer.daemon = True
+            self._writer.start()
         return self
 
-    def process(self, summary, mdata):
-        """ output the summary record """
+    def _getcollection(self, name):
+        return self._outdb.get_collection(name, write_concern=self._writeconcern)
 
+    def _documents(self, summary, mdata):
+        """ The documents to store for a job keyed by collection name """
         mongoid = str(summary['acct']['id']) + '-' + str(summary['acct']['end_time'])
         summary['_id'] = mongoid
         summary['summarization'].update(mdata)
 
+        docs = {}
         if 'timeseries' in summary:
             summary['timeseries']['_id'] = summary["_id"]
-            self._outdb[self._timeseries].update({"_id": summary["_id"]}, summary['timeseries'], upsert=True)
+            docs[self._timeseries] = summary['timeseries']
             del summary['timeseries']
 
-        self._outdb[self._collection].update({"_id": summary["_id"]}, summary, upsert=True)
+        docs[self._collection] = summary
+        return docs
+
+    def process(self, summary, mdata, ondone=None):
+        """ output the summary record. The ondone function is called once
+            the documents have been stored """
+
+        docs = self._documents(summary, mdata)
+
+        if self._writer is None:
+            for collection, doc in docs.items():
+                self._getcollection(collection).update({"_id": doc["_id"]}, doc, upsert=True)
+            if ondone is not None:
+                ondone()
+            return
+
+        self._enqueue((docs, ondone))
+        self._runpersisted()
+
+    def _enqueue(self, item):
+        """ Add an item to the writer queue. Raises the error that stopped the writer
+            thread rather than waiting for it forever """
+        while True:
+            self._checkwriter()
+            try:
+                self._queue.put(item, timeout=1.0)
+                return
+            except queue.Full:
+                continue
+
+    def _checkwriter(self):
+        """ Raise the error that stopped the writer thread (if any) """
+        if self._writererror is not None:
+            raise RuntimeError("MongoDB writer thread failed") from self._writererror
+
+    def _runpersisted(self):
+        """ Call the ondone functions for the documents that the writer thread has
+            stored. These run in the thread that called process() """
+        while True:
+            try:
+                ondone = self._persisted.get_nowait()
+            except queue.Empty:
+                break
+            ondone()
+
+    def _writeloop(self):
+        """ Background thread that sends the queued documents in bulk """
+        try:
+            self._sendqueued()
+        except Exception as exc:
+            logging.exception("MongoDB writer thread failed")
+            self._writererror = exc
+
+    def _sendqueued(self):
+        """ Send the queued documents until the None marker is received """
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.time(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False
+
+            if item:
+                if not batch:
+                    deadline = time.time() + self._bulkinterval
+                batch.append(item)
+
+            if batch and (item is None or item is False or len(batch) >= self._bulksize):
+                self._flush(batch)
+                batch = []
+                deadline = None
+
+            if item is None:
+                break
+
+    def _flush(self, batch):
+        """ Write the documents for a list of jobs. Only the jobs for which all of the
+            documents were written are passed on to have their ondone function called """
+        failed = set()
+        for collection in (self._timeseries, self._collection):
+            ops = []
+            owners = []
+            for n, (docs, _) in enumerate(batch):
+                if collection in docs:
+                    ops.append(ReplaceOne({"_id": docs[collection]["_id"]}, docs[collection], upsert=True))
+                    owners.append(n)
+            if not ops:
+                continue
+
+            try:
+                self._getcollection(collection).bulk_write(ops, ordered=False)
+            except BulkWriteError as exc:
+                errors = exc.details.get('writeErrors', [])
+                for err in errors:
+                    failed.add(owners[err['index']])
+                if exc.details.get('writeConcernErrors'):
+                    # Not possible to tell which of the writes were affected
+                    failed.update(owners)
+                logging.error("Bulk write to %s failed for %s documents. First error: %s", collection,
+                              len(errors), errors[0]['errmsg'] if errors else exc.details.get('writeConcernErrors'))
+            except Exception as exc:
+                # Includes errors such as bson InvalidDocument that are not PyMongoErrors
+                failed.update(owners)
+                logging.error("Bulk write to %s failed: %s", collection, str(exc))
+
+        for n, (docs, ondone) in enumerate(batch):
+            if n in failed:
+                logging.error("Summary for %s was not stored", docs[self._collection]['_id'])
+            elif ondone is not None:
+                self._persisted.put(ondone)
 
     def __exit__(self, exception_type, exception_val, trace):
+        if self._writer is not None:
+            try:
+                self._enqueue(None)
+            except RuntimeError:
+                # The writer has already stopped, the error is raised below
+                pass
+            self._writer.join()
+            self._writer = None
+            self._runpersisted()
+
         if self._client != None:
             self._outdb = None
             self._client.close()
             self._client = None
 
+        if exception_type is None:
+            self._checkwriter()
+
 
 class StdoutOutput(object):
     """
@@ -134,12 +297,14 @@ class StdoutOutput(object):
     def __enter__(self):
         return self
 
-    def process(self, summary, mdata):
+    def process(self, summary, mdata, ondone=None):
         """
         json print
         """
         print(self._resid, json.dumps(summary, default=str, indent=4))
         print("MDATA: ", json.dumps(mdata, default=str, indent=4))
+        if ondone is not None:
+            ondone()
 
     def __exit__(self, exception_type, exception_val, trace):
         pass
@@ -153,8 +318,9 @@ class NullOutput(object):
     def __enter__(self):
         return self
 
-    def process(self, summary, mdata):
-        pass
+    def process(self, summary, mdata, ondone=None):
+        if ondone is not None:
+            ondone()
 
     def __exit__(self, exception_type, exception_val, trace):
         pass
@@ -2,7 +2,7 @@
     include common functions """
 
 from abc import ABCMeta, abstractmethod, abstractproperty
-from supremm.statistics import calculate_stats
+from supremm.statistics import SketchStats
 from supremm.subsample import TimeseriesAccumulator
 from supremm.errors import ProcessingError
 import os
@@ -43,6 +43,20 @@ def loadpreprocessors(preprocdir=None):
 
     return loadplugins(preprocdir, "preprocessors")
 
+def mergeable(plugin):
+    """ returns whether the plugin or preprocessor class implements the merge() hook
+        and can therefore be run on a subset of the job's nodes """
+    return getattr(plugin, "merge", None) is not None
+
+def blockprocessing(plugin):
+    """ returns whether the plugin class (or instance) implements the process_block() hook """
+    return getattr(plugin, "process_block", None) is not None
+
+def windowmergeable(plugin):
+    """ returns whether the plugin or preprocessor class implements the mergewindow()
+        hook and can therefore be run on a time window of the job """
+    return getattr(plugin, "mergewindow", None) is not None
+
 class NodeMetadata(object, metaclass=ABCMeta):
     """ Wrapper class that contains info about a job node. This is passed to
         the process function of the plugin. """
@@ -62,6 +76,21 @@ class NodeMetadata(object, metaclass=ABCMeta):
 class Plugin(object, metaclass=ABCMeta):
     """ abstract base class describing the plugin interface """
 
+    # Plugins that do not keep references to the data arrays passed to process()
+    # can set this so that the arrays are views of buffers that the framework
+    # reuses for the next datapoint. The data may then be a single 2-D array
+    # (metric x instance) rather than a list of arrays.
+    zerocopy = False
+
+    # Plugins that take much longer than the others to process the data set this
+    # so that they are skipped for jobs that are over their time budget.
+    expensive = False
+
+    # Paths (tuples of keys) to the values in the results that are sums over all of
+    # the nodes of the job. A "*" matches every key at that level. These values are
+    # scaled up when only a sample of the nodes of a job is summarized.
+    totals = ()
+
     def __init__(self, job):
         self._job = job
         self._status = "uninitialized"
@@ -82,11 +111,34 @@ class Plugin(object, metaclass=ABCMeta):
         """ process is called for every requested data point """
         pass
 
+    # Optional hook process_block(self, nodemeta, timestamps, values, description)
+    # for plugins that need every timestamp. If implemented the PCP datasource
+    # calls it with blocks of consecutive datapoints instead of calling process().
+    # timestamps is a 1-D array, values a 3-D array (datapoint x metric x instance)
+    # and description is as for process(). Entries are NaN where a metric has fewer
+    # instances than the others. The instances do not change within a block.
+    # Return False to stop receiving data for the node.
+    process_block = None
+
     @abstractmethod
     def results(self):
         """ results will be called once after all the datapoints have had calls to  process()"""
         pass
 
+    # Optional hook merge(self, other) used when the nodes of a job are split
+    # between several processes. Called on a fresh instance once for each of the
+    # instances that processed the subsets of nodes (in node order) before results()
+    # is called. The framework handles the status field.
+    merge = None
+
+    # Optional hook mergewindow(self, other) used when a long job is split into
+    # consecutive time windows. Called on a fresh instance once for each of the
+    # instances that processed the windows (in time order) before results() is
+    # called. The last datapoint that an instance sees for a node is the same as
+    # the first datapoint for that node in the following window so that counter
+    # deltas can be added.
+    mergewindow = None
+
     @abstractproperty
     def name(self):
         pass
@@ -158,6 +210,17 @@ class PreProcessor(object, metaclass=ABCMeta):
         """ Called after all of the data available for a host has been processed. """
         pass
 
+    # Optional hook merge(self, other) used when the nodes of a job are split
+    # between several processes. Implementations should combine the state and
+    # update the job data as hostend() does.
+    merge = None
+
+    # Optional hook mergewindow(self, other) used when a long job is split into
+    # consecutive time windows. Each datapoint is only processed in one of the
+    # windows. Implementations should combine the state and update the job data
+    # as hostend() does.
+    mergewindow = None
+
     @abstractproperty
     def name(self):
         pass
@@ -186,11 +249,12 @@ class DeviceBasedPlugin(Plugin, metaclass=ABCMeta):
     """
 
     mode = property(lambda x: "firstlast")
+    zerocopy = True
 
     def __init__(self, job):
         super(DeviceBasedPlugin, self).__init__(job)
         self._first = {}
-        self._data = {}
+        self._delta = {}
         self._error = None
         self.allmetrics = self.requiredMetrics + self.optionalMetrics
 
@@ -209,37 +273,61 @@ class DeviceBasedPlugin(Plugin, metaclass=ABCMeta):
             self._error = ProcessingError.INDOMS_CHANGED_DURING_JOB
             return False
 
-        hostdata = ndata - self._first[nodemeta.nodename]
-
-        for mindex, i in enumerate(description):
-            for index in range(len(hostdata[mindex, :])):
-                indom = i[1][index]
-                metricname = self.allmetrics[mindex]
-
-                if indom not in self._data:
-                    self._data[indom] = {}
-                if metricname not in self._data[indom]:
-                    self._data[indom][metricname] = []
-                self._data[indom][metricname].append(hostdata[mindex, index])
+        self._delta[nodemeta.nodename] = (ndata - self._first[nodemeta.nodename], [i[1] for i in description])
 
         return True
 
+    def merge(self, other):
+        self._first.update(other._first)
+        self._delta.update(other._delta)
+        if self._error is None:
+            self._error = other._error
+
+    def mergewindow(self, other):
+        for nodename, first in other._first.items():
+            self._first.setdefault(nodename, first)
+        for nodename, (hostdata, indoms) in other._delta.items():
+            if nodename not in self._delta:
+                self._delta[nodename] = (hostdata, indoms)
+            elif self._delta[nodename][0].shape != hostdata.shape:
+                self._error = ProcessingError.INDOMS_CHANGED_DURING_JOB
+            else:
+                self._delta[nodename] = (self._delta[nodename][0] + hostdata, indoms)
+        if self._error is None:
+            self._error = other._error
+
     def results(self):
 
         if self._error != None:
             return {"error": self._error}
 
-        if len(self._data) == 0:
+        if len(self._delta) == 0:
             return {"error": ProcessingError.INSUFFICIENT_DATA}
 
+        data = {}
+
+        for hostdata, indoms in self._delta.values():
+            for mindex, names in enumerate(indoms):
+                for index in range(len(hostdata[mindex, :])):
+                    indom = names[index]
+                    metricname = self.allmetrics[mindex]
+
+                    if indom not in data:
+                        data[indom] = {}
+                    if metricname not in data[indom]:
+                        data[indom][metricname] = SketchStats()
+                    data[indom][metricname].append(hostdata[mindex, index])
+
         output = {}
 
-        for devicename, device in self._data.items():
+        for devicename, device in data.items():
             cleandevname = devicename.replace(".", "-")
             output[cleandevname] = {}
             for metricname, metric in device.items():
                 prettyname = "-".join(metricname.split(".")[2:])
-                output[cleandevname][prettyname] = calculate_stats(metric)
+                output[cleandevname][prettyname] = metric.get()
+                if metric.approximate():
+                    output[cleandevname][prettyname]['med_approx'] = True
 
         return output
 
@@ -251,6 +339,7 @@ class DeviceInstanceBasedPlugin(Plugin, metaclass=ABCMeta):
     """
 
     mode = property(lambda x: "firstlast")
+    zerocopy = True
 
     def __init__(self, job):
         super(DeviceInstanceBasedPlugin, self).__init__(job)
@@ -271,9 +360,16 @@ class DeviceInstanceBasedPlugin(Plugin, metaclass=ABCMeta):
 
         for idx, metricname in enumerate(self.requiredMetrics):
             if metricname not in self._data:
-                self._data[metricname] = []
+                self._data[metricname] = SketchStats()
             self._data[metricname].append(hostdata[idx, 0])
 
+    def merge(self, other):
+        self._first.update(other._first)
+        for metricname, values in other._data.items():
+            self._data.setdefault(metricname, SketchStats()).merge(values)
+        if self._error is None:
+            self._error = other._error
+
     def results(self):
 
         if self._error != None:
@@ -286,7 +382,9 @@ class DeviceInstanceBasedPlugin(Plugin, metaclass=ABCMeta):
 
         for metricname, metric in self._data.items():
             prettyname = "-".join(metricname.split(".")[1:])
-            output[prettyname] = calculate_stats(metric)
+            output[prettyname] = metric.get()
+            if metric.approximate():
+                output[prettyname]['med_approx'] = True
 
         return output
 
@@ -319,6 +417,14 @@ class RateConvertingTimeseriesPlugin(Plugin, metaclass=ABCMeta):
         if datum != None:
             self._data.adddata(nodemeta.nodeindex, timestamp, datum)
 
+    def merge(self, other):
+        self._data.merge(other._data)
+        self._hostdata.update(other._hostdata)
+
+    def mergewindow(self, other):
+        self._data.mergewindow(other._data)
+        self._hostdata.update(other._hostdata)
+
     def results(self):
 
         if len(self._hostdata) != self._job.nodecount:
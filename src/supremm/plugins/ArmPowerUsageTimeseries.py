@@ -58,6 +58,18 @@ class ArmPowerUsageTimeseries(Plugin):
 
         return True
 
+    def merge(self, other):
+        self._data.merge(other._data)
+        self._hostdata.update(other._hostdata)
+        if self._error is None:
+            self._error = other._error
+
+    def mergewindow(self, other):
+        selection = self._data.mergewindow(other._data)
+        TimeseriesAccumulator.mergehostdata(selection, self._hostdata, other._hostdata)
+        if self._error is None:
+            self._error = other._error
+
     def results(self):
 
         if self._error:
@@ -19,6 +19,7 @@ class Catastrophe(Plugin):
 
     def __init__(self, job):
         super(Catastrophe, self).__init__(job)
+        # The datapoints for each node are stored as a list of arrays, one per block
         self._data = {}
         self._error = None
 
@@ -32,20 +33,68 @@ class Catastrophe(Plugin):
             # Ignore datapoints where no data stored
             return True
 
-        if nodemeta.nodename not in self._data:
-            self._data[nodemeta.nodename] = {"x": [], "t": []}
+        return self.adddatapoints(nodemeta.nodename, numpy.array([timestamp]), numpy.array([1.0 * numpy.sum(data[0])]))
 
-        info = self._data[nodemeta.nodename]
-        info['x'].append(1.0 * numpy.sum(data[0]))
-        info['t'].append(timestamp)
+    def process_block(self, nodemeta, timestamps, values, description):
 
-        if len(info['x']) > 1:
-            if numpy.any(info['x'][-1] - info['x'][-2] < 0.0):
-                self._error = ProcessingError.PMDA_RESTARTED_DURING_JOB
-                return False
+        if self._job.getdata('perf')['active'] != True:
+            self._error = ProcessingError.RAW_COUNTER_UNAVAILABLE
+            return False
+
+        ninstances = len(description[0][0])
+        if ninstances == 0:
+            # Ignore datapoints where no data stored
+            return True
+
+        return self.adddatapoints(nodemeta.nodename, timestamps, 1.0 * numpy.sum(values[:, 0, :ninstances], 1))
+
+    def adddatapoints(self, nodename, timestamps, x):
+        """ store the summed counter values for a node and check that the
+            counters did not go backwards """
+
+        if nodename not in self._data:
+            self._data[nodename] = {"x": [], "t": []}
+
+        info = self._data[nodename]
+
+        if len(info['x']) > 0:
+            previous = numpy.concatenate((info['x'][-1][-1:], x[:-1]))
+        else:
+            previous = numpy.concatenate((x[:1], x[:-1]))
+
+        info['x'].append(x)
+        info['t'].append(numpy.array(timestamps))
+
+        if numpy.any(x - previous < 0.0):
+            self._error = ProcessingError.PMDA_RESTARTED_DURING_JOB
+            return False
 
         return True
 
+    def merge(self, other):
+        self._data.update(other._data)
+        if self._error is None:
+            self._error = other._error
+
+    def mergewindow(self, other):
+        for nodename, theirs in other._data.items():
+            if nodename not in self._data:
+                self._data[nodename] = theirs
+                continue
+
+            info = self._data[nodename]
+
+            # The datapoint at the window boundary is in both windows
+            first = 1 if theirs['t'][0][0] <= info['t'][-1][-1] else 0
+            if first == 0 and theirs['x'][0][0] - info['x'][-1][-1] < 0.0:
+                self._error = ProcessingError.PMDA_RESTARTED_DURING_JOB
+
+            info['x'].append(numpy.concatenate(theirs['x'])[first:])
+            info['t'].append(numpy.concatenate(theirs['t'])[first:])
+
+        if self._error is None:
+            self._error = other._error
+
     def results(self):
 
         if self._error:
@@ -54,23 +103,35 @@ class Catastrophe(Plugin):
         if len(self._data) == 0:
             return {"error": ProcessingError.RAW_COUNTER_UNAVAILABLE}
 
-        vals = None
+        ratios = []
 
         for _, data in self._data.items():
 
-            if data['x'][-1] - data['x'][0] == 0.0:
+            x = numpy.concatenate(data['x'])
+            t = numpy.concatenate(data['t'])
+
+            if x[-1] - x[0] == 0.0:
                 return {"error": ProcessingError.RAW_COUNTER_UNAVAILABLE}
 
             start = 2
-            end = len(data['x'])-2
+            end = len(x)-2
+
+            i = numpy.arange(start+1, end-1)
+            if len(i) == 0:
+                continue
 
-            for i in range(start+1, end-1):
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                a = (x[i] - x[start]) / (t[i] - t[start])
+                b = (x[end] - x[i]) / (t[end] - t[i])
+                ratios.append(b/a)
 
-                a = (data['x'][i] - data['x'][start]) / (data['t'][i] - data['t'][start])
-                b = (data['x'][end] - data['x'][i]) / (data['t'][end] - data['t'][i])
-                vals = b/a if vals == None else min(vals, b/a)
+        ratios = numpy.concatenate(ratios)
 
-        if vals == None:
+        if len(ratios) == 0:
             return {"error": ProcessingError.JOB_TOO_SHORT}
 
-        return {"value": vals}
+        # The ratios that are NaN are ignored unless the first one is
+        if numpy.isnan(ratios[0]) or numpy.all(numpy.isnan(ratios)):
+            return {"value": ratios[0]}
+
+        return {"value": numpy.nanmin(ratios)}
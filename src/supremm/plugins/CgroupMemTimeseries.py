@@ -65,6 +65,21 @@ class CgroupMemTimeseries(Plugin):
 
         return True
 
+    def merge(self, other):
+        self._data.merge(other._data)
+        self._hostdata.update(other._hostdata)
+        self._hostcounts.update(other._hostcounts)
+
+    def mergewindow(self, other):
+        selection = self._data.mergewindow(other._data)
+        TimeseriesAccumulator.mergehostdata(selection, self._hostdata, other._hostdata)
+        for hostidx, counts in other._hostcounts.items():
+            if hostidx in self._hostcounts:
+                for key, count in counts.items():
+                    self._hostcounts[hostidx][key] += count
+            else:
+                self._hostcounts[hostidx] = counts
+
     def results(self):
 
         if len(self._hostdata) != self._job.nodecount:
@@ -75,6 +75,22 @@ class CgroupMemory(Plugin):
 
         return True
 
+    def merge(self, other):
+        self._data.update(other._data)
+        self._hostcounts.update(other._hostcounts)
+
+    def mergewindow(self, other):
+        for nodeidx, stats in other._data.items():
+            if nodeidx not in self._data:
+                self._data[nodeidx] = stats
+                self._hostcounts[nodeidx] = other._hostcounts[nodeidx]
+                continue
+
+            for mine, theirs in zip(self._data[nodeidx], stats):
+                mine.merge(theirs)
+            for key, count in other._hostcounts[nodeidx].items():
+                self._hostcounts[nodeidx][key] += count
+
     def results(self):
 
         if len(self._data) != self._job.nodecount:
@@ -24,6 +24,7 @@ class CpuCategories(Plugin):
     ]])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    totals = (("maxcores",),)
 
     GOOD_THRESHOLD = 0.5
     PINNED_THRESHOLD = 0.9
@@ -38,63 +39,88 @@ class CpuCategories(Plugin):
         super(CpuCategories, self).__init__(job)
         self._timeabove = {}
         self._timebelow = {}
-        self._deltas = {}
+        self._ndeltas = {}
         self._last = {}
         self._maxcores = {}
 
     def process(self, nodemeta, timestamp, data, description):
-        length = len(data[0])
+        return self.process_block(nodemeta, np.array([timestamp]), np.array(data)[np.newaxis], description)
+
+    def process_block(self, nodemeta, timestamps, values, description):
+        length = values.shape[2]
         node = nodemeta.nodename
-        proc = self._job.getdata('proc')
 
         # Initialize dicts to handle multiple nodes and cores
         if node not in self._last:
             self._timeabove[node] = {}
             self._timebelow[node] = {}
-            self._deltas[node] = {}
+            self._ndeltas[node] = 0
             self._maxcores[node] = 0
 
+            proc = self._job.getdata('proc')
             if proc is None or 'cpusallowed' not in proc or node not in proc['cpusallowed'] or 'error' in proc['cpusallowed'][node]:
-                for i in range(length):
-                    self._timeabove[node][i] = 0
-                    self._timebelow[node][i] = 0
-                    self._deltas[node][i] = []
+                cores = range(length)
             else:
-                for i in proc['cpusallowed'][node]:
-                    self._timeabove[node][i] = 0
-                    self._timebelow[node][i] = 0
-                    self._deltas[node][i] = []
+                cores = proc['cpusallowed'][node]
+            for i in cores:
+                self._timeabove[node][i] = 0
+                self._timebelow[node][i] = 0
+
             timeabove = [x for x in self._timeabove[node].keys()]
-            self._last[node] = np.array(data)[:, timeabove]
-            return True
+            self._last[node] = values[0][:, timeabove]
+            values = values[1:]
+            if len(values) == 0:
+                return True
 
+        # The data are datapoint x metric x core
         timeabove = [x for x in self._timeabove[node].keys()]
-        nodedata = np.array(data)[:, timeabove]
-        difference = nodedata - self._last[node]
-        total = np.sum(difference, 0)
-        self._last[node] = nodedata
+        nodedata = values[:, :, timeabove]
+        difference = np.diff(np.concatenate((self._last[node][np.newaxis], nodedata)), axis=0)
+        total = np.sum(difference, 1)
+        self._last[node] = nodedata[-1]
 
-        currentdeltas = difference[0] / total
+        currentdeltas = difference[:, 0, :] / total
 
         if length != 0:
-            counter = 0
-            for i in self._timeabove[node]:
-                self._deltas[node][i].append(currentdeltas[counter])
-                if currentdeltas[counter] > self.DELTA_THRESHOLD:
-                    self._timeabove[node][i] += total[counter]
-                else:
-                    self._timebelow[node][i] += total[counter]
-                counter += 1
-
-            totalusage = np.sum(currentdeltas)
-            if not np.isnan(totalusage) and int(round(totalusage)) > self._maxcores[node]:
-                self._maxcores[node] = int(round(totalusage))
+            above = currentdeltas > self.DELTA_THRESHOLD
+            for counter, i in enumerate(self._timeabove[node]):
+                self._timeabove[node][i] += np.sum(total[above[:, counter], counter])
+                self._timebelow[node][i] += np.sum(total[~above[:, counter], counter])
+            self._ndeltas[node] += len(currentdeltas)
+
+            totalusage = np.sum(currentdeltas, 1)
+            totalusage = totalusage[~np.isnan(totalusage)]
+            if len(totalusage) > 0 and int(round(np.max(totalusage))) > self._maxcores[node]:
+                self._maxcores[node] = int(round(np.max(totalusage)))
         return True
 
+    def merge(self, other):
+        self._timeabove.update(other._timeabove)
+        self._timebelow.update(other._timebelow)
+        self._ndeltas.update(other._ndeltas)
+        self._last.update(other._last)
+        self._maxcores.update(other._maxcores)
+
+    def mergewindow(self, other):
+        for node in other._last:
+            if node not in self._last:
+                self._timeabove[node] = other._timeabove[node]
+                self._timebelow[node] = other._timebelow[node]
+                self._ndeltas[node] = other._ndeltas[node]
+                self._maxcores[node] = other._maxcores[node]
+            else:
+                for cpu, value in other._timeabove[node].items():
+                    self._timeabove[node][cpu] = self._timeabove[node].get(cpu, 0) + value
+                for cpu, value in other._timebelow[node].items():
+                    self._timebelow[node][cpu] = self._timebelow[node].get(cpu, 0) + value
+                self._ndeltas[node] += other._ndeltas[node]
+                self._maxcores[node] = max(self._maxcores[node], other._maxcores[node])
+            self._last[node] = other._last[node]
+
     def results(self):
         duty_cycles = OrderedDict()
         for node in self._timeabove:
-            if len(list(self._deltas[node].values())[0]) < self.MIN_DELTAS:
+            if self._ndeltas[node] < self.MIN_DELTAS:
                 return {"error": ProcessingError.INSUFFICIENT_DATA}
 
             duty_cycles[node] = OrderedDict()
@@ -81,6 +81,27 @@ class CpuPerfCounters(Plugin):
 
         return True
 
+    def merge(self, other):
+        self._first.update(other._first)
+        self._data.update(other._data)
+        self._totalcores += other._totalcores
+        if self._error is None:
+            self._error = other._error
+
+    def mergewindow(self, other):
+        for nodename, first in other._first.items():
+            self._first.setdefault(nodename, first)
+        for nodename, delta in other._data.items():
+            if nodename not in self._data:
+                self._data[nodename] = delta
+                self._totalcores += delta[0].size
+            elif self._data[nodename].shape == delta.shape:
+                self._data[nodename] = self._data[nodename] + delta
+            else:
+                self._error = ProcessingError.RAW_COUNTER_UNAVAILABLE
+        if self._error is None:
+            self._error = other._error
+
     def results(self):
 
         if self._error != None:
@@ -2,10 +2,50 @@
 """ CPU Usage metrics """
 
 from supremm.plugin import Plugin
-from supremm.statistics import calculate_stats
+from supremm.statistics import calculate_stats, SketchStats
 from supremm.errors import ProcessingError
 import numpy
 
+class CoreStats(object):
+    """ The statistics of the per core ratios of each cpu metric. The ratios are
+        added one host at a time. If exact is false they are accumulated in
+        bounded memory and the median is an estimate """
+
+    def __init__(self, nmetrics, exact):
+        self._exact = exact
+        self._cores = 0
+        if exact:
+            self._ratios = []
+        else:
+            self._ratios = [SketchStats() for _ in range(nmetrics)]
+
+    def append(self, hostratios):
+        """ add the ratios for the cores of a host (one row per metric) """
+        self._cores += hostratios.shape[1]
+        if self._exact:
+            self._ratios.append(hostratios)
+        else:
+            for i, stats in enumerate(self._ratios):
+                stats.append(hostratios[i, :])
+
+    def count(self):
+        """ the number of cores that have been added """
+        return self._cores
+
+    def get(self, outnames):
+        """ the statistics for each metric """
+        results = {}
+        if self._exact:
+            ratios = numpy.hstack(self._ratios)
+            for i, name in enumerate(outnames):
+                results[name] = calculate_stats(ratios[i, :])
+        else:
+            for i, name in enumerate(outnames):
+                results[name] = self._ratios[i].get()
+                if self._ratios[i].approximate():
+                    results[name]['med_approx'] = True
+        return results
+
 class CpuUsage(Plugin):
     """ Compute the overall cpu usage for a job """
 
@@ -34,6 +74,11 @@ class CpuUsage(Plugin):
 
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    totals = (("nodecpus", "all", "cnt"), ("jobcpus", "all", "cnt"), ("effcpus", "all"))
+
+    # Jobs with more cores than this have their cpu statistics computed in
+    # bounded memory with an estimated median (marked with med_approx)
+    MAX_EXACT_CORES = 16384
 
     def __init__(self, job):
         super(CpuUsage, self).__init__(job)
@@ -64,9 +109,8 @@ class CpuUsage(Plugin):
     def computeallcpus(self):
         """ overall stats for all cores on the nodes """
 
-        ratios = numpy.empty((self._ncpumetrics, self._totalcores), numpy.double)
+        ratios = CoreStats(self._ncpumetrics, self._totalcores <= self.MAX_EXACT_CORES)
 
-        coreindex = 0
         for host, last in self._last.items():
             try:
                 elapsed = last - self._first[host]
@@ -75,19 +119,14 @@ class CpuUsage(Plugin):
                     # typically happens if the job was very short and the datapoints are too close together
                     return {"error": ProcessingError.JOB_TOO_SHORT}
 
-                coresperhost = len(last[0, :])
-                ratios[:, coreindex:(coreindex+coresperhost)] = 1.0 * elapsed / numpy.sum(elapsed, 0)
-                coreindex += coresperhost
+                ratios.append(1.0 * elapsed / numpy.sum(elapsed, 0))
             except ValueError:
                 # typically happens if the linux pmda crashes during the job
                 return {"error": ProcessingError.INSUFFICIENT_DATA}
- 
-        results = {}
-        for i, name in enumerate(self._outnames):
-            results[name] = calculate_stats(ratios[i, :])
- 
+
+        results = ratios.get(self._outnames)
         results['all'] = {"cnt": self._totalcores}
- 
+
         return results
 
 
@@ -101,9 +140,10 @@ class CpuUsage(Plugin):
 
         cpusallowed = self._job.getdata('proc')['cpusallowed']
 
-        ratios = numpy.empty((self._ncpumetrics, self._totalcores), numpy.double)
+        exact = self._totalcores <= self.MAX_EXACT_CORES
+        ratios = CoreStats(self._ncpumetrics, exact)
+        effective = CoreStats(self._ncpumetrics, exact)
 
-        coreindex = 0
         for host, last in self._last.items():
             elapsed = last - self._first[host]
             if host in cpusallowed and 'error' not in cpusallowed[host]:
@@ -111,29 +151,51 @@ class CpuUsage(Plugin):
             else:
                 return {"error": ProcessingError.CPUSET_UNKNOWN}, {"error": ProcessingError.CPUSET_UNKNOWN}
 
-            coresperhost = len(elapsed[0, :])
-            ratios[:, coreindex:(coreindex+coresperhost)] = 1.0 * elapsed / numpy.sum(elapsed, 0)
-            coreindex += coresperhost
-
-        allowedcores = numpy.array(ratios[:, :coreindex])
-
-        results = {}
-        for i, name in enumerate(self._outnames):
-            results[name] = calculate_stats(allowedcores[i, :])
+            hostratios = 1.0 * elapsed / numpy.sum(elapsed, 0)
+            ratios.append(hostratios)
+            effective.append(numpy.compress(hostratios[1, :] < 0.95, hostratios, axis=1))
 
-        results['all'] = {"cnt": coreindex}
+        results = ratios.get(self._outnames)
+        results['all'] = {"cnt": ratios.count()}
 
-        effective = numpy.compress(allowedcores[1, :] < 0.95, allowedcores , axis=1)
         effectiveresults = {
-            'all': len(effective[i, :])
+            'all': effective.count()
         }
         if effectiveresults['all'] > 0:
-            for i, name in enumerate(self._outnames):
-                effectiveresults[name] = calculate_stats(effective[i, :])
+            effectiveresults.update(effective.get(self._outnames))
 
         return results, effectiveresults
         
 
+    def merge(self, other):
+        if self._ncpumetrics == -1:
+            self._ncpumetrics = other._ncpumetrics
+        elif other._ncpumetrics != -1 and other._ncpumetrics != self._ncpumetrics:
+            # Inconsistent metrics between the hosts, the data from the other
+            # hosts cannot be combined
+            return
+
+        self._first.update(other._first)
+        self._last.update(other._last)
+        self._totalcores += other._totalcores
+
+    def mergewindow(self, other):
+        if self._ncpumetrics == -1:
+            self._ncpumetrics = other._ncpumetrics
+        elif other._ncpumetrics != -1 and other._ncpumetrics != self._ncpumetrics:
+            return
+
+        for nodename, first in other._first.items():
+            self._first.setdefault(nodename, first)
+
+        for nodename, last in other._last.items():
+            if nodename in self._last and self._last[nodename].shape == last.shape:
+                self._last[nodename] = self._last[nodename] + last - other._first[nodename]
+            else:
+                if nodename not in self._last:
+                    self._totalcores += last[0].size
+                self._last[nodename] = last
+
     def results(self):
 
         nhosts = len(self._last)
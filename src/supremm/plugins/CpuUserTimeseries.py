@@ -60,6 +60,17 @@ class CpuUserTimeseries(Plugin):
 
         return True
 
+    def merge(self, other):
+        self._data.merge(other._data)
+        self._hostdata.update(other._hostdata)
+        self._hostdevnames.update(other._hostdevnames)
+
+    def mergewindow(self, other):
+        selection = self._data.mergewindow(other._data)
+        TimeseriesAccumulator.mergehostdata(selection, self._hostdata, other._hostdata)
+        for hostidx, names in other._hostdevnames.items():
+            self._hostdevnames.setdefault(hostidx, names)
+
     def results(self):
 
         values = self._data.get()
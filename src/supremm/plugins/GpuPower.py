@@ -13,6 +13,7 @@ class GpuPower(Plugin):
     requiredMetrics = property(lambda x: ["nvidia.powerused"])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    totals = (("*", "energy", "total"),)
 
     def __init__(self, job):
         super(GpuPower, self).__init__(job)
@@ -33,6 +34,9 @@ class GpuPower(Plugin):
                 'energy': Integrator(timestamp),
                 'names': [x for x in description[0][1]]
             }
+            # The first datapoint only starts the energy integration. In a time window
+            # after the first it is the boundary datapoint that the previous window
+            # already added to the power statistics
             return True
 
         hdata = self._data[nodemeta.nodeindex]
@@ -44,6 +48,17 @@ class GpuPower(Plugin):
 
         return True
 
+    def merge(self, other):
+        self._data.update(other._data)
+
+    def mergewindow(self, other):
+        for nodeidx, theirs in other._data.items():
+            if nodeidx in self._data:
+                self._data[nodeidx]['power'].merge(theirs['power'])
+                self._data[nodeidx]['energy'].merge(theirs['energy'])
+            else:
+                self._data[nodeidx] = theirs
+
     def results(self):
 
         result = {}
@@ -36,11 +36,32 @@ class GpuUsage(Plugin):
 
             self._data[nodemeta.nodename]['names'] = [x for x in description[0][1]]
 
+            if self._job.windowstart is not None:
+                # The first datapoint in a time window was already processed
+                # as the last datapoint of the previous window
+                return True
+
         for idx, statname in enumerate(self.statnames):
             self._data[nodemeta.nodename][statname].append(1.0 * data[idx])
 
         return True
 
+    def merge(self, other):
+        if self.statnames == None:
+            self.statnames = other.statnames
+        self._data.update(other._data)
+
+    def mergewindow(self, other):
+        if self.statnames == None:
+            self.statnames = other.statnames
+        for nodename, theirs in other._data.items():
+            if nodename not in self._data:
+                self._data[nodename] = theirs
+                continue
+            for statname in self.statnames:
+                if statname in theirs:
+                    self._data[nodename][statname].merge(theirs[statname])
+
     def results(self):
 
         result = {}
@@ -15,6 +15,7 @@ class IpmiPower(Plugin):
     requiredMetrics = property(lambda x: ["ipmi.dcmi.power"])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    totals = (("energy", "total"),)
 
     def __init__(self, job):
         super(IpmiPower, self).__init__(job)
@@ -37,6 +38,9 @@ class IpmiPower(Plugin):
                 'power': RollingStats(),
                 'energy': Integrator(timestamp)
             }
+            # The first datapoint only starts the energy integration. In a time window
+            # after the first it is the boundary datapoint that the previous window
+            # already added to the power statistics
             return True
 
         hdata = self._data[nodemeta.nodeindex]
@@ -46,6 +50,17 @@ class IpmiPower(Plugin):
 
         return True
 
+    def merge(self, other):
+        self._data.update(other._data)
+
+    def mergewindow(self, other):
+        for nodeidx, theirs in other._data.items():
+            if nodeidx in self._data:
+                self._data[nodeidx]['power'].merge(theirs['power'])
+                self._data[nodeidx]['energy'].merge(theirs['energy'])
+            else:
+                self._data[nodeidx] = theirs
+
     def results(self):
 
         meanpower = []
@@ -19,6 +19,7 @@ class Lnet(Plugin):
         self._first = {}
         self._data = numpy.empty((job.nodecount, len(self.requiredMetrics)))
         self._hostidx = 0
+        self._rows = {}
 
     def process(self, nodemeta, timestamp, data, description):
 
@@ -29,10 +30,29 @@ class Lnet(Plugin):
             return True
 
         self._data[self._hostidx, :] = vals -  self._first[nodemeta.nodename]
+        self._rows[nodemeta.nodename] = self._hostidx
         self._hostidx += 1
 
         return True
 
+    def merge(self, other):
+        self._first.update(other._first)
+        self._data[self._hostidx:self._hostidx + other._hostidx, :] = other._data[:other._hostidx, :]
+        for nodename, row in other._rows.items():
+            self._rows[nodename] = self._hostidx + row
+        self._hostidx += other._hostidx
+
+    def mergewindow(self, other):
+        for nodename, first in other._first.items():
+            self._first.setdefault(nodename, first)
+        for nodename, row in other._rows.items():
+            if nodename in self._rows:
+                self._data[self._rows[nodename], :] += other._data[row, :]
+            else:
+                self._data[self._hostidx, :] = other._data[row, :]
+                self._rows[nodename] = self._hostidx
+                self._hostidx += 1
+
     def results(self):
 
         output = {}
@@ -34,6 +34,16 @@ class LoadAvg(Plugin):
 
         return True
 
+    def merge(self, other):
+        self._data.update(other._data)
+
+    def mergewindow(self, other):
+        for nodename, stats in other._data.items():
+            if nodename in self._data:
+                self._data[nodename].merge(stats)
+            else:
+                self._data[nodename] = stats
+
     def results(self):
 
         meanval = []
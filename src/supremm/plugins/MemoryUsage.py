@@ -48,6 +48,33 @@ class MemoryUsage(Plugin):
 
         return True
 
+    def merge(self, other):
+        self._data.update(other._data)
+        self._hostcpucounts.update(other._hostcpucounts)
+
+    def mergewindow(self, other):
+        for nodeidx, theirs in other._data.items():
+            if nodeidx not in self._data:
+                self._data[nodeidx] = theirs
+                continue
+
+            hdata = self._data[nodeidx]
+
+            # The value that was held back at the end of this window is
+            # only used if the node has more datapoints in the next window
+            if hdata['usedval'] != None and theirs['usedval'] != None:
+                hdata['used'].append(hdata['usedval'])
+                hdata['usedminus'].append(hdata['usedminusval'])
+
+            hdata['used'].merge(theirs['used'])
+            hdata['usedminus'].merge(theirs['usedminus'])
+            if theirs['usedval'] != None:
+                hdata['usedval'] = theirs['usedval']
+                hdata['usedminusval'] = theirs['usedminusval']
+
+        for nodeidx, count in other._hostcpucounts.items():
+            self._hostcpucounts.setdefault(nodeidx, count)
+
     def results(self):
 
         memused = []
@@ -54,6 +54,34 @@ class NodeMemoryUsage(Plugin):
 
         return True
 
+    def merge(self, other):
+        self._data.update(other._data)
+
+    def mergewindow(self, other):
+        for nodeidx, theirs in other._data.items():
+            if nodeidx not in self._data:
+                self._data[nodeidx] = theirs
+                continue
+
+            hdata = self._data[nodeidx]
+
+            # The value that was held back at the end of this window is
+            # only used if the node has more datapoints in the next window
+            if hdata['freeval'] != None and theirs['freeval'] != None:
+                hdata['free'].append(hdata['freeval'])
+
+            hdata['free'].merge(theirs['free'])
+            if theirs['freeval'] != None:
+                hdata['freeval'] = theirs['freeval']
+
+            if hdata['physmem'] == None:
+                hdata['physmem'] = theirs['physmem']
+
+            if hdata['cached'] == None:
+                hdata['cached'] = theirs['cached']
+            elif theirs['cached'] != None:
+                hdata['cached'].merge(theirs['cached'])
+
     def results(self):
 
         memused = []
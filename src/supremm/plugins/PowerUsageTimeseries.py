@@ -45,6 +45,14 @@ class PowerUsageTimeseries(Plugin):
 
         return True
 
+    def merge(self, other):
+        self._data.merge(other._data)
+        self._hostdata.update(other._hostdata)
+
+    def mergewindow(self, other):
+        self._data.mergewindow(other._data)
+        self._hostdata.update(other._hostdata)
+
     def results(self):
 
         if len(self._hostdata) != self._job.nodecount:
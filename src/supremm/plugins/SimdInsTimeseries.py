@@ -65,6 +65,21 @@ class SimdInsTimeseries(Plugin):
 
         return True
 
+    def merge(self, other):
+        self._data.merge(other._data)
+        self._hostdata.update(other._hostdata)
+        self._hostdevnames.update(other._hostdevnames)
+        if self._error is None:
+            self._error = other._error
+
+    def mergewindow(self, other):
+        selection = self._data.mergewindow(other._data)
+        TimeseriesAccumulator.mergehostdata(selection, self._hostdata, other._hostdata)
+        for hostidx, names in other._hostdevnames.items():
+            self._hostdevnames.setdefault(hostidx, names)
+        if self._error is None:
+            self._error = other._error
+
     def results(self):
 
         if self._error != None:
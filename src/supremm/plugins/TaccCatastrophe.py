@@ -34,6 +34,24 @@ class TaccCatastrophe(Plugin):
 
         return True
 
+    def merge(self, other):
+        self._data.update(other._data)
+        self._values.update(other._values)
+
+    def mergewindow(self, other):
+        for nodename, theirs in other._data.items():
+            if nodename in self._data:
+                info = self._data[nodename]
+                # The counters in the next window start from zero at the datapoint
+                # on the window boundary, which is in both windows
+                offset = info['x'][-1]
+                first = 1 if theirs['t'][0] <= info['t'][-1] else 0
+                info['x'].extend(offset + x for x in theirs['x'][first:])
+                info['t'].extend(theirs['t'][first:])
+            else:
+                self._data[nodename] = theirs
+            self._values[nodename] = other._values[nodename]
+
     def results(self):
 
         if len(self._data) == 0:
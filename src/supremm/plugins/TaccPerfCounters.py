@@ -56,6 +56,26 @@ class TaccPerfCounters(Plugin):
 
         return True
 
+    def merge(self, other):
+        self._last.update(other._last)
+        self._data.update(other._data)
+        self._totalcores += other._totalcores
+        if self._error is None:
+            self._error = other._error
+
+    def mergewindow(self, other):
+        for nodename, delta in other._data.items():
+            if nodename not in self._data:
+                self._data[nodename] = delta
+                self._totalcores += delta[0].size
+            elif self._data[nodename].shape == delta.shape:
+                self._data[nodename] = self._data[nodename] + delta
+            else:
+                self._error = ProcessingError.RAW_COUNTER_UNAVAILABLE
+        self._last.update(other._last)
+        if self._error is None:
+            self._error = other._error
+
     def results(self):
 
         if self._error != None:
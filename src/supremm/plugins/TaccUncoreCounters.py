@@ -42,6 +42,19 @@ class TaccUncoreCounters(Plugin):
 
         return True
 
+    def merge(self, other):
+        self._last.update(other._last)
+        self._data.update(other._data)
+        if self._error is None:
+            self._error = other._error
+
+    def mergewindow(self, other):
+        for nodename, delta in other._data.items():
+            self._data[nodename] = self._data.get(nodename, 0.0) + delta
+        self._last.update(other._last)
+        if self._error is None:
+            self._error = other._error
+
     def results(self):
 
         if self._error != None:
@@ -68,6 +68,20 @@ class UncoreCounters(Plugin):
 
         return True
 
+    def merge(self, other):
+        self._first.update(other._first)
+        self._data.update(other._data)
+        if self._error is None:
+            self._error = other._error
+
+    def mergewindow(self, other):
+        for nodename, first in other._first.items():
+            self._first.setdefault(nodename, first)
+        for nodename, delta in other._data.items():
+            self._data[nodename] = self._data.get(nodename, 0) + delta
+        if self._error is None:
+            self._error = other._error
+
     def results(self):
 
         if self._error != None:
@@ -48,6 +48,18 @@ class HardwareInventory(PreProcessor):
 
         self._job.adddata(self.name, self.data)
 
+    def merge(self, other):
+        self.data.update(other.data)
+        self.cores.extend(other.cores)
+        self._job.adddata(self.name, self.data)
+
+    def mergewindow(self, other):
+        for hostname, hostdata in other.data.items():
+            if hostname not in self.data:
+                self.data[hostname] = hostdata
+                self.cores.append(hostdata['cores'])
+        self._job.adddata(self.name, self.data)
+
     def results(self):
         return {"cores": calculate_stats(self.cores)}
 
@@ -37,6 +37,16 @@ class PerfEvent(PreProcessor):
     def hostend(self):
         self._job.adddata(self.name, {"active": self.perfactive})
 
+    def merge(self, other):
+        # The counters must have been active on every host
+        if self.perfactive != False and other.perfactive is not None:
+            self.perfactive = other.perfactive
+        self._job.adddata(self.name, {"active": self.perfactive})
+
+    def mergewindow(self, other):
+        # The counters must have been active for the whole job
+        self.merge(other)
+
     def results(self):
         return None
 
@@ -171,6 +171,30 @@ class Proc(PreProcessor):
 
         self._job.adddata(self.name, self.output)
 
+    def merge(self, other):
+        self.output['procDump']['constrained'].update(other.output['procDump']['constrained'])
+        self.output['procDump']['unconstrained'].update(other.output['procDump']['unconstrained'])
+        self.output['cpusallowed'].update(other.output['cpusallowed'])
+        for hostname, errors in other.output.get('errors', {}).items():
+            if 'errors' not in self.output:
+                self.output['errors'] = {}
+            self.output['errors'].setdefault(hostname, set()).update(errors)
+
+        self._job.adddata(self.name, self.output)
+
+    def mergewindow(self, other):
+        self.output['procDump']['constrained'].update(other.output['procDump']['constrained'])
+        self.output['procDump']['unconstrained'].update(other.output['procDump']['unconstrained'])
+        # The cpu set for a host is taken from the earliest data available
+        for hostname, cpus in other.output['cpusallowed'].items():
+            self.output['cpusallowed'].setdefault(hostname, cpus)
+        for hostname, errors in other.output.get('errors', {}).items():
+            if 'errors' not in self.output:
+                self.output['errors'] = {}
+            self.output['errors'].setdefault(hostname, set()).update(errors)
+
+        self._job.adddata(self.name, self.output)
+
     def results(self):
 
         constrained = [x[0] for x in self.output['procDump']['constrained'].most_common()]
@@ -44,16 +44,50 @@ def usage(has_mpi):
     print("                                       duration longer than SECONDS (default no limit)")
     print("     --max-duration SECONDS   only process jobs with a duration shorter than SECONDS")
     print("                              (default no limit)")
+    print("     --skip-in-db       apply the node count and duration limits in the accounting")
+    print("                        database query. The skipped jobs are marked as processed")
+    print("                        with the skip reason but no summary is written for them")
     print("     --tag              tag to add to the summarization field in mongo")
     if has_mpi:
         print("     --dump-proclist    whether to output the MPI process information periodically")
     print("  -D --delete T|F       whether to delete job-level archives after processing.")
     print("  -E --extract-only     only extract the job-level archives (sets delete=False)")
     print("  -L --use-lib-extract  use libpcp_pmlogextract.so.1 instead of pmlogextract")
+    print("     --extract-parallel N  run up to N pmlogextract processes at once for the")
+    print("                        nodes of a job (default 1)")
+    print("     --extract-per-fs N limit the concurrent pmlogextract processes that read")
+    print("                        archives from the same filesystem to N (default 0, no limit)")
     print("  -o --output DIR       override the output directory for the job archives.")
     print("                        This directory will be emptied before used and no")
     print("                        subdirectories will be created. This option is ignored ")
     print("                        if multiple jobs are to be processed.")
+    if not has_mpi:
+        print("     --node-parallel NODES  split jobs with more than NODES nodes between the")
+        print("                        worker processes (default 0, never split)")
+        print("     --extract-threads N  run the archive extraction in a separate pool of N")
+        print("                        processes that feeds the summarization processes")
+        print("                        (default 0, extract and summarize in the same process)")
+        print("     --extract-queue N  maximum number of jobs that the extraction may run ahead")
+        print("                        of the summarization when --extract-threads is set (default 2)")
+        print("     --output-threads N number of threads that write the summaries when")
+        print("                        --extract-threads is set (default 1)")
+        print("     --output-queue N   maximum number of summaries waiting to be written when")
+        print("                        --extract-threads is set (default 16)")
+        print("     --schedule-window N  read ahead N jobs and process the most expensive ones")
+        print("                        first (default 0, process in accounting order)")
+        print("     --short-reserve N  number of worker processes that are kept for the cheapest")
+        print("                        jobs in the window when --schedule-window is set (default 1)")
+        print("     --time-parallel SECONDS  split jobs with a walltime longer than SECONDS")
+        print("                        into time windows that are processed by different")
+        print("                        worker processes (default 0, never split)")
+    print("     --fused-scan       read each node archive in a single pass for all of the plugins")
+    print("                        rather than one pass per plugin")
+    print("     --direct-read      read the raw PCP archives for each node directly rather than")
+    print("                        extracting the job data with pmlogextract first. Nodes with")
+    print("                        archives that cannot be read together are still extracted")
+    print("     --sample-interval SECONDS  quick-look mode where the plugins see one datapoint")
+    print("                        every SECONDS rather than every logged sample. The interval")
+    print("                        is recorded in the summarization field of the summary")
     print("     --fail-fast        Don't suppress and log unknown exceptions during processing. Mainly used for testing.")
     print("  -n --dry-run          process jobs but do not write to database.")
     print("  -h --help             display this help message and exit.")
@@ -92,7 +126,21 @@ def getoptions(has_mpi):
         "force_timeout": 2 * 24 * 3600,
         "resource": None,
         "dry_run": False,
-        "fail_fast": False
+        "fail_fast": False,
+        "fused_scan": False,
+        "node_parallel": 0,
+        "time_parallel": 0,
+        "extract_threads": 0,
+        "extract_queue": 2,
+        "output_threads": 1,
+        "output_queue": 16,
+        "schedule_window": 0,
+        "short_reserve": 1,
+        "skip_in_db": False,
+        "direct_read": False,
+        "extract_parallel": 1,
+        "extract_per_fs": 0,
+        "sample_interval": None
     }
 
     opts, _ = getopt(sys.argv[1:], "ABONCbP:M:j:r:t:dqs:e:LT:t:D:Eo:hn",
@@ -124,7 +172,21 @@ def getoptions(has_mpi):
                       "output=",
                       "help",
                       "dry-run",
-                      "fail-fast"])
+                      "fail-fast",
+                      "fused-scan",
+                      "node-parallel=",
+                      "time-parallel=",
+                      "extract-threads=",
+                      "extract-queue=",
+                      "output-threads=",
+                      "output-queue=",
+                      "schedule-window=",
+                      "short-reserve=",
+                      "skip-in-db",
+                      "direct-read",
+                      "extract-parallel=",
+                      "extract-per-fs=",
+                      "sample-interval="])
 
     for opt in opts:
         if opt[0] in ("-j", "--localjobid"):
@@ -157,6 +219,10 @@ def getoptions(has_mpi):
             retdata['process_error'] = int(opt[1])
         if opt[0] in ("-L", "--use-lib-extract"):
             retdata['libextract'] = True
+        if opt[0] == "--extract-parallel":
+            retdata['extract_parallel'] = int(opt[1])
+        if opt[0] == "--extract-per-fs":
+            retdata['extract_per_fs'] = int(opt[1])
         if opt[0] in ("-M", "--max-nodes"):
             retdata['max_nodes'] = int(opt[1])
         if opt[0] == "--max-nodetime":
@@ -167,6 +233,8 @@ def getoptions(has_mpi):
             retdata['min_parallel_duration'] = int(opt[1])
         if opt[0] == "--max-duration":
             retdata['max_duration'] = int(opt[1])
+        if opt[0] == "--skip-in-db":
+            retdata['skip_in_db'] = True
         if opt[0] in ("-T", "--timeout"):
             retdata['force_timeout'] = int(opt[1])
         if opt[0] == "--tag":
@@ -183,6 +251,28 @@ def getoptions(has_mpi):
             retdata["dry_run"] = True
         if opt[0] == "--fail-fast":
             retdata["fail_fast"] = True
+        if opt[0] == "--fused-scan":
+            retdata["fused_scan"] = True
+        if opt[0] == "--direct-read":
+            retdata["direct_read"] = True
+        if opt[0] == "--node-parallel":
+            retdata["node_parallel"] = int(opt[1])
+        if opt[0] == "--time-parallel":
+            retdata["time_parallel"] = int(opt[1])
+        if opt[0] == "--extract-threads":
+            retdata["extract_threads"] = int(opt[1])
+        if opt[0] == "--extract-queue":
+            retdata["extract_queue"] = int(opt[1])
+        if opt[0] == "--output-threads":
+            retdata["output_threads"] = max(1, int(opt[1]))
+        if opt[0] == "--output-queue":
+            retdata["output_queue"] = int(opt[1])
+        if opt[0] == "--schedule-window":
+            retdata["schedule_window"] = int(opt[1])
+        if opt[0] == "--short-reserve":
+            retdata["short_reserve"] = int(opt[1])
+        if opt[0] == "--sample-interval":
+            retdata["sample_interval"] = float(opt[1]) if float(opt[1]) > 0 else None
         if opt[0] in ("-h", "--help"):
             usage(has_mpi)
             sys.exit(0)
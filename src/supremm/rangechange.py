@@ -3,6 +3,10 @@ import numpy
 
 class DataCache(object):
     """ Helper class that remembers the last value that it was passed """
+
+    # The data are kept after process() returns so must not be reused buffers
+    zerocopy = False
+
     def __init__(self):
         self.mdata = None
         self.timestamp = None
@@ -39,6 +43,7 @@ class RangeChange(object):
         self._passthrough = False
         self.accumulator = []
         self.last = []
+        self.instances = []
         self.needsfixup = []
 
     def set_fetched_metrics(self, metriclist):
@@ -47,6 +52,7 @@ class RangeChange(object):
 
         self.accumulator = [None] * len(metriclist)
         self.last = [None] * len(metriclist)
+        self.instances = [None] * len(metriclist)
         self.needsfixup = []
         self._passthrough = True
 
@@ -57,6 +63,87 @@ class RangeChange(object):
             else:
                 self.needsfixup.append(None)
 
+    def normalise_block(self, values, description):
+        """ Convert the data in a block of datapoints (datapoint x metric x
+            instance) in place. The result is the same as calling normalise_data
+            for each datapoint. The arithmetic is done on 64 bit integers as the
+            block values are floating point """
+
+        if self._passthrough:
+            return
+
+        for i, fixup in enumerate(self.needsfixup):
+
+            if fixup is None:
+                continue
+
+            ninstances = len(description[i][0])
+            if ninstances == 0:
+                continue
+
+            block = values[:, i, :ninstances]
+            counts = numpy.rint(block).astype(numpy.uint64)
+
+            start = 0
+            if self.accumulator[i] is None:
+                self.accumulator[i] = numpy.array(counts[0])
+                self.last[i] = numpy.array(counts[0])
+                start = 1
+            elif not numpy.array_equal(self.instances[i], description[i][0]):
+                self.realign(i, description[i][0], counts[0])
+            self.instances[i] = numpy.array(description[i][0])
+
+            if start == len(block):
+                continue
+
+            if start == 1:
+                previous = counts
+            else:
+                previous = numpy.vstack((self.last[i], counts))
+
+            # Unsigned subtraction wraps modulo 2^64 so the deltas are exact
+            deltas = (previous[1:] - previous[:-1]) % numpy.uint64(1 << fixup['range'])
+            totals = numpy.cumsum(numpy.vstack((self.accumulator[i], deltas)), axis=0, dtype=numpy.uint64)
+
+            self.last[i] = counts[-1]
+            block[start:] = totals[1:]
+            self.accumulator[i] = totals[-1]
+
+    def realign(self, i, instances, first):
+        """ Rearrange the state for metric i to match a new list of instances. The
+            instances that were not seen before start from their value in the first
+            datapoint (first) """
+        previous = dict((inst, j) for j, inst in enumerate(self.instances[i]))
+
+        last = numpy.array(first)
+        accumulator = numpy.array(first)
+        for j, inst in enumerate(instances):
+            if inst in previous:
+                last[j] = self.last[i][previous[inst]]
+                accumulator[j] = self.accumulator[i][previous[inst]]
+
+        self.last[i] = last
+        self.accumulator[i] = accumulator
+
+    def wrapperiod(self):
+        """ Returns the shortest time (in seconds) that any of the fetched counters
+            that are converted can take to wrap. This is 2^range / max_rate where
+            max_rate is the largest increase per second given in the normalization
+            settings for the metric. Returns None if a converted metric has no
+            max_rate """
+
+        period = None
+        for fixup in self.needsfixup:
+            if fixup is None:
+                continue
+            if fixup.get('max_rate', 0) <= 0:
+                return None
+            metricperiod = float(1 << fixup['range']) / fixup['max_rate']
+            if period is None or metricperiod < period:
+                period = metricperiod
+
+        return period
+
     @property
     def passthrough(self):
         """ Returns whether the range changer will not modify data """
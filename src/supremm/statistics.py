@@ -19,6 +19,12 @@ class Integrator(object):
         self._total = y * delta_x + self._total
         self._elapsed += delta_x
 
+    def merge(self, other):
+        """ Add the data from an integrator for the following interval """
+        self._total = other._total + self._total
+        self._elapsed += other._elapsed
+        self._x0 = other._x0
+
     @property
     def total(self):
         """ get the total value """
@@ -61,6 +67,22 @@ def calculate_stats(v):
     return res
 
 
+def add_sample_fraction(results, fraction):
+    """ Add the fraction of the job's nodes that the statistics were computed over
+        to each of the statistics dicts in a plugin's results. These are the dicts
+        from calculate_stats() or RollingStats.get(), including ones that plugins
+        have added other values to such as a total """
+    if not isinstance(results, dict):
+        return
+
+    if 'avg' in results and 'cnt' in results and not any(isinstance(x, (dict, list)) for x in results.values()):
+        results['sample_fraction'] = fraction
+        return
+
+    for value in results.values():
+        add_sample_fraction(value, fraction)
+
+
 class RollingStats(object):
     """ Uses Welford's method [1] to compute the mean and stddev of
         a series for data without storing all datapoints.
@@ -95,6 +117,33 @@ class RollingStats(object):
             self.min = numpy.minimum(self.min, x)
             self.max = numpy.maximum(self.max, x)
 
+    def merge(self, other):
+        """ Combine with the statistics from another series using the
+            pairwise update from Chan et al. [2]
+
+            [2] T. F. Chan, G. H. Golub, R. J. LeVeque (1979) Updating Formulae and
+            a Pairwise Algorithm for Computing Sample Variances, Technical Report
+            STAN-CS-79-773, Stanford University
+        """
+        if other._count == 0:
+            return
+
+        if self._count == 0:
+            self.__dict__.update(other.__dict__)
+            return
+
+        count = self._count + other._count
+        delta = other.last_m - self.last_m
+
+        self.m = self.last_m + delta * other._count / count
+        self.s = self.last_s + other.last_s + delta * delta * self._count * other._count / count
+        self.last_m = self.m
+        self.last_s = self.s
+        self._count = count
+
+        self.min = numpy.minimum(self.min, other.min)
+        self.max = numpy.maximum(self.max, other.max)
+
     def get(self):
         """ return a dict with the various statistics """
         return {'avg': self.mean(), 'min': self.min, 'max': self.max, 'cnt': self._count, 'std': math.sqrt(self.variance())}
@@ -118,6 +167,166 @@ class RollingStats(object):
     def __str__(self):
         return str(self.get())
 
+
+class SketchStats(object):
+    """ Accumulates the same statistics as calculate_stats() over a series of
+        data in bounded memory. Data are added with append() (a single value or an
+        array of values) and instances that summarized other parts of the series can
+        be combined with merge().
+
+        The moments are combined with the pairwise updates from Pébay [3] and the
+        median is estimated with a KLL quantile sketch [4] with accuracy parameter k.
+        The median is exact until more than k values have been added, after that
+        its rank error is about 1.7/k.
+
+        [3] P. Pébay (2008) Formulas for Robust, One-Pass Parallel Computation of
+        Covariances and Arbitrary-Order Statistical Moments, Technical Report
+        SAND2008-6212, Sandia National Laboratories
+
+        [4] Z. Karnin, K. Lang, E. Liberty (2016) Optimal Quantile Approximation
+        in Streams, IEEE 57th Annual Symposium on Foundations of Computer Science
+    """
+    def __init__(self, k=1024):
+        self._k = k
+        self._count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._m3 = 0.0
+        self._m4 = 0.0
+        self.min = None
+        self.max = None
+        # The items in compactor h each stand for 2**h of the data
+        self._compactors = [numpy.empty(0)]
+        self._offset = 0
+
+    def append(self, x):
+        """ append a datum or an array of data """
+        values = numpy.asarray(x, dtype=numpy.float64).ravel()
+        if values.size == 0:
+            return
+
+        mean = numpy.mean(values)
+        delta = values - mean
+        delta2 = delta * delta
+        self._addmoments(values.size, mean, numpy.sum(delta2), numpy.sum(delta2 * delta), numpy.sum(delta2 * delta2))
+        self._addrange(numpy.amin(values), numpy.amax(values))
+
+        self._compactors[0] = numpy.concatenate((self._compactors[0], values))
+        self._compress()
+
+    def merge(self, other):
+        """ Combine with the statistics from another series """
+        if other._count == 0:
+            return
+
+        self._addmoments(other._count, other._mean, other._m2, other._m3, other._m4)
+        self._addrange(other.min, other.max)
+
+        for level, items in enumerate(other._compactors):
+            if level == len(self._compactors):
+                self._compactors.append(numpy.empty(0))
+            self._compactors[level] = numpy.concatenate((self._compactors[level], items))
+        self._compress()
+
+    def _addmoments(self, count, mean, m2, m3, m4):
+        """ Combine the central moment sums of another series """
+        total = self._count + count
+        delta = mean - self._mean
+        na = float(self._count)
+        nb = float(count)
+
+        m4 = self._m4 + m4 + delta ** 4 * na * nb * (na * na - na * nb + nb * nb) / total ** 3 \
+                + 6.0 * delta ** 2 * (na * na * m2 + nb * nb * self._m2) / total ** 2 \
+                + 4.0 * delta * (na * m3 - nb * self._m3) / total
+        m3 = self._m3 + m3 + delta ** 3 * na * nb * (na - nb) / total ** 2 \
+                + 3.0 * delta * (na * m2 - nb * self._m2) / total
+        m2 = self._m2 + m2 + delta * delta * na * nb / total
+
+        self._mean += delta * nb / total
+        self._m2 = m2
+        self._m3 = m3
+        self._m4 = m4
+        self._count = total
+
+    def _addrange(self, vmin, vmax):
+        """ Update the minimum and maximum """
+        self.min = vmin if self.min is None else min(self.min, vmin)
+        self.max = vmax if self.max is None else max(self.max, vmax)
+
+    def _capacity(self, level):
+        """ The number of items a compactor holds before half are promoted """
+        depth = len(self._compactors) - level - 1
+        return max(2, int(math.ceil(self._k * (2.0 / 3.0) ** depth)))
+
+    def _compress(self):
+        """ Compact the sketch until every compactor is within its capacity """
+        level = 0
+        while level < len(self._compactors):
+            items = self._compactors[level]
+            if len(items) <= self._capacity(level):
+                level += 1
+                continue
+
+            items = numpy.sort(items)
+            odd = len(items) % 2
+            if level + 1 == len(self._compactors):
+                self._compactors.append(numpy.empty(0))
+
+            # Alternate which of each pair is kept so the errors cancel out
+            self._compactors[level + 1] = numpy.concatenate((self._compactors[level + 1], items[odd + self._offset::2]))
+            self._compactors[level] = items[:odd]
+            self._offset = 1 - self._offset
+            level = 0
+
+    def median(self):
+        """ return the (estimated) median """
+        if len(self._compactors) == 1:
+            return float(numpy.median(self._compactors[0]))
+
+        values = numpy.concatenate(self._compactors)
+        weights = numpy.concatenate([numpy.full(len(items), 2.0 ** level) for level, items in enumerate(self._compactors)])
+        order = numpy.argsort(values, kind="mergesort")
+        cumulative = numpy.cumsum(weights[order])
+        return float(values[order][numpy.searchsorted(cumulative, cumulative[-1] / 2.0)])
+
+    def count(self):
+        """ returns the number of data points that have been processed """
+        return self._count
+
+    def approximate(self):
+        """ returns whether the median is an estimate """
+        return len(self._compactors) > 1
+
+    def get(self):
+        """ return a dict with the same statistics as calculate_stats() """
+        if self._count == 0:
+            return {}
+
+        if self._count == 1 or self.min == self.max:
+            return {'avg': float(self.min), 'cnt': self._count}
+
+        variance = self._m2 / (self._count - 1)
+
+        res = {
+            'max': float(self.max),
+            'avg': float(self._mean),
+            'krt': float(self._count * self._m4 / (self._m2 * self._m2) - 3.0),
+            'min': float(self.min),
+            'skw': float(math.sqrt(self._count) * self._m3 / self._m2 ** 1.5),
+            'cnt': self._count,
+            'med': self.median()
+        }
+        if self._count > 2:
+            res['std'] = math.sqrt(float(variance))
+
+        if self._mean > 0:
+            res['cov'] = math.sqrt(float(variance)) / float(self._mean)
+
+        return res
+
+    def __str__(self):
+        return str(self.get())
+
 def test():
     """ test """
     indata = [0.1, 0.2, 0.3, 0.4, 0.4, 0.5, 0.1, 0.4]
@@ -52,6 +52,69 @@ class TimeseriesAccumulator(object):
         self._count[hostidx] += 1
         return insertidx
 
+    def merge(self, other):
+        """ Add the data for the hosts stored in another accumulator for the same
+            job. Each host must only have data in one of the accumulators """
+        for hostidx in numpy.nonzero(other._count)[0]:
+            self._data[hostidx, :, :] = other._data[hostidx, :, :]
+            self._count[hostidx] = other._count[hostidx]
+
+        if self._samplewindow == None:
+            self._samplewindow = other._samplewindow
+            self._leadout = other._leadout
+
+    def mergewindow(self, other):
+        """ Add the data from an accumulator for the following time window of the
+            same job. The combined series are resampled as if all of the datapoints had
+            been added to this accumulator. The first datapoint in the other accumulator
+            is dropped if it is the same as the last one in this accumulator.
+
+            Returns a dict with the list of datapoints that were kept for each host
+            as (source, index) pairs, where source is 0 for this accumulator and 1 for
+            the other, so that per-datapoint data can be rearranged to match """
+        merged = TimeseriesAccumulator(len(self._count), self._totaltime)
+        selection = {}
+
+        for hostidx in range(len(self._count)):
+            mycount = self._count[hostidx]
+            first = 0
+            if mycount > 0 and other._count[hostidx] > 0 and other._data[hostidx, 0, 0] <= self._data[hostidx, mycount - 1, 0]:
+                first = 1
+
+            points = [(0, i) for i in range(mycount)] + [(1, i) for i in range(first, other._count[hostidx])]
+
+            kept = []
+            for source, idx in points:
+                series = self._data if source == 0 else other._data
+                if merged.adddata(hostidx, series[hostidx, idx, 0], series[hostidx, idx, 1]) is not None:
+                    kept.append((source, idx))
+
+            if kept:
+                selection[hostidx] = kept
+
+        self._data = merged._data
+        self._count = merged._count
+        self._samplewindow = merged._samplewindow
+        self._leadout = merged._leadout
+
+        return selection
+
+    @staticmethod
+    def mergehostdata(selection, mine, theirs):
+        """ Rearrange the per-datapoint host data (dicts of arrays indexed by host
+            then by the insert index returned by adddata) to match the selection
+            returned by mergewindow(). The result is stored in mine """
+        for hostidx, kept in selection.items():
+            sources = (mine.get(hostidx), theirs.get(hostidx))
+            merged = numpy.empty_like(sources[0] if sources[0] is not None else sources[1])
+            for i, (source, idx) in enumerate(kept):
+                merged[i] = sources[source][idx]
+            mine[hostidx] = merged
+
+        for hostidx, hostdata in theirs.items():
+            if hostidx not in mine:
+                mine[hostidx] = hostdata
+
     def gethost(self, hostidx):
         """ return the data series """
         return self._data[hostidx, :self._count[hostidx], :]
@@ -1,6 +1,11 @@
 """ Definition of the summarize API """
+import logging
 from abc import ABC, abstractmethod
 
+from supremm.deadline import SAMPLED, SKIPPED_PLUGINS, NODE_SUBSAMPLED, TRUNCATED
+from supremm.nodesample import scaletotals
+from supremm.statistics import add_sample_fraction
+
 VERSION = "1.0.6"
 TIMESERIES_VERSION = 4
 
@@ -20,6 +25,19 @@ class Summarize(ABC):
         self.version = VERSION
         self.timeseries_version = TIMESERIES_VERSION
 
+        # When set the data are read with one datapoint every sampleinterval seconds
+        self.sampleinterval = None
+
+        # The time budget for the job (a JobDeadline) and the degradations that
+        # were applied when the job went over it
+        self.deadline = None
+        self.degradations = []
+        self.skipped = set()
+        self.nodes_skipped = 0
+        # The skipped nodes that were left out by the node stride rather than
+        # because the summarization was truncated
+        self.nodes_subsampled = 0
+
     @abstractmethod
     def get(self):
         """ Return a dict with the summary information """
@@ -34,6 +52,131 @@ class Summarize(ABC):
         else:
             self.errors[category].add(errormsg)
 
+    def merge(self, other):
+        """ Combine the plugin state and errors from another instance that processed a
+            different subset of the job's nodes. The plugins must have been instantiated
+            from the same lists of classes. """
+        for category, errormsgs in other.errors.items():
+            self.adderror(category, list(errormsgs))
+
+        self.mergedegradations(other)
+        self.nodes_skipped += other.nodes_skipped
+        self.nodes_subsampled += other.nodes_subsampled
+
+        # Preprocessors are always merged since hostend() is called for every host
+        for mine, theirs in zip(self.preprocs, other.preprocs):
+            mine.merge(theirs)
+            if theirs.status != "uninitialized":
+                mine.status = theirs.status
+
+        for mine, theirs in zip(self.alltimestamps + self.firstlast, other.alltimestamps + other.firstlast):
+            if theirs.status != "uninitialized":
+                mine.merge(theirs)
+                mine.status = theirs.status
+
+    def mergewindow(self, other):
+        """ Combine the plugin state and errors from another instance that processed the
+            following time window of the job. The plugins must have been instantiated
+            from the same lists of classes. """
+        for category, errormsgs in other.errors.items():
+            self.adderror(category, list(errormsgs))
+
+        # A node that was skipped in any time window is missing data
+        self.mergedegradations(other)
+        self.nodes_skipped = max(self.nodes_skipped, other.nodes_skipped)
+        self.nodes_subsampled = max(self.nodes_subsampled, other.nodes_subsampled)
+
+        for mine, theirs in zip(self.preprocs, other.preprocs):
+            mine.mergewindow(theirs)
+            if theirs.status != "uninitialized":
+                mine.status = theirs.status
+
+        for mine, theirs in zip(self.alltimestamps + self.firstlast, other.alltimestamps + other.firstlast):
+            if theirs.status != "uninitialized":
+                mine.mergewindow(theirs)
+                mine.status = theirs.status
+
+    def mergedegradations(self, other):
+        """ Combine the degradations that were applied to another part of the job """
+        if other.sampleinterval is not None and (self.sampleinterval is None or other.sampleinterval > self.sampleinterval):
+            self.sampleinterval = other.sampleinterval
+        for degradation in other.degradations:
+            if degradation not in self.degradations:
+                self.degradations.append(degradation)
+        self.skipped.update(other.skipped)
+
+    def checkdeadline(self):
+        """ Apply the degradations for a job that has gone over its time budget.
+            Returns the ones that were applied by this call """
+        if self.deadline is None:
+            return []
+
+        applied = []
+        for degradation in self.deadline.check():
+            if degradation == SAMPLED:
+                if self.sampleinterval is not None and self.sampleinterval >= self.deadline.sampleinterval:
+                    # Already reading the data at a lower resolution
+                    continue
+                self.sampleinterval = self.deadline.sampleinterval
+            elif degradation == SKIPPED_PLUGINS:
+                self.skipped.update(x.name for x in self.alltimestamps + self.firstlast if x.expensive)
+
+            logging.info("%s is over its time budget, summarization is %s", self.job.job_id, degradation)
+            self.degradations.append(degradation)
+            applied.append(degradation)
+
+        return applied
+
+    def running(self, analytics):
+        """ The analytics that have not been skipped """
+        return [x for x in analytics if x.name not in self.skipped]
+
+    def skipnode(self, nodeidx):
+        """ Whether the data for a node are not processed because the job is over
+            its time budget """
+        if TRUNCATED in self.degradations:
+            return True
+        if NODE_SUBSAMPLED in self.degradations:
+            return nodeidx % self.deadline.nodestride != 0
+        return False
+
+    def skippednode(self):
+        """ Count a node that was not processed. The nodes that are left out by the
+            node stride are a sample of the job's nodes, the ones that are dropped
+            once the summarization is truncated are missing data """
+        self.nodes_skipped += 1
+        if TRUNCATED not in self.degradations:
+            self.nodes_subsampled += 1
+
+    def adddegradations(self, summarization):
+        """ Record the degradations in the summarization information """
+        if self.sampleinterval is not None:
+            summarization['sample_interval'] = self.sampleinterval
+        if self.degradations:
+            summarization['degraded'] = list(self.degradations)
+        if self.skipped:
+            summarization['skipped_plugins'] = sorted(self.skipped)
+        if self.nodes_skipped:
+            summarization['nodes_skipped'] = self.nodes_skipped
+
+    def addsampling(self, summarization):
+        """ Record the number of nodes that were summarized if the job was sampled """
+        if self.job.sampled:
+            summarization['sampled_nodes'] = {"count": self.job.nodecount, "total": self.job.totalnodecount}
+
+    def results(self, analytic):
+        """ The results of an analytic. If only a sample of the nodes was summarized the
+            totals over the nodes are scaled up to estimates for the whole job and the
+            results and statistics are annotated with the fraction of nodes they were
+            computed over """
+        result = analytic.results()
+        if self.job.sampled and isinstance(result, dict):
+            fraction = float(self.job.nodecount) / self.job.totalnodecount
+            scaletotals(result, analytic.totals, 1.0 / fraction)
+            add_sample_fraction(result, fraction)
+            result['sample_fraction'] = fraction
+        return result
+
     @abstractmethod
     def process(self):
         """ Main entry point. All of a job's nodes are processed """
@@ -6,6 +6,9 @@
 import logging
 import os
 import time
+import bisect
+import queue
+import threading
 import traceback
 import multiprocessing as mp
 from supremm.config import Config
@@ -28,28 +31,35 @@ def get_jobs(opts, account):
     elif opts['mode'] == "timerange":
         return account.getbytimerange(opts['start'], opts['end'], opts)
     else:
-        return account.get(None, None)
+        return account.get(None, None, opts)
 
 
 def process_summary(m, dbif, opts, job, summarize_time, result):
     summary, mdata, success, summarize_error = result
-    try:
-        # TODO: change behavior so markasdone only happens if this is successful
-        outputter_start = time.time()
-        m.process(summary, mdata)
-        outputter_time = time.time() - outputter_start
+    outputter_start = time.time()
 
-        if not opts['dry_run']:
+    def markasdone():
+        """ Called by the outputter once the summary has been stored """
+        if opts['dry_run']:
+            return
+        try:
             # TODO: this attempts to emulate the old timing behavior. Keep it?
-            process_time = summarize_time + outputter_time
+            process_time = summarize_time + time.time() - outputter_start
             dbif.markasdone(job, success, process_time, summarize_error)
+        except Exception as e:
+            logging.error("Failure marking job %s %s as processed. Error: %s %s", job.job_id, job.jobdir, str(e), traceback.format_exc())
+            if opts["fail_fast"]:
+                raise
+
+    try:
+        m.process(summary, mdata, markasdone)
     except Exception as e:
         logging.error("Failure processing summary for job %s %s. Error: %s %s", job.job_id, job.jobdir, str(e), traceback.format_exc())
         if opts["fail_fast"]:
             raise
 
 
-def processjobs(config, opts, process_pool=None):
+def processjobs(config, opts, process_pool=None, extract_pool=None):
     """ main function that does the work. One run of this function per process """
 
     allpreprocs = loadpreprocessors()
@@ -71,89 +81,383 @@ def processjobs(config, opts, process_pool=None):
 
         logging.debug("Using %s preprocessors", len(preprocs))
         logging.debug("Using %s plugins", len(plugins))
-        if process_pool is not None:
-            process_resource_multiprocessing(resconf, preprocs, plugins, config, opts, datasource, process_pool)
+        if extract_pool is not None:
+            process_resource_pipelined(r, resconf, config, opts, datasource, process_pool, extract_pool)
+        elif process_pool is not None:
+            process_resource_multiprocessing(r, resconf, config, opts, datasource, process_pool)
         else:
             process_resource(resconf, config, opts, datasource)
 
 
 def process_resource(resconf, config, opts, datasource):
-    with outputter.factory(config, resconf, dry_run=opts["dry_run"]) as m:
+    if resconf['batch_system'] == "XDMoD":
+        dbif = XDMoDAcct(resconf['resource_id'], resconf['hostname_mode'], config)
+    else:
+        dbif = DbAcct(resconf['resource_id'], config)
 
-        if resconf['batch_system'] == "XDMoD":
-            dbif = XDMoDAcct(resconf['resource_id'], resconf['hostname_mode'], config)
-        else:
-            dbif = DbAcct(resconf['resource_id'], config)
+    try:
+        with outputter.factory(config, resconf, dry_run=opts["dry_run"]) as m:
+            for job in get_jobs(opts, dbif):
+                try:
+                    summarize_start = time.time()
+                    jobmeta = datasource.presummarize(job, config, resconf, opts)
+                    if not jobmeta:
+                        continue # Extract-only mode for PCP datasource
+                    res = datasource.summarizejob(job, jobmeta, config, opts)
+                    s, mdata, success, s_err = res
+                    summarize_time = time.time() - summarize_start
+                    summary_dict = s.get()
+                except Exception as e:
+                    logging.error("Failure for summarization of job %s %s. Error: %s %s", job.job_id, job.jobdir, str(e), traceback.format_exc())
+                    datasource.cleanup(opts, job)
+                    if opts["fail_fast"]:
+                        raise
+                    else:
+                        continue
+
+                process_summary(m, dbif, opts, job, summarize_time, (summary_dict, mdata, success, s_err))
+                datasource.cleanup(opts, job)
+    finally:
+        # The outputter may mark jobs as done when it is closed
+        dbif.flush()
+
+
+def process_resource_multiprocessing(resname, resconf, config, opts, datasource, pool):
+    if resconf['batch_system'] == "XDMoD":
+        dbif = XDMoDAcct(resconf['resource_id'], resconf['hostname_mode'], config)
+    else:
+        dbif = DbAcct(resconf['resource_id'], config)
 
-        for job in get_jobs(opts, dbif):
+    try:
+        with outputter.factory(config, resconf, dry_run=opts['dry_run']) as m:
+            jobs = get_jobs(opts, dbif)
+
+            # Jobs that have been split into shards that are waiting for results
+            shardedjobs = {}
+
+            it = iter_jobs(jobs, config, resconf, opts, datasource, shardedjobs)
+
+            scheduler = None
+            if opts['schedule_window'] > 0:
+                scheduler = JobScheduler(it, opts['schedule_window'], opts['threads'], opts['short_reserve'])
+                it = iter(scheduler)
+
+            pool_iter = pool.imap_unordered(do_summarize, worker_tasks(resname, it))
+            while True:
+                try:
+                    job, result, summarize_time = pool_iter.next(timeout=600000)
+                except StopIteration:
+                    break
+
+                if scheduler is not None:
+                    scheduler.done(job)
+
+                if job.shardid is not None:
+                    merged = merge_shard_result(shardedjobs, job, result, summarize_time, config, opts, datasource)
+                    if merged is None:
+                        continue
+                    job, result, summarize_time = merged
+
+                if result is not None:
+                    process_summary(m, dbif, opts, job, summarize_time, result)
+                    datasource.cleanup(opts, job)
+                else:
+                    datasource.cleanup(opts, job)
+    finally:
+        # The outputter may mark jobs as done when it is closed
+        dbif.flush()
+
+
+def jobcost(job):
+    """ Estimate of the relative processing time for a job (or job shard) """
+    narchives = sum(len(archives) for _, archives in job.rawarchives())
+    return job.shardnodecount * max(job.walltime, 1) * max(narchives, 1)
+
+
+class JobScheduler(object):
+    """
+    Reorders the work items from iter_jobs() so that the most expensive jobs are
+    started first. Up to window items are read ahead from the job iterator. Only
+    nworkers items are handed out at a time (done() must be called for each
+    completed job) and reserve of the workers are kept for the cheapest jobs
+    in the window so that short jobs are not held up behind the long ones.
+    """
+
+    def __init__(self, items, window, nworkers, reserve):
+        self._items = iter(items)
+        self._window = window
+        self._exhausted = False
+        self._pending = []
+        self._order = 0
+        self._slots = threading.Semaphore(nworkers)
+        self._lock = threading.Lock()
+        self._largelimit = max(1, nworkers - reserve)
+        self._largerunning = 0
+        self._running = {}
+
+    @staticmethod
+    def _key(job):
+        return job.job_pk_id, job.shardid
+
+    def _fill(self):
+        while not self._exhausted and len(self._pending) < self._window:
             try:
-                summarize_start = time.time()
-                jobmeta = datasource.presummarize(job, config, resconf, opts)
-                if not jobmeta:
-                    continue # Extract-only mode for PCP datasource
-                res = datasource.summarizejob(job, jobmeta, config, opts)
-                s, mdata, success, s_err = res
-                summarize_time = time.time() - summarize_start
-                summary_dict = s.get()
-            except Exception as e:
-                logging.error("Failure for summarization of job %s %s. Error: %s %s", job.job_id, job.jobdir, str(e), traceback.format_exc())
-                datasource.cleanup(opts, job)
-                if opts["fail_fast"]:
-                    raise
+                item = next(self._items)
+            except StopIteration:
+                self._exhausted = True
+                break
+            # The counter keeps the accounting order for jobs with the same cost
+            self._order += 1
+            bisect.insort(self._pending, (jobcost(item), -self._order, item))
+
+    def __iter__(self):
+        while True:
+            self._slots.acquire()
+            self._fill()
+            if not self._pending:
+                return
+
+            with self._lock:
+                if self._largerunning < self._largelimit:
+                    _, _, item = self._pending.pop()
+                    self._largerunning += 1
+                    self._running[self._key(item)] = True
                 else:
-                    continue
+                    _, _, item = self._pending.pop(0)
+                    self._running[self._key(item)] = False
 
-            process_summary(m, dbif, opts, job, summarize_time, (summary_dict, mdata, success, s_err))
-            datasource.cleanup(opts, job)
+            yield item
 
+    def done(self, job):
+        """ Must be called when the processing for a job has completed """
+        with self._lock:
+            if self._running.pop(self._key(job), False):
+                self._largerunning -= 1
+        self._slots.release()
 
-def process_resource_multiprocessing(resconf, preprocs, plugins, config, opts, datasource, pool):
-    with outputter.factory(config, resconf, dry_run=opts['dry_run']) as m:
-        if resconf['batch_system'] == "XDMoD":
-             dbif = XDMoDAcct(resconf['resource_id'], resconf['hostname_mode'], config)
-        else:
-            dbif = DbAcct(resconf['resource_id'], config)
 
-        jobs = get_jobs(opts, dbif)
+def process_resource_pipelined(resname, resconf, config, opts, datasource, pool, extract_pool):
+    """
+    Process the jobs with separate stages for the archive extraction, the summarization
+    and the output. Each stage runs concurrently with the others. The extraction is allowed
+    to run up to extract_queue jobs ahead of the summarization and the summaries wait in a
+    queue of at most output_queue entries for the output threads.
+    """
+    if resconf['batch_system'] == "XDMoD":
+        dbif = XDMoDAcct(resconf['resource_id'], resconf['hostname_mode'], config)
+    else:
+        dbif = DbAcct(resconf['resource_id'], config)
+
+    jobs = get_jobs(opts, dbif)
+
+    # Each job (or job shard) holds a slot from when it is sent for extraction
+    # until its summary is sent to the output queue
+    slots = threading.Semaphore(opts['threads'] + opts['extract_queue'])
+    outqueue = queue.Queue(opts['output_queue'])
+
+    outputthreads = [threading.Thread(target=output_stage, args=(outqueue, config, resconf, opts, datasource)) for _ in range(opts['output_threads'])]
+    for thread in outputthreads:
+        thread.start()
 
-        it = iter_jobs(jobs, config, resconf, plugins, preprocs, opts, datasource)
-        pool_iter = pool.imap_unordered(do_summarize, it)
+    # Jobs that have been split into shards that are waiting for results
+    shardedjobs = {}
+
+    try:
+        it = throttle(iter_jobs(jobs, config, resconf, opts, datasource, shardedjobs), slots)
+        extract_iter = extract_pool.imap_unordered(do_extract, worker_tasks(resname, it))
+        pool_iter = pool.imap_unordered(do_summarize_extracted, extract_iter)
         while True:
             try:
                 job, result, summarize_time = pool_iter.next(timeout=600000)
             except StopIteration:
                 break
 
-            if result is not None:
-                process_summary(m, dbif, opts, job, summarize_time, result)
-                datasource.cleanup(opts, job)
-            else:
+            slots.release()
+
+            if job.shardid is not None:
+                merged = merge_shard_result(shardedjobs, job, result, summarize_time, config, opts, datasource)
+                if merged is None:
+                    continue
+                job, result, summarize_time = merged
+
+            outqueue.put((job, result, summarize_time))
+    finally:
+        for _ in outputthreads:
+            outqueue.put(None)
+        for thread in outputthreads:
+            thread.join()
+
+
+def output_stage(outqueue, config, resconf, opts, datasource):
+    """
+    Output thread for the pipelined mode. Writes the job summaries from the queue and
+    marks the jobs as processed until a None entry is received.
+    """
+    if resconf['batch_system'] == "XDMoD":
+        dbif = XDMoDAcct(resconf['resource_id'], resconf['hostname_mode'], config)
+    else:
+        dbif = DbAcct(resconf['resource_id'], config)
+
+    try:
+        with outputter.factory(config, resconf, dry_run=opts['dry_run']) as m:
+            while True:
+                item = outqueue.get()
+                if item is None:
+                    break
+
+                job, result, summarize_time = item
+                if result is not None:
+                    process_summary(m, dbif, opts, job, summarize_time, result)
                 datasource.cleanup(opts, job)
+    finally:
+        # The outputter may mark jobs as done when it is closed
+        dbif.flush()
+
 
+def throttle(iterable, semaphore):
+    """ Acquire the semaphore for each item before it is passed on """
+    for item in iterable:
+        semaphore.acquire()
+        yield item
 
-def iter_jobs(jobs, config, resconf, plugins, preprocs, opts, datasource):
+
+def iter_jobs(jobs, config, resconf, opts, datasource, shardedjobs=None):
     """
-    Combines the db cursor job iterator with the other information needed to pass to summarizejob.
+    Iterate over the jobs from the db cursor. Jobs that the datasource splits into shards
+    are recorded in shardedjobs and each shard is sent to the workers separately.
     """
     for job in jobs:
-        yield job, config, resconf, plugins, preprocs, opts, datasource
+        shards = []
+        if shardedjobs is not None:
+            shards = datasource.shardjob(job, config, resconf, opts)
+
+        if not shards:
+            yield job
+            continue
+
+        shardedjobs[job.job_pk_id] = (job, len(shards), [])
+        for shard in shards:
+            yield shard
+
+
+def worker_tasks(resname, jobs):
+    """ The work items sent to the worker processes are the resource name and the job """
+    for job in jobs:
+        yield resname, job
+
+
+# State for the worker processes that is set up once by init_worker() rather
+# than being sent with every job
+_worker = {}
+
+
+def init_worker(config, opts):
+    """
+    Initializer for the worker processes. The plugins are loaded here and the
+    datasource for each resource is created when the first job for it is received.
+    """
+    _worker['config'] = config
+    _worker['opts'] = opts
+    _worker['preprocs'] = loadpreprocessors()
+    _worker['plugins'] = loadplugins()
+    _worker['resources'] = {}
+
+
+def worker_resource(resname):
+    """ Return the resource configuration and datasource for a worker process """
+    resources = _worker['resources']
+    if resname not in resources:
+        resconf = dict(_worker['config'].resourceconfigs())[resname]
+        resconf = override_defaults(resconf, _worker['opts'])
+        preprocs, plugins = filter_plugins(resconf, _worker['preprocs'], _worker['plugins'])
+        resources[resname] = (resconf, DatasourceFactory(preprocs, plugins, resconf))
+
+    return resources[resname]
+
+
+def merge_shard_result(shardedjobs, shard, result, summarize_time, config, opts, datasource):
+    """
+    Store the result for a job shard. Once the results for all of the shards of the job have
+    been received they are combined and the job, result and summarize time are returned.
+    """
+    job, nshards, shardresults = shardedjobs[shard.job_pk_id]
+    shardresults.append((shard, result, summarize_time))
+    job.addshardjobdir(shard)
+    if len(shardresults) < nshards:
+        return None
+
+    del shardedjobs[shard.job_pk_id]
+
+    if any(r is None for _, r, _ in shardresults):
+        logging.error("Failure for summarization of a shard of job %s %s", job.job_id, job.jobdir)
+        return job, None, None
+
+    try:
+        merge_start = time.time()
+        s, mdata, success, s_err = datasource.mergeshards(job, [(x, r) for x, r, _ in shardresults], config, opts)
+        summary_dict = s.get()
+        # The shards were processed concurrently so the time is from the slowest one
+        summarize_time = max(t for _, _, t in shardresults) + time.time() - merge_start
+    except Exception as e:
+        logging.error("Failure for summarization of job %s %s. Error: %s %s", job.job_id, job.jobdir, str(e), traceback.format_exc())
+        if opts["fail_fast"]:
+            raise
+        return job, None, None
+
+    return job, (summary_dict, mdata, success, s_err), summarize_time
 
 
 def do_summarize(args):
     """
     used in a separate process
     """
-    job, config, resconf, plugins, preprocs, opts, datasource = args
+    return do_summarize_extracted(do_extract(args))
+
+
+def do_extract(args):
+    """
+    Run the checks and archive extraction for a job. Used in a separate process.
+    Job shards are extracted by summarizeshard() so are passed straight through.
+    """
+    resname, job = args
+    config, opts = _worker['config'], _worker['opts']
+    resconf, datasource = worker_resource(resname)
+    extract_start = time.time()
+    jobmeta = None
+
+    if job.shardid is None:
+        try:
+            jobmeta = datasource.presummarize(job, config, resconf, opts)
+        except Exception as e:
+            logging.error("Failure for summarization of job %s %s. Error: %s %s", job.job_id, job.jobdir, str(e), traceback.format_exc())
+            if opts["fail_fast"]:
+                raise
+
+    return args, jobmeta, time.time() - extract_start
+
+
+def do_summarize_extracted(extracted):
+    """
+    Summarize a job that was processed by do_extract(). Used in a separate process.
+    """
+    args, jobmeta, extract_time = extracted
+    resname, job = args
+    config, opts = _worker['config'], _worker['opts']
+    resconf, datasource = worker_resource(resname)
     try:
         summarize_start = time.time()
-        jobmeta = datasource.presummarize(job, config, resconf, opts)
+        if job.shardid is not None:
+            # The summary is combined with the other shards in the main process
+            res = datasource.summarizeshard(job, config, resconf, opts)
+            return job, res, time.time() - summarize_start
+
         if not jobmeta:
-            return job, None, None  # Extract-only mode for PCP datasource
+            return job, None, None  # Extract-only mode for PCP datasource or extract failure
         res = datasource.summarizejob(job, jobmeta, config, opts)
         if res is None:
             return job, None, None  # Extract-only mode
         s, mdata, success, s_err = res
-        summarize_time = time.time() - summarize_start
+        summarize_time = extract_time + time.time() - summarize_start
         # Ensure Summarize.get() is called on worker process since it is cpu-intensive
         summary_dict = s.get()
     except Exception as e:
@@ -177,13 +481,21 @@ def main():
 
     threads = opts['threads']
 
-    process_pool = mp.Pool(threads) if threads > 1 else None
-    processjobs(config, opts, process_pool)
+    extract_pool = None
+    if opts['extract_threads'] > 0:
+        extract_pool = mp.Pool(opts['extract_threads'], init_worker, (config, opts))
+
+    process_pool = None
+    if threads > 1 or extract_pool is not None:
+        process_pool = mp.Pool(threads, init_worker, (config, opts))
+
+    processjobs(config, opts, process_pool, extract_pool)
 
-    if process_pool is not None:
-        # wait for all processes to finish
-        process_pool.close()
-        process_pool.join()
+    for pool in (extract_pool, process_pool):
+        if pool is not None:
+            # wait for all processes to finish
+            pool.close()
+            pool.join()
 
 
 if __name__ == "__main__":
@@ -48,126 +48,130 @@ def processjobs(config, opts, procid, comm):
         logging.debug("Using %s preprocessors", len(preprocs))
         logging.debug("Using %s plugins", len(plugins))
 
-        with outputter.factory(config, resconf, dry_run=opts["dry_run"]) as m:
-
-            if resconf['batch_system'] == "XDMoD":
-                dbif = XDMoDAcct(resconf['resource_id'], resconf['hostname_mode'], config)
-            else:
-                dbif = DbAcct(resconf['resource_id'], config)
-
-            list_procs = 0
-
-            # Master
-            if procid == 0:
-                getjobs = {}
-                if opts['mode'] == "single":
-                    getjobs['cmd'] = dbif.getbylocaljobid
-                    getjobs['opts'] = [opts['local_job_id'],]
-                elif opts['mode'] == "timerange":
-                    getjobs['cmd'] = dbif.getbytimerange
-                    getjobs['opts'] = [opts['start'], opts['end'], opts]
-                else:
-                    getjobs['cmd'] = dbif.get
-                    getjobs['opts'] = [None, None]
-
-                logging.debug("MASTER STARTING")
-                numworkers = opts['threads']-1
-                numsent = 0
-                numreceived = 0
-
-
-                for job in getjobs['cmd'](*(getjobs['opts'])):
-                    if numsent >= numworkers:
-                        list_procs += 1
-                        if opts['dump_proclist'] and (list_procs == 1 or list_procs == 1000):
-                            # Once all ranks are going, dump the process list for debugging
-                            logging.info("Dumping process list")
-                            allpinfo = {}
-                            for proc in psutil.process_iter():
-                                try:
-                                    pinfo = proc.as_dict()
-                                except psutil.NoSuchProcess:
-                                    pass
-                                else:
-                                    allpinfo[pinfo['pid']] = pinfo
-
-                            with open("rank-{}_{}.proclist".format(procid, list_procs), 'w') as outfile:
-                                json.dump(allpinfo, outfile, indent=2)
-
-                        # Wait for a worker to be done and then send more work
-                        process = comm.recv(source=MPI.ANY_SOURCE, tag=1)
-                        numreceived += 1
-                        comm.send(job, dest=process, tag=1)
-                        numsent += 1
-                        logging.debug("Sent new job: %d sent, %d received", numsent, numreceived)
+        if resconf['batch_system'] == "XDMoD":
+            dbif = XDMoDAcct(resconf['resource_id'], resconf['hostname_mode'], config)
+        else:
+            dbif = DbAcct(resconf['resource_id'], config)
+
+        try:
+            with outputter.factory(config, resconf, dry_run=opts["dry_run"]) as m:
+
+                list_procs = 0
+
+                # Master
+                if procid == 0:
+                    getjobs = {}
+                    if opts['mode'] == "single":
+                        getjobs['cmd'] = dbif.getbylocaljobid
+                        getjobs['opts'] = [opts['local_job_id'],]
+                    elif opts['mode'] == "timerange":
+                        getjobs['cmd'] = dbif.getbytimerange
+                        getjobs['opts'] = [opts['start'], opts['end'], opts]
                     else:
-                        # Initial batch
-                        comm.send(job, dest=numsent+1, tag=1)
-                        numsent += 1
-                        logging.debug("Initial Batch: %d sent, %d received", numsent, numreceived)
-
-                logging.info("After all jobs sent: %d sent, %d received", numsent, numreceived)
-
-                # Get leftover results
-                while numsent > numreceived:
-                    comm.recv(source=MPI.ANY_SOURCE, tag=1)
-                    numreceived += 1
-                    logging.debug("Getting leftovers. %d sent, %d received", numsent, numreceived)
-
-                # Shut them down
-                for worker in range(numworkers):
-                    logging.debug("Shutting down: %d", worker+1)
-                    comm.send(None, dest=worker+1, tag=1)
-
-            # Worker
-            else:
-                sendtime = time.time()
-                midtime = time.time()
-                recvtime = time.time()
-                logging.debug("WORKER %d STARTING", procid)
-                while True:
-                    recvtries = 0
-                    while not comm.Iprobe(source=0, tag=1):
-                        if recvtries < 1000:
-                            recvtries += 1
-                            continue
-                        # Sleep so we can instrument how efficient we are
-                        # Otherwise, workers spin on exit at the hidden mpi_finalize call.
-                        # If you care about maximum performance and don't care about wasted cycles, remove the Iprobe/sleep loop
-                        # Empirically, a tight loop with time.sleep(0.001) uses ~1% CPU
-                        time.sleep(0.001)
-                    job = comm.recv(source=0, tag=1)
+                        getjobs['cmd'] = dbif.get
+                        getjobs['opts'] = [None, None, opts]
+
+                    logging.debug("MASTER STARTING")
+                    numworkers = opts['threads']-1
+                    numsent = 0
+                    numreceived = 0
+
+
+                    for job in getjobs['cmd'](*(getjobs['opts'])):
+                        if numsent >= numworkers:
+                            list_procs += 1
+                            if opts['dump_proclist'] and (list_procs == 1 or list_procs == 1000):
+                                # Once all ranks are going, dump the process list for debugging
+                                logging.info("Dumping process list")
+                                allpinfo = {}
+                                for proc in psutil.process_iter():
+                                    try:
+                                        pinfo = proc.as_dict()
+                                    except psutil.NoSuchProcess:
+                                        pass
+                                    else:
+                                        allpinfo[pinfo['pid']] = pinfo
+
+                                with open("rank-{}_{}.proclist".format(procid, list_procs), 'w') as outfile:
+                                    json.dump(allpinfo, outfile, indent=2)
+
+                            # Wait for a worker to be done and then send more work
+                            process = comm.recv(source=MPI.ANY_SOURCE, tag=1)
+                            numreceived += 1
+                            comm.send(job, dest=process, tag=1)
+                            numsent += 1
+                            logging.debug("Sent new job: %d sent, %d received", numsent, numreceived)
+                        else:
+                            # Initial batch
+                            comm.send(job, dest=numsent+1, tag=1)
+                            numsent += 1
+                            logging.debug("Initial Batch: %d sent, %d received", numsent, numreceived)
+
+                    logging.info("After all jobs sent: %d sent, %d received", numsent, numreceived)
+
+                    # Get leftover results
+                    while numsent > numreceived:
+                        comm.recv(source=MPI.ANY_SOURCE, tag=1)
+                        numreceived += 1
+                        logging.debug("Getting leftovers. %d sent, %d received", numsent, numreceived)
+
+                    # Shut them down
+                    for worker in range(numworkers):
+                        logging.debug("Shutting down: %d", worker+1)
+                        comm.send(None, dest=worker+1, tag=1)
+
+                # Worker
+                else:
+                    sendtime = time.time()
+                    midtime = time.time()
                     recvtime = time.time()
-                    mpisendtime = midtime-sendtime
-                    mpirecvtime = recvtime-midtime
-                    if (mpisendtime+mpirecvtime) > 2:
-                        logging.warning("MPI send/recv took %s/%s", mpisendtime, mpirecvtime)
-                    if job != None:
-                        logging.debug("Rank: %s, Starting: %s", procid, job.job_id)
-                        process_job(config, dbif, job, m, opts, plugins, preprocs, resconf, datasource)
-                        logging.debug("Rank: %s, Finished: %s", procid, job.job_id)
-                        sendtime = time.time()
-                        comm.send(procid, dest=0, tag=1)
-                        midtime = time.time()
-
-                        list_procs += 1
-                        if opts['dump_proclist'] and (list_procs == 1 or list_procs == 10):
-                            # Once all ranks are going, dump the process list for debugging
-                            logging.info("Dumping process list")
-                            allpinfo = {}
-                            for proc in psutil.process_iter():
-                                try:
-                                    pinfo = proc.as_dict()
-                                except psutil.NoSuchProcess:
-                                    pass
-                                else:
-                                    allpinfo[pinfo['pid']] = pinfo
-
-                            with open("rank-{}_{}.proclist".format(procid, list_procs), 'w') as outfile:
-                                json.dump(allpinfo, outfile, indent=2)
-                    else:
-                        # Got shutdown message
-                        break
+                    logging.debug("WORKER %d STARTING", procid)
+                    while True:
+                        recvtries = 0
+                        while not comm.Iprobe(source=0, tag=1):
+                            if recvtries < 1000:
+                                recvtries += 1
+                                continue
+                            # Sleep so we can instrument how efficient we are
+                            # Otherwise, workers spin on exit at the hidden mpi_finalize call.
+                            # If you care about maximum performance and don't care about wasted cycles, remove the Iprobe/sleep loop
+                            # Empirically, a tight loop with time.sleep(0.001) uses ~1% CPU
+                            time.sleep(0.001)
+                        job = comm.recv(source=0, tag=1)
+                        recvtime = time.time()
+                        mpisendtime = midtime-sendtime
+                        mpirecvtime = recvtime-midtime
+                        if (mpisendtime+mpirecvtime) > 2:
+                            logging.warning("MPI send/recv took %s/%s", mpisendtime, mpirecvtime)
+                        if job != None:
+                            logging.debug("Rank: %s, Starting: %s", procid, job.job_id)
+                            process_job(config, dbif, job, m, opts, plugins, preprocs, resconf, datasource)
+                            logging.debug("Rank: %s, Finished: %s", procid, job.job_id)
+                            sendtime = time.time()
+                            comm.send(procid, dest=0, tag=1)
+                            midtime = time.time()
+
+                            list_procs += 1
+                            if opts['dump_proclist'] and (list_procs == 1 or list_procs == 10):
+                                # Once all ranks are going, dump the process list for debugging
+                                logging.info("Dumping process list")
+                                allpinfo = {}
+                                for proc in psutil.process_iter():
+                                    try:
+                                        pinfo = proc.as_dict()
+                                    except psutil.NoSuchProcess:
+                                        pass
+                                    else:
+                                        allpinfo[pinfo['pid']] = pinfo
+
+                                with open("rank-{}_{}.proclist".format(procid, list_procs), 'w') as outfile:
+                                    json.dump(allpinfo, outfile, indent=2)
+                        else:
+                            # Got shutdown message
+                            break
+        finally:
+            # The outputter may mark jobs as done when it is closed
+            dbif.flush()
 
 
 def process_job(config, dbif, job, m, opts, plugins, preprocs, resconf, datasource):
@@ -182,11 +186,11 @@ def process_job(config, dbif, job, m, opts, plugins, preprocs, resconf, datasour
         summary, mdata, success, summarize_error = res
         summarize_time = time.time() - summarize_start
 
-        # TODO: change behavior so markasdone only happens if this is successful
-        m.process(summary.get(), mdata)
+        def markasdone():
+            if not opts['dry_run']:
+                dbif.markasdone(job, success, summarize_time, summarize_error)
 
-        if not opts['dry_run']:
-            dbif.markasdone(job, success, summarize_time, summarize_error)
+        m.process(summary.get(), mdata, markasdone)
 
     except Exception as e:
         logging.error("Failure for job %s %s. Error: %s %s", job.job_id, job.jobdir, str(e), traceback.format_exc())
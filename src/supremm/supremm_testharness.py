@@ -76,6 +76,8 @@ class MockJob(object):
         self.end_str = "end"
         self.walltime = 9751
         self.nodecount = len(archivelist)
+        self.totalnodecount = self.nodecount
+        self.sampled = False
         self.acct = {"end_time": 12312, "id": 1, "uid": opts['acct_uid'] if 'acct_uid' in opts else "sdf", "user": "werqw", "partition": "test", "local_job_id": "1234", "resource_manager": "slurm"}
         self.nodes = [os.path.basename(x) for x in archivelist]
         self._data = {}
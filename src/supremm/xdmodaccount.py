@@ -1,7 +1,7 @@
 """ Implementation for account reader that gets data from the XDMoD datawarehouse """
 from pymysql import OperationalError, ProgrammingError
 from supremm.config import Config
-from supremm.accounting import Accounting, ArchiveCache
+from supremm.accounting import Accounting, ArchiveCache, StatusBatch
 from supremm.scripthelpers import getdbconnection
 from supremm.Job import Job
 from supremm.errors import ProcessingError
@@ -9,6 +9,10 @@ import logging
 
 class XDMoDAcct(Accounting):
     """ account reader that gets data from xdmod datawarehouse """
+
+    # Number of job records for which the hosts and archives are looked up together
+    PREFETCH_JOBS = 500
+
     def __init__(self, resource_id, hostname_mode, config):
         super(XDMoDAcct, self).__init__(resource_id, config)
 
@@ -118,12 +122,13 @@ class XDMoDAcct(Accounting):
                     jf.resource_id = %s
             """
 
+        # The {1} placeholders are replaced with the list of job ids
         self.hostquery = """
             SELECT 
-                tt.hostname, tt.filename
+                tt.hostname, tt.filename, tt.job_id
             FROM (
             SELECT 
-                h.hostname, ap.filename, na.start_time_ts
+                h.hostname, ap.filename, na.start_time_ts, jh.job_id
             FROM
                 modw_supremm.`archive_paths` ap,
                 modw_supremm.`archives_nodelevel` na,
@@ -132,7 +137,7 @@ class XDMoDAcct(Accounting):
                 modw.`{0}` j
             WHERE
                 j.job_id = jh.job_id
-                    AND jh.job_id = %s
+                    AND jh.job_id IN ({1})
                     AND jh.host_id = h.id
                     AND na.host_id = h.id
                     AND ((j.start_time_ts BETWEEN na.start_time_ts AND na.end_time_ts)
@@ -142,7 +147,7 @@ class XDMoDAcct(Accounting):
                     AND ap.id = na.archive_id 
             UNION 
             SELECT 
-                h.hostname, ap.filename, ja.start_time_ts
+                h.hostname, ap.filename, ja.start_time_ts, jh.job_id
             FROM
                 modw_supremm.`archive_paths` ap,
                 modw_supremm.`archives_joblevel` ja,
@@ -151,30 +156,32 @@ class XDMoDAcct(Accounting):
                 modw.`{0}` j
             WHERE
                 j.job_id = jh.job_id
-                    AND jh.job_id = %s
+                    AND jh.job_id IN ({1})
                     AND jh.host_id = h.id
                     AND ja.host_id = h.id
                     AND ja.local_job_id_raw = j.local_job_id_raw
                     AND ja.archive_id = ap.id
             ) tt ORDER BY 1 ASC, tt.start_time_ts ASC
-        """.format(jobfacttable)
+        """.replace("{0}", jobfacttable)
 
         self.nodenamequery = """
             SELECT
-                h.hostname
+                h.hostname, jh.job_id
             FROM
                 modw.`hosts` h,
                 modw.`jobhosts` jh,
                 modw.`{0}` j
             WHERE
                 j.job_id = jh.job_id
-                AND jh.job_id = %s
-                AND jh.host_id = h.id;
-        """.format(jobfacttable)
+                AND jh.job_id IN ({1})
+                AND jh.host_id = h.id
+            ORDER BY jh.job_id ASC, jh.order_id ASC;
+        """.replace("{0}", jobfacttable)
 
         self.con = None
         self.hostcon = None
         self.madcon = None
+        self._statusbatch = StatusBatch(self._writestatus)
         self.nodenamecon = None
 
     def detectXdmodSchema(self):
@@ -255,12 +262,12 @@ class XDMoDAcct(Accounting):
             job_selector = " AND( " + job_selector + " )"
             query += job_selector
 
-        query += " ORDER BY jf.end_time_ts ASC"
+        query, data = self.applyskipchecks(query, data, opts)
 
         for job in  self.executequery(query, data):
             yield job
 
-    def get(self, start, end):
+    def get(self, start, end, opts=None):
         """ Yields all unprocessed jobs. Optionally specify a time interval to process"""
 
         query = self._query
@@ -274,11 +281,70 @@ class XDMoDAcct(Accounting):
         if end != None:
             query += " AND jf.end_time_ts < %s "
             data = data + (end, )
-        query += " ORDER BY jf.end_time_ts ASC"
+
+        query, data = self.applyskipchecks(query, data, opts)
 
         for job in  self.executequery(query, data):
             yield job
 
+    @staticmethod
+    def skipcode(opts):
+        """ SQL expression for the ProcessingError code of the job skip checks in
+            Datasource.presummarize(), in the same order. The expression is NULL
+            for jobs that pass and uses the columns of the job query """
+
+        walltime = "(t.`end_time` - t.`start_time`)"
+        checks = []
+        data = ()
+
+        if opts['min_parallel_duration'] != None:
+            checks.append("WHEN t.`nodes` > 1 AND {0} < %s THEN {1}".format(walltime, ProcessingError.PARALLEL_TOO_SHORT))
+            data += (opts['min_parallel_duration'], )
+        if opts['min_duration'] != None:
+            checks.append("WHEN {0} < %s THEN {1}".format(walltime, ProcessingError.TIME_TOO_SHORT))
+            data += (opts['min_duration'], )
+        checks.append("WHEN t.`nodes` < 1 THEN {0}".format(ProcessingError.INVALID_NODECOUNT))
+        if opts['max_nodes'] > 0:
+            checks.append("WHEN t.`nodes` > %s THEN {0}".format(ProcessingError.JOB_TOO_BIG))
+            data += (opts['max_nodes'], )
+        if opts['max_nodetime'] != None:
+            checks.append("WHEN t.`nodes` * {0} > %s THEN {1}".format(walltime, ProcessingError.JOB_TOO_MANY_NODEHOURS))
+            data += (opts['max_nodetime'], )
+        if opts['max_duration'] > 0:
+            checks.append("WHEN {0} >= %s THEN {1}".format(walltime, ProcessingError.TIME_TOO_LONG))
+            data += (opts['max_duration'], )
+
+        return "(CASE " + " ".join(checks) + " END)", data
+
+    def applyskipchecks(self, query, data, opts):
+        """ Returns the job query ordered by end time. If the skip_in_db option is set the
+            jobs that would be skipped by the checks in Datasource.presummarize() are
+            marked as processed with the skip error in one statement and are excluded
+            from the returned query """
+
+        if opts is None or not opts['skip_in_db']:
+            return query + " ORDER BY jf.end_time_ts ASC", data
+
+        skipcode, skipdata = self.skipcode(opts)
+
+        if not opts['dry_run']:
+            markquery = """
+                INSERT INTO modw_supremm.`process`
+                    (jobid, process_version, process_timestamp, process_time)
+                SELECT t.`job_id`, -1000 - {0}, NOW(), 0 FROM ({1}) t WHERE {0} IS NOT NULL
+                ON DUPLICATE KEY UPDATE process_version = VALUES(process_version), process_timestamp = NOW(), process_time = VALUES(process_time)
+                """.format(skipcode, query)
+
+            if self.madcon == None:
+                self.madcon = getdbconnection(self.dbsettings, False, {'autocommit': True})
+
+            cur = self.madcon.cursor()
+            cur.execute(markquery, skipdata + data + skipdata)
+            logging.info("Marked the jobs that fail the skip checks (%s rows affected)", cur.rowcount)
+
+        filtered = "SELECT * FROM ({0}) t WHERE {1} IS NULL ORDER BY t.`end_time` ASC".format(query, skipcode)
+        return filtered, data + skipdata
+
     def executequery(self, query, data):
         """ run the sql queries and yield a job object for each result """
         if self.con == None:
@@ -294,56 +360,88 @@ class XDMoDAcct(Accounting):
         rows_returned=cur.rowcount
         logging.info("Processing %s jobs", rows_returned)
 
-        for record in cur:
-            hostcur = self.hostcon.cursor()
-            hostcur.execute(self.hostquery, (record['job_id'], record['job_id']))
-
-            nodenamecur = self.nodenamecon.cursor()
-            nodenamecur.execute(self.nodenamequery, record['job_id'])
-
-            hostarchives = {}
-            hostlist = []
-            for n in nodenamecur:
-                if self.hostnamemode == "hostname":
-                    name = n[0].split(".")[0]
-                    hostlist.append(name)
-                else:
-                    hostlist.append(h[0])
-
-            for h in hostcur:
-                if h[0] not in hostarchives:
-                    hostarchives[h[0]] = []
-                hostarchives[h[0]].append(h[1])
-
-            jobpk = record['job_id']
-            del record['job_id']
-            record['host_list'] = hostlist
-            job = Job(jobpk, str(record['job_uniq_id']), record)
-            job.set_nodes(hostlist)
-            job.set_rawarchives(hostarchives)
+        while True:
+            records = cur.fetchmany(self.PREFETCH_JOBS)
+            if not records:
+                break
 
-            yield job
+            hostlists, archives = self.gethosts([record['job_id'] for record in records])
+
+            for record in records:
+                hostlist = hostlists.get(record['job_id'], [])
+                hostarchives = archives.get(record['job_id'], {})
+
+                jobpk = record['job_id']
+                del record['job_id']
+                record['host_list'] = hostlist
+                job = Job(jobpk, str(record['job_uniq_id']), record)
+                job.set_nodes(hostlist)
+                job.set_rawarchives(hostarchives)
+
+                yield job
+
+    def gethosts(self, jobids):
+        """ Lookup the hosts and the archives for each host for a list of jobs.
+            Returns dicts of the host list and the host archives keyed by job id.
+            The hosts of each job are in the order they were allocated so the
+            first one is the head node """
+
+        placeholders = ", ".join(["%s"] * len(jobids))
+
+        hostcur = self.hostcon.cursor()
+        hostcur.execute(self.hostquery.replace("{1}", placeholders), jobids + jobids)
+
+        nodenamecur = self.nodenamecon.cursor()
+        nodenamecur.execute(self.nodenamequery.replace("{1}", placeholders), jobids)
+
+        hostlists = {}
+        for n in nodenamecur:
+            if self.hostnamemode == "hostname":
+                name = n[0].split(".")[0]
+            else:
+                name = n[0]
+            hostlists.setdefault(n[1], []).append(name)
+
+        archives = {}
+        for h in hostcur:
+            hostarchives = archives.setdefault(h[2], {})
+            if h[0] not in hostarchives:
+                hostarchives[h[0]] = []
+            hostarchives[h[0]].append(h[1])
+
+        return hostlists, archives
 
     def markasdone(self, job, success, elapsedtime, error=None):
-        """ log a job as being processed (either successfully or not) """
-        query = """
-            INSERT INTO modw_supremm.`process` 
-                (jobid, process_version, process_timestamp, process_time) VALUES (%s, %s, NOW(), %s)
-            ON DUPLICATE KEY UPDATE process_version = %s, process_timestamp = NOW(), process_time = %s
-            """
+        """ log a job as being processed (either successfully or not). The status is
+            buffered and written in batches, see flush() """
 
         if error != None:
             version = -1000 - error
         else:
             version = Accounting.PROCESS_VERSION if success else -1 * Accounting.PROCESS_VERSION
 
-        data = (job.job_pk_id, version, elapsedtime, version, elapsedtime)
+        self._statusbatch.add((job.job_pk_id, version, elapsedtime))
+
+    def flush(self):
+        self._statusbatch.flush()
+
+    def _writestatus(self, rows):
+        """ write the process status for a batch of jobs in a single statement """
+        query = """
+            INSERT INTO modw_supremm.`process`
+                (jobid, process_version, process_timestamp, process_time) VALUES {0}
+            ON DUPLICATE KEY UPDATE process_version = VALUES(process_version), process_timestamp = NOW(), process_time = VALUES(process_time)
+            """.format(", ".join(["(%s, %s, NOW(), %s)"] * len(rows)))
+
+        data = [value for row in rows for value in row]
 
         if self.madcon == None:
             self.madcon = getdbconnection(self.dbsettings, False, {'autocommit': True})
 
         cur = self.madcon.cursor()
 
+        # The statement is an upsert so it is safe to repeat the whole batch
+        # after a reconnect
         try:
             cur.execute(query, data)
         except OperationalError as e:
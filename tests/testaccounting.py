@@ -0,0 +1,74 @@
+""" tests for the buffering of the job process status """
+import unittest
+import time
+
+from supremm.accounting import StatusBatch
+
+class TestStatusBatch(unittest.TestCase):
+    """ Check when the buffered status rows are written """
+
+    def setUp(self):
+        self.written = []
+
+    def write(self, rows):
+        self.written.append(list(rows))
+
+    def test_size(self):
+        batch = StatusBatch(self.write, maxrows=3, maxwait=60)
+        for row in range(7):
+            batch.add(row)
+        self.assertEqual([[0, 1, 2], [3, 4, 5]], self.written)
+
+        batch.flush()
+        self.assertEqual([[0, 1, 2], [3, 4, 5], [6]], self.written)
+
+    def test_time(self):
+        """ rows are written after maxwait even if no more rows are added """
+        batch = StatusBatch(self.write, maxrows=100, maxwait=0.05)
+        batch.add(1)
+        batch.add(2)
+
+        deadline = time.time() + 5
+        while not self.written and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([[1, 2]], self.written)
+
+        batch.flush()
+        self.assertEqual([[1, 2]], self.written)
+
+    def test_failedwrite(self):
+        """ rows are kept for the next flush if a timed write fails """
+        def failonce(rows):
+            if not self.written:
+                self.written.append(None)
+                raise IOError("database went away")
+            self.write(rows)
+
+        batch = StatusBatch(failonce, maxrows=100, maxwait=0.01)
+        batch.add(1)
+
+        deadline = time.time() + 5
+        while not self.written and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+
+        batch.flush()
+        self.assertEqual([None, [1]], self.written)
+
+    def test_failedflush(self):
+        """ a failed flush raises and keeps the rows """
+        def fail(rows):
+            raise IOError("database went away")
+
+        batch = StatusBatch(fail, maxrows=100, maxwait=60)
+        batch.add(1)
+        batch.add(2)
+        self.assertRaises(IOError, batch.flush)
+
+        batch._writefn = self.write
+        batch.add(3)
+        batch.flush()
+        self.assertEqual([[1, 2, 3]], self.written)
+
+if __name__ == '__main__':
+    unittest.main()
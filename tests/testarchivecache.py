@@ -0,0 +1,76 @@
+""" tests for the merged job archive cache """
+import unittest
+import datetime
+import glob
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from supremm.datasource.pcp.archivecache import MergedArchiveCache
+
+class TestArchiveCache(unittest.TestCase):
+    """ Check that merged archives are reused and evicted """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.rawarchive = self.writearchive("raw", "rawdata")
+        self.begin = datetime.datetime(2020, 1, 1)
+        self.end = datetime.datetime(2020, 1, 2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def writearchive(self, name, content):
+        """ create a fake pcp archive """
+        archive = os.path.join(self.tmpdir, name)
+        for suffix in (".0", ".index", ".meta"):
+            with open(archive + suffix, "w") as fp:
+                fp.write(content)
+        return archive
+
+    def test_reuse(self):
+        """ archives are found in the cache if the inputs are unchanged """
+        cache = MergedArchiveCache(os.path.join(self.tmpdir, "cache"), 1024 * 1024)
+
+        key = cache.key("node1", self.begin, self.end, [self.rawarchive])
+        self.assertNotEqual(key, cache.key("node1", self.begin, self.end + datetime.timedelta(seconds=1), [self.rawarchive]))
+        self.assertFalse(cache.fetch(key, os.path.join(self.tmpdir, "out")))
+
+        cache.store(key, self.writearchive("merged", "mergeddata"))
+
+        self.assertTrue(cache.fetch(key, os.path.join(self.tmpdir, "out")))
+        with open(os.path.join(self.tmpdir, "out.0")) as fp:
+            self.assertEqual("mergeddata", fp.read())
+
+        self.writearchive("raw", "newrawdata")
+        self.assertNotEqual(key, cache.key("node1", self.begin, self.end, [self.rawarchive]))
+
+    def test_evict(self):
+        """ the least recently used archives are removed """
+        # Room for two of the 30 byte archives
+        cache = MergedArchiveCache(os.path.join(self.tmpdir, "cache"), 70)
+
+        keys = [cache.key("node{0}".format(i), self.begin, self.end, [self.rawarchive]) for i in range(3)]
+        for i in range(2):
+            cache.store(keys[i], self.writearchive("merged{0}".format(i), "0123456789"))
+            os.utime(cache._entrydir(keys[i]), (i, i))
+        cache.evict()
+
+        # Using the first archive makes the second one the least recently used
+        self.assertTrue(cache.fetch(keys[0], os.path.join(self.tmpdir, "out0")))
+        cache.store(keys[2], self.writearchive("merged2", "0123456789"))
+
+        # Entries are only removed by evict()
+        self.assertTrue(os.path.exists(cache._entrydir(keys[1])))
+        with patch("supremm.datasource.pcp.archivecache.glob.glob", wraps=glob.glob) as scan:
+            cache.evict()
+            calls = scan.call_count
+            cache.evict()
+            self.assertEqual(calls, scan.call_count)
+
+        self.assertTrue(cache.fetch(keys[2], os.path.join(self.tmpdir, "out2")))
+        self.assertFalse(cache.fetch(keys[1], os.path.join(self.tmpdir, "out1")))
+
+if __name__ == '__main__':
+    unittest.main()
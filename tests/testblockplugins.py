@@ -0,0 +1,374 @@
+""" tests that the plugins that process blocks of data give the same results as
+    when they are called for each datapoint and as the original per-datapoint
+    implementations """
+import unittest
+import datetime
+import numbers
+import warnings
+from collections import OrderedDict
+from unittest.mock import Mock
+
+import numpy
+
+from supremm.errors import ProcessingError
+from supremm.plugins.CpuCategories import CpuCategories
+from supremm.plugins.Catastrophe import Catastrophe
+from supremm.plugins.TimeseriesPatternsGpfs import TimeseriesPatternsGpfs
+from supremm.statistics import calculate_stats
+from supremm.TimeseriesPatterns import _HAS_AUTOPERIOD, _calculate_autoperiod
+
+class NodeMeta(object):
+    def __init__(self, nodename, nodeindex):
+        self.nodename = nodename
+        self.nodeindex = nodeindex
+
+class ReferenceCpuCategories(CpuCategories):
+    """ The per-datapoint implementation of CpuCategories before process_block() was added """
+
+    def __init__(self, job):
+        super(ReferenceCpuCategories, self).__init__(job)
+        self._deltas = {}
+
+    def process(self, nodemeta, timestamp, data, description):
+        length = len(data[0])
+        node = nodemeta.nodename
+        proc = self._job.getdata('proc')
+
+        # Initialize dicts to handle multiple nodes and cores
+        if node not in self._last:
+            self._timeabove[node] = {}
+            self._timebelow[node] = {}
+            self._deltas[node] = {}
+            self._maxcores[node] = 0
+
+            if proc is None or 'cpusallowed' not in proc or node not in proc['cpusallowed'] or 'error' in proc['cpusallowed'][node]:
+                for i in range(length):
+                    self._timeabove[node][i] = 0
+                    self._timebelow[node][i] = 0
+                    self._deltas[node][i] = []
+            else:
+                for i in proc['cpusallowed'][node]:
+                    self._timeabove[node][i] = 0
+                    self._timebelow[node][i] = 0
+                    self._deltas[node][i] = []
+            timeabove = [x for x in self._timeabove[node].keys()]
+            self._last[node] = numpy.array(data)[:, timeabove]
+            return True
+
+        timeabove = [x for x in self._timeabove[node].keys()]
+        nodedata = numpy.array(data)[:, timeabove]
+        difference = nodedata - self._last[node]
+        total = numpy.sum(difference, 0)
+        self._last[node] = nodedata
+
+        currentdeltas = difference[0] / total
+
+        if length != 0:
+            counter = 0
+            for i in self._timeabove[node]:
+                self._deltas[node][i].append(currentdeltas[counter])
+                if currentdeltas[counter] > self.DELTA_THRESHOLD:
+                    self._timeabove[node][i] += total[counter]
+                else:
+                    self._timebelow[node][i] += total[counter]
+                counter += 1
+
+            totalusage = numpy.sum(currentdeltas)
+            if not numpy.isnan(totalusage) and int(round(totalusage)) > self._maxcores[node]:
+                self._maxcores[node] = int(round(totalusage))
+        return True
+
+    def results(self):
+        duty_cycles = OrderedDict()
+        for node in self._timeabove:
+            if len(list(self._deltas[node].values())[0]) < self.MIN_DELTAS:
+                return {"error": ProcessingError.INSUFFICIENT_DATA}
+
+            duty_cycles[node] = OrderedDict()
+            for i in self._timeabove[node]:
+                total_time = self._timeabove[node][i] + self._timebelow[node][i]
+                ratio = self._timeabove[node][i] / total_time
+                duty_cycles[node]["cpu{}".format(i)] = ratio
+
+        # Categorize the job's performance
+        duty_list = numpy.array([value for node in duty_cycles.values() for value in node.values()])
+
+        if not any(value < self.GOOD_THRESHOLD for value in duty_list):
+            category = "GOOD"
+        elif not any(value >= self.LOW_THRESHOLD for value in duty_list):
+            category = "LOW"
+        else:
+            high = numpy.sort(duty_list[duty_list >= self.LOW_THRESHOLD])
+            if high.size > self.MIN_HIGH_SIZE:
+                if high[-1] - high[0] < self.MAX_DIFFERENCE:
+                    category = "PINNED"
+                else:
+                    category = "UNPINNED"
+            else:
+                if high[0] >= self.MIN_HIGH_VALUE:
+                    category = "PINNED"
+                else:
+                    category = "UNPINNED"
+
+        return {"dutycycles": duty_cycles, "category": category, "maxcores": sum(self._maxcores.values())}
+
+class ReferenceCatastrophe(Catastrophe):
+    """ The per-datapoint implementation of Catastrophe before process_block() was added """
+
+    def __init__(self, job):
+        super(ReferenceCatastrophe, self).__init__(job)
+        self._data = {}
+        self._error = None
+
+    def process(self, nodemeta, timestamp, data, description):
+
+        if self._job.getdata('perf')['active'] != True:
+            self._error = ProcessingError.RAW_COUNTER_UNAVAILABLE
+            return False
+
+        if len(data[0]) == 0:
+            # Ignore datapoints where no data stored
+            return True
+
+        if nodemeta.nodename not in self._data:
+            self._data[nodemeta.nodename] = {"x": [], "t": []}
+
+        info = self._data[nodemeta.nodename]
+        info['x'].append(1.0 * numpy.sum(data[0]))
+        info['t'].append(timestamp)
+
+        if len(info['x']) > 1:
+            if numpy.any(info['x'][-1] - info['x'][-2] < 0.0):
+                self._error = ProcessingError.PMDA_RESTARTED_DURING_JOB
+                return False
+
+        return True
+
+    def results(self):
+
+        if self._error:
+            return {"error": self._error}
+
+        if len(self._data) == 0:
+            return {"error": ProcessingError.RAW_COUNTER_UNAVAILABLE}
+
+        vals = None
+
+        for _, data in self._data.items():
+
+            if data['x'][-1] - data['x'][0] == 0.0:
+                return {"error": ProcessingError.RAW_COUNTER_UNAVAILABLE}
+
+            start = 2
+            end = len(data['x'])-2
+
+            for i in range(start+1, end-1):
+
+                a = (data['x'][i] - data['x'][start]) / (data['t'][i] - data['t'][start])
+                b = (data['x'][end] - data['x'][i]) / (data['t'][end] - data['t'][i])
+                vals = b/a if vals == None else min(vals, b/a)
+
+        if vals == None:
+            return {"error": ProcessingError.JOB_TOO_SHORT}
+
+        return {"value": vals}
+
+class ReferenceTimeseriesPatternsGpfs(TimeseriesPatternsGpfs):
+    """ The per-datapoint implementation of TimeseriesPatterns before process_block() was added """
+
+    def process(self, nodemeta, timestamp, data, description):
+
+        if self.end_time - self.start_time < self.MIN_WALLTIME:
+            return False
+
+        # associate each metric with its data point, as tuples of (metric, data)
+        # sum across the mountpoints to get one total data point
+        metrics = list(zip(self.metricNames, (numpy.sum(x) for x in data)))
+
+        nodename = nodemeta.nodename
+        if nodename not in self.nodes:
+            self.section_start_timestamps[0].append(self.start_time)
+            self.nodes[nodename] = {
+                "current_marker": self.start_time + self.section_len,
+                "section_start_data": dict(metrics),
+                "section_start_timestamp": self.start_time,
+                "section_avgs": {metric: [] for metric in self.metricNames},
+                "last_value": None,
+                "section_counter": 0,
+                "data_error": False,
+
+                "all_times": [],
+                "all_data": {metric: [] for metric in self.metricNames}
+            }
+
+        node = self.nodes[nodename]
+
+        node['all_times'].append(timestamp)
+        if _HAS_AUTOPERIOD:
+            for metric, data in metrics:
+                node['all_data'][metric].append(data)
+
+        node['last_value'] = metrics
+
+        if timestamp >= node['current_marker'] and timestamp < self.end_time:
+
+            node['data_error'] = timestamp - node['current_marker'] > self.DISTANCE_THRESHOLD
+
+            for metric, data in metrics:
+                avg = (data - node['section_start_data'][metric]) / (timestamp - node['section_start_timestamp'])
+                node['section_avgs'][metric].append(avg)
+                node['section_start_data'][metric] = data
+
+            node['section_start_timestamp'] = timestamp
+            node['section_counter'] += 1
+            self.section_start_timestamps[node['section_counter']].append(timestamp)
+            node['current_marker'] += self.section_len
+
+        return True
+
+    def results(self):
+
+        if self.end_time - self.start_time < self.MIN_WALLTIME:
+            return {'error': ProcessingError.JOB_TOO_SHORT}
+
+        metric_data = {
+            metric: {
+                'sections': [[] for _ in range(self.SECTIONS)],
+                'nodes_used': 0
+            }
+            for metric in self.metricNames
+        }
+
+        for nodename, node in self.nodes.items():
+            if not len(node['all_times']) > self.DATAPOINT_THRESHOLD:
+                node['data_error'] = True
+                continue
+
+            for metric, data in node['last_value']:
+
+                avg = (data - node['section_start_data'][metric]) / (self.end_time - node['section_start_timestamp'])
+                node['section_avgs'][metric].append(avg)
+
+                if len(node['section_avgs'][metric]) == self.SECTIONS and not node['data_error']:
+                    metric_data[metric]['nodes_used'] += 1
+
+                    for i in range(self.SECTIONS):
+                        metric_data[metric]['sections'][i].append(node['section_avgs'][metric][i])
+
+        for metric_name, metric in metric_data.items():
+
+            if metric['nodes_used'] < self.MIN_NODES:
+                metric_data[metric_name] = {'error': ProcessingError.INSUFFICIENT_DATA}
+                continue
+
+            metric['sections'] = [calculate_stats(nodes) for nodes in metric['sections']]
+            metric['section_start_timestamps'] = [calculate_stats(sect) for sect in self.section_start_timestamps]
+            if _HAS_AUTOPERIOD:
+                metric['autoperiod'] = _calculate_autoperiod(self.nodes, metric_name, self.resource, self.jobid)
+
+        return metric_data
+
+class TestBlockPlugins(unittest.TestCase):
+    """ Compare process_block() and process() with the original per-datapoint
+        implementation for the same data """
+
+    def setUp(self):
+        self.rng = numpy.random.RandomState(1)
+        self.job = Mock()
+        self.job.getdata.side_effect = lambda name: {"perf": {"active": True}}.get(name)
+        self.job.start_datetime = datetime.datetime(2020, 1, 1)
+        self.job.end_datetime = datetime.datetime(2020, 1, 1, 2)
+        self.job.windowstart = None
+        self.job.acct = {"partition": "normal", "local_job_id": "1"}
+
+    def runplugin(self, cls, refcls, nodes, blocksizes):
+        """ returns the results from the reference implementation, from calling
+            process() for each datapoint and from calling process_block() with
+            blocks of the given sizes """
+        reference = refcls(self.job)
+        perrecord = cls(self.job)
+        block = cls(self.job)
+
+        for nodeidx, (timestamps, values) in enumerate(nodes):
+            meta = NodeMeta("node{0}".format(nodeidx), nodeidx)
+            description = [[numpy.arange(values.shape[2]), []] for _ in range(values.shape[1])]
+
+            for timestamp, datum in zip(timestamps, values):
+                reference.process(meta, float(timestamp), list(datum), description)
+                perrecord.process(meta, float(timestamp), list(datum), description)
+
+            pos = 0
+            count = 0
+            while pos < len(timestamps):
+                size = blocksizes[count % len(blocksizes)]
+                block.process_block(meta, timestamps[pos:pos + size], numpy.array(values[pos:pos + size]), description)
+                pos += size
+                count += 1
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            return reference.results(), perrecord.results(), block.results()
+
+    def assertResultsEqual(self, expected, actual):
+        """ The results must match apart from rounding in the floating point sums """
+        if isinstance(expected, dict):
+            self.assertEqual(list(expected.keys()), list(actual.keys()))
+            for key in expected:
+                self.assertResultsEqual(expected[key], actual[key])
+        elif isinstance(expected, list):
+            self.assertEqual(len(expected), len(actual))
+            for exp, act in zip(expected, actual):
+                self.assertResultsEqual(exp, act)
+        elif isinstance(expected, numbers.Integral):
+            self.assertEqual(expected, actual)
+        elif isinstance(expected, numbers.Real):
+            self.assertAlmostEqual(expected, actual, delta=1e-9 * max(1.0, abs(expected)))
+        else:
+            self.assertEqual(expected, actual)
+
+    def counters(self, ndatapoints, nmetrics, ninstances, scale):
+        timestamps = 1577836800.0 + numpy.arange(ndatapoints) * 30.0 + self.rng.rand(ndatapoints)
+        values = numpy.cumsum(self.rng.rand(ndatapoints, nmetrics, ninstances) * scale, axis=0)
+        return timestamps, values
+
+    def test_cpucategories(self):
+        nodes = []
+        for _ in range(2):
+            timestamps, values = self.counters(200, 8, 64, 1000)
+            values = numpy.floor(values)
+            # Idle period
+            values[100:120] = values[99]
+            nodes.append((timestamps, values))
+
+        reference, perrecord, block = self.runplugin(CpuCategories, ReferenceCpuCategories, nodes, [1, 7, 512])
+
+        self.assertIn(reference['category'], ("GOOD", "LOW", "PINNED", "UNPINNED"))
+        self.assertResultsEqual(reference, perrecord)
+        self.assertResultsEqual(reference, block)
+
+    def test_catastrophe(self):
+        nodes = [self.counters(300, 1, 32, 1e12) for _ in range(3)]
+
+        reference, perrecord, block = self.runplugin(Catastrophe, ReferenceCatastrophe, nodes, [5, 64, 512])
+
+        self.assertIn("value", reference)
+        self.assertResultsEqual(reference, perrecord)
+        self.assertResultsEqual(reference, block)
+
+    def test_timeseriespatterns(self):
+        nodes = []
+        for _ in range(2):
+            timestamps = numpy.sort(1577836800.0 + self.rng.rand(250) * 7200)
+            values = numpy.cumsum(self.rng.rand(250, 2, 4) * 1e9, axis=0)
+            nodes.append((timestamps, values))
+
+        reference, perrecord, block = self.runplugin(TimeseriesPatternsGpfs, ReferenceTimeseriesPatternsGpfs, nodes, [1, 13, 512])
+
+        for metric in ("gpfs-fsios-read_bytes", "gpfs-fsios-write_bytes"):
+            self.assertEqual(2, reference[metric]['sections'][0]['cnt'])
+            for result in (perrecord, block):
+                self.assertResultsEqual(reference[metric]['sections'], result[metric]['sections'])
+                self.assertResultsEqual(reference[metric]['section_start_timestamps'], result[metric]['section_start_timestamps'])
+
+if __name__ == '__main__':
+    unittest.main()
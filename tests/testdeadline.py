@@ -0,0 +1,94 @@
+""" tests for the job time budget """
+import unittest
+from unittest.mock import Mock, patch
+
+from supremm.deadline import JobDeadline, deadlinesettings, SAMPLED, SKIPPED_PLUGINS, NODE_SUBSAMPLED, TRUNCATED
+from supremm.summarize import Summarize
+
+class MockSummarize(Summarize):
+    def get(self):
+        return {}
+    def process(self):
+        return True
+    def complete(self):
+        return True
+    def good_enough(self):
+        return True
+
+def mockplugin(name, expensive):
+    plugin = Mock()
+    plugin.name = name
+    plugin.mode = "all"
+    plugin.expensive = expensive
+    return plugin
+
+class TestDeadline(unittest.TestCase):
+    """ Check that the degradations are applied in stages """
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = patch("supremm.deadline.time.time", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_settings(self):
+        self.assertIsNone(deadlinesettings({"batch_system": "XDMoD"}))
+        self.assertIsNone(deadlinesettings(None))
+        self.assertEqual({"budget": 600.0, "sampleinterval": 300.0, "nodestride": 4}, deadlinesettings({"job_time_budget": 600}))
+
+    def test_stages(self):
+        deadline = JobDeadline(100, sampleinterval=60, nodestride=2)
+
+        self.now += 99
+        self.assertEqual([], deadline.check())
+        self.now += 1
+        self.assertEqual([SAMPLED, SKIPPED_PLUGINS], deadline.check())
+        self.assertEqual([], deadline.check())
+        # Stages that are reached together are applied together
+        self.now += 500
+        self.assertEqual([NODE_SUBSAMPLED, TRUNCATED], deadline.check())
+
+    def test_summarize(self):
+        job = Mock()
+        job.job_id = "1"
+        s = MockSummarize([], [mockplugin("patterns", True), mockplugin("cpu", False)], job, None)
+        s.sampleinterval = 120.0
+        s.deadline = JobDeadline(100, sampleinterval=60, nodestride=2)
+
+        self.assertEqual([], s.checkdeadline())
+        self.assertFalse(s.skipnode(1))
+
+        self.now += 100
+        # Already sampled more coarsely than the degraded interval
+        self.assertEqual([SKIPPED_PLUGINS], s.checkdeadline())
+        self.assertEqual(["cpu"], [x.name for x in s.running(s.alltimestamps)])
+
+        self.now += 50
+        s.checkdeadline()
+        self.assertEqual([False, True, False], [s.skipnode(i) for i in range(3)])
+        s.skippednode()
+
+        # Truncated nodes are missing data rather than a sample of the nodes
+        self.now += 50
+        s.checkdeadline()
+        self.assertTrue(s.skipnode(2))
+        s.skippednode()
+        self.assertEqual((2, 1), (s.nodes_skipped, s.nodes_subsampled))
+
+        other = MockSummarize([], [mockplugin("patterns", True), mockplugin("cpu", False)], job, None)
+        other.sampleinterval = 300.0
+        other.degradations = [SAMPLED, TRUNCATED]
+        other.nodes_skipped = 3
+        other.nodes_subsampled = 2
+        s.merge(other)
+        self.assertEqual(3, s.nodes_subsampled)
+
+        summarization = {}
+        s.adddegradations(summarization)
+        self.assertEqual({"sample_interval": 300.0,
+                          "degraded": [SKIPPED_PLUGINS, NODE_SUBSAMPLED, TRUNCATED, SAMPLED],
+                          "skipped_plugins": ["patterns"],
+                          "nodes_skipped": 5}, summarization)
+
+if __name__ == '__main__':
+    unittest.main()
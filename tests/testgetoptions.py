@@ -10,12 +10,26 @@ class TestGetOptions(unittest.TestCase):
     def setUp(self):
         self.defaults = {
                 'fail_fast': False,
+                'fused_scan': False,
+                'direct_read': False,
+                'node_parallel': 0,
+                'time_parallel': 0,
+                'extract_threads': 0,
+                'extract_queue': 2,
+                'output_threads': 1,
+                'output_queue': 16,
+                'schedule_window': 0,
+                'short_reserve': 1,
+                'sample_interval': None,
+                'skip_in_db': False,
                 'dry_run': False,
                 'dodelete': True,
                 'extractonly': False,
                 'force_timeout': 172800,
                 'job_output_dir': None,
                 'libextract': False,
+                'extract_parallel': 1,
+                'extract_per_fs': 0,
                 'log': logging.INFO,
                 'max_nodes': 0,
                 'min_duration': None,
@@ -176,5 +190,11 @@ class TestGetOptions(unittest.TestCase):
 
         self.helper(['--max-nodetime', "3455"], expected)
 
+    def testsampleinterval(self):
+        expected = self.defaults.copy()
+        expected['sample_interval'] = 300.0
+
+        self.helper(['--sample-interval', "300"], expected)
+
 if __name__ == '__main__':
     unittest.main()
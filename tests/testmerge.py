@@ -0,0 +1,189 @@
+""" tests for combining the results of jobs that were summarized in shards """
+import unittest
+import datetime
+import numpy
+
+from supremm.Job import Job
+from supremm.plugin import Plugin, PreProcessor, mergeable, windowmergeable, blockprocessing
+from supremm.statistics import RollingStats
+from supremm.plugins.Block import Block
+from supremm.plugins.LoadAvg import LoadAvg
+from supremm.plugins.GpuUsageTimeseries import GpuUsageTimeseries
+from supremm.plugins.GpuPower import GpuPower
+from supremm.plugins.IpmiPower import IpmiPower
+from supremm.preprocessors.PerfEvent import PerfEvent
+
+class NodeMeta(object):
+    """ mock node metadata """
+    def __init__(self, nodename, nodeindex):
+        self.nodename = nodename
+        self.nodeindex = nodeindex
+
+class NoHooks(Plugin):
+    """ plugin that only implements the required methods """
+    name = property(lambda x: "nohooks")
+    mode = property(lambda x: "firstlast")
+    requiredMetrics = property(lambda x: [])
+    optionalMetrics = property(lambda x: [])
+    derivedMetrics = property(lambda x: [])
+
+    def process(self, nodemeta, timestamp, data, description):
+        return True
+
+    def results(self):
+        return {}
+
+class TestMerge(unittest.TestCase):
+    """ Check that summarizing a job in shards gives the same results """
+
+    def setUp(self):
+        self.nodes = ["node{0}".format(i) for i in range(4)]
+        acct = {'nodes': len(self.nodes), 'start_time': 1000, 'end_time': 2000}
+        self.job = Job(1, "1", acct)
+        self.job.set_nodes(self.nodes)
+        self.job.set_rawarchives(dict((n, ["/archive/" + n]) for n in self.nodes))
+
+    def gendata(self, plugin, nodeidx, times=range(1000, 2000, 30)):
+        """ feed some data for one node to the plugin """
+        meta = NodeMeta(self.nodes[nodeidx], nodeidx)
+        for t in times:
+            if isinstance(plugin, Block):
+                data = [numpy.array([t * (nodeidx + 1.0), 2.0 * t]) for _ in plugin.allmetrics]
+                description = [[numpy.array([0, 1]), ["sda", "sdb"]] for _ in plugin.allmetrics]
+            elif isinstance(plugin, LoadAvg):
+                data = [numpy.array([nodeidx + (t % 7)])]
+                description = [[numpy.array([0]), ["1 minute"]]]
+            else:
+                data = [numpy.array([t, t + 1.0]) * (nodeidx + 1) for _ in range(3)]
+                description = [[numpy.array([0, 1]), ["0", "1"]] for _ in range(3)]
+            plugin.process(meta, t, data, description)
+
+    def test_shards(self):
+        """ test job splitting """
+        shard = self.job.getshard(1, self.nodes[2:])
+        self.assertEqual(4, shard.nodecount)
+        self.assertEqual(2, shard.shardnodecount)
+        self.assertEqual(self.nodes[2:], list(shard.nodenames()))
+
+        shard.addnodearchive("node3", "/jobdir/node3")
+        shard.record_error("test error")
+        self.job.mergeshard(shard)
+
+        self.assertEqual([("node3", 3, "/jobdir/node3")], list(self.job.nodearchives()))
+        self.assertEqual(["test error"], self.job.get_errors())
+
+    def test_shardjobdirs(self):
+        """ the shard archive directories are recorded on the job """
+        shards = [self.job.getshard(i, self.nodes[2 * i:2 * i + 2]) for i in range(2)]
+        shards[0].setjobdir("/scratch/1/shard0", "/scratch/.reservations/a.res")
+        shards[1].setjobdir("/out/1/shard1")
+
+        for shard in shards:
+            self.job.addshardjobdir(shard)
+        self.job.addshardjobdir(self.job.getshard(2, []))
+
+        self.assertEqual("/scratch/1", self.job.jobdir)
+        self.assertEqual([("/scratch/1/shard0", "/scratch/.reservations/a.res"), ("/out/1/shard1", None)], self.job.shardjobdirs)
+        self.assertEqual([], self.job.getshard(3, []).shardjobdirs)
+
+    def test_hooks(self):
+        """ the optional hooks are only used if they are implemented """
+        for hooked in (NoHooks, NoHooks(self.job), Plugin, PreProcessor):
+            self.assertFalse(mergeable(hooked))
+            self.assertFalse(windowmergeable(hooked))
+            self.assertFalse(blockprocessing(hooked))
+
+        self.assertTrue(blockprocessing(type("BlockHook", (NoHooks,), {"process_block": lambda *x: True})(self.job)))
+        self.assertTrue(mergeable(Block(self.job)))
+        self.assertTrue(windowmergeable(PerfEvent))
+
+    def test_plugins(self):
+        """ compare plugin results for serial and merged processing """
+        for pluginclass in (Block, LoadAvg, GpuUsageTimeseries):
+            self.assertTrue(mergeable(pluginclass))
+
+            serial = pluginclass(self.job)
+            for i in range(len(self.nodes)):
+                self.gendata(serial, i)
+
+            merged = pluginclass(self.job)
+            for nodes in ([0, 1], [2, 3]):
+                part = pluginclass(self.job.getshard(0, [self.nodes[i] for i in nodes]))
+                for i in nodes:
+                    self.gendata(part, i)
+                merged.merge(part)
+
+            self.assertEqual(repr(serial.results()), repr(merged.results()))
+
+    def test_windows(self):
+        """ compare plugin results for serial and time window processing """
+        for pluginclass in (Block, LoadAvg, GpuUsageTimeseries, IpmiPower, GpuPower):
+            self.assertTrue(windowmergeable(pluginclass))
+
+            serial = pluginclass(self.job)
+            for i in range(len(self.nodes)):
+                self.gendata(serial, i)
+
+            # The datapoint at 1480 is the boundary between the windows and is seen by both
+            merged = pluginclass(self.job)
+            windowstart = self.job.start_datetime + datetime.timedelta(seconds=480)
+            for shardid, (window, times) in enumerate([((None, windowstart), range(1000, 1481, 30)),
+                                                        ((windowstart, None), range(1480, 2000, 30))]):
+                part = pluginclass(self.job.getwindow(shardid, *window))
+                for i in range(len(self.nodes)):
+                    self.gendata(part, i, times)
+                merged.mergewindow(part)
+
+            if pluginclass is GpuUsageTimeseries:
+                result = merged.results()
+                for hostidx in range(len(self.nodes)):
+                    times = merged._data.gethost(hostidx)[:, 0]
+                    self.assertEqual(1000, times[0])
+                    self.assertEqual(1990, times[-1])
+                    self.assertTrue(numpy.all(numpy.diff(times) > 0))
+                self.assertEqual(len(times), len(result['hosts']['0']['all']))
+            else:
+                # The sample based statistics such as the mean power count the
+                # boundary datapoint once
+                self.assertResultsAlmostEqual(serial.results(), merged.results())
+
+    def assertResultsAlmostEqual(self, expected, actual):
+        """ compare nested dicts of results allowing for rounding differences """
+        if isinstance(expected, dict):
+            self.assertEqual(sorted(expected.keys()), sorted(actual.keys()))
+            for key in expected:
+                self.assertResultsAlmostEqual(expected[key], actual[key])
+        else:
+            self.assertAlmostEqual(expected, actual)
+
+    def test_rollingstats(self):
+        """ combined statistics match those for the whole series """
+        values = numpy.random.RandomState(7).normal(5.0, 2.0, 100)
+
+        serial = RollingStats()
+        for v in values:
+            serial.append(v)
+
+        merged = RollingStats()
+        for part in (values[:1], values[1:40], values[40:]):
+            stats = RollingStats()
+            for v in part:
+                stats.append(v)
+            merged.merge(stats)
+
+        expected = serial.get()
+        for key, value in merged.get().items():
+            self.assertAlmostEqual(expected[key], value)
+
+    def test_preproc(self):
+        """ the perf counters must be active on all nodes """
+        merged = PerfEvent(self.job)
+        for active in (True, False, True):
+            part = PerfEvent(self.job)
+            part.perfactive = active
+            merged.merge(part)
+
+        self.assertEqual({"active": False}, self.job.getdata("perf"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+""" tests for the metric resolution cache """
+import unittest
+import os
+import shutil
+import struct
+import tempfile
+
+from supremm.datasource.pcp.metriccache import MetricResolutionCache, hostclass, pmnssignature
+
+class Plugin(object):
+    def __init__(self, requiredMetrics, optionalMetrics=None):
+        self.requiredMetrics = requiredMetrics
+        self.optionalMetrics = optionalMetrics or []
+        self.derivedMetrics = []
+
+def record(rtype, payload):
+    length = len(payload) + 12
+    return struct.pack(">ii", length, rtype) + payload + struct.pack(">i", length)
+
+class TestMetricCache(unittest.TestCase):
+    """ Check the archive signatures and cache lookups """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def writemeta(self, name, descs, indom):
+        """ create a fake archive .meta file with a label, descriptor and indom records """
+        archive = os.path.join(self.tmpdir, name)
+        with open(archive + ".meta", "wb") as fp:
+            fp.write(record(0x50052602, b"label" + name.encode()))
+            for desc in descs:
+                fp.write(record(1, desc))
+            fp.write(record(5, indom))
+        return archive
+
+    def test_signature(self):
+        descs = [b"kernel.percpu.cpu.user", b"mem.numa.alloc"]
+
+        sig1 = pmnssignature(self.writemeta("a", descs, b"cpu0 cpu1"), "cpn-k05-01.cluster")
+        sig2 = pmnssignature(self.writemeta("b", descs, b"cpu0 cpu1 cpu2"), "cpn-k07-22")
+
+        self.assertIsNotNone(sig1)
+        self.assertEqual(sig1, sig2)
+        self.assertNotEqual(sig1, pmnssignature(self.writemeta("c", descs[:1], b"cpu0"), "cpn-k05-01"))
+        self.assertNotEqual(sig1, pmnssignature(self.writemeta("d", descs, b"cpu0"), "gpu-k05-01"))
+
+        self.assertIsNone(pmnssignature(os.path.join(self.tmpdir, "missing"), "cpn-k05-01"))
+        with open(os.path.join(self.tmpdir, "e.meta"), "wb") as fp:
+            fp.write(record(1, b"truncated")[:-6])
+        self.assertIsNone(pmnssignature(os.path.join(self.tmpdir, "e"), "cpn-k05-01"))
+
+        self.assertEqual("cpn-k-", hostclass("cpn-k05-01.cluster"))
+
+    def test_cache(self):
+        cache = MetricResolutionCache(maxentries=2)
+        perf = Plugin([["perfevent.a", "perfevent.b"], ["perfevent.c"]])
+        mem = Plugin(["mem.numa.alloc"], ["mem.freemem"])
+
+        self.assertIsNone(cache.get("sig", perf))
+        cache.store("sig", perf, [12, 13], ["perfevent.a", "perfevent.b"], [3, 3])
+        cache.store("sig", mem, [], [], [])
+
+        self.assertEqual(((12, 13), ["perfevent.a", "perfevent.b"], [3, 3]), cache.get("sig", Plugin([["perfevent.a", "perfevent.b"], ["perfevent.c"]])))
+        self.assertEqual(((), [], []), cache.get("sig", mem))
+        self.assertIsNone(cache.get("othersig", mem))
+
+        # perf was used more recently than mem so mem is dropped
+        cache.get("sig", perf)
+        cache.store("othersig", mem, [1], ["mem.numa.alloc"], [1])
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get("sig", mem))
+        self.assertIsNotNone(cache.get("sig", perf))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+""" tests for summarizing a sample of the nodes of large jobs """
+import unittest
+from unittest.mock import Mock
+
+from supremm.Job import Job
+from supremm.nodesample import stratifiedsample, samplesettings
+from supremm.plugins.GpuPower import GpuPower
+from supremm.plugins.IpmiPower import IpmiPower
+from supremm.statistics import add_sample_fraction, calculate_stats
+from supremm.summarize import Summarize
+
+class MockSummarize(Summarize):
+    def get(self):
+        return {}
+    def process(self):
+        return True
+    def complete(self):
+        return True
+    def good_enough(self):
+        return True
+
+def mockplugin(cls, results):
+    plugin = Mock()
+    plugin.name = "mock"
+    plugin.mode = "all"
+    plugin.totals = cls.totals
+    plugin.results.return_value = results
+    return plugin
+
+class TestNodeSample(unittest.TestCase):
+    """ Check the node sampling """
+
+    def setUp(self):
+        self.nodes = ["cpu{0:04d}".format(i) for i in range(90)] + ["gpu{0:03d}".format(i) for i in range(10)]
+        acct = {'nodes': len(self.nodes), 'start_time': 1000, 'end_time': 2000}
+        self.job = Job(1, "1234", acct)
+        self.job.set_nodes(self.nodes)
+        self.job.set_rawarchives(dict((n, ["/archive/" + n]) for n in self.nodes))
+
+    def test_settings(self):
+        self.assertIsNone(samplesettings({"batch_system": "XDMoD"}))
+        self.assertIsNone(samplesettings(None))
+        self.assertEqual({"threshold": 256, "samplesize": 64}, samplesettings({"node_sample_threshold": 256}))
+        self.assertEqual({"threshold": 16, "samplesize": 16}, samplesettings({"node_sample_threshold": 16, "node_sample_size": 32}))
+
+    def test_stratified(self):
+        sample = stratifiedsample(self.nodes, 21, "1234")
+
+        self.assertEqual(21, len(sample))
+        self.assertEqual("cpu0000", sample[0])
+        self.assertEqual(sorted(sample), sample)
+        # 20 nodes after the head node split 89:10 between the classes
+        self.assertEqual(2, len([x for x in sample if x.startswith("gpu")]))
+        self.assertEqual(sample, stratifiedsample(self.nodes, 21, "1234"))
+
+        self.assertEqual(self.nodes, stratifiedsample(self.nodes, 200, "1234"))
+
+    def test_job(self):
+        self.assertFalse(self.job.sampled)
+
+        for nodename in self.nodes:
+            self.job.addnodearchive(nodename, "/job/" + nodename)
+
+        sample = stratifiedsample(self.nodes, 10, "1234")
+        self.job.samplenodes(sample)
+
+        self.assertTrue(self.job.sampled)
+        self.assertEqual(10, self.job.nodecount)
+        self.assertEqual(100, self.job.totalnodecount)
+        self.assertTrue(self.job.has_enough_raw_archives())
+        self.assertEqual([(n, ["/archive/" + n]) for n in sample], list(self.job.rawarchives()))
+        # The sampled nodes are renumbered so the head node is still node 0
+        self.assertEqual([(n, i, "/job/" + n) for i, n in enumerate(sample)], list(self.job.nodearchives()))
+
+    def test_statistics(self):
+        results = {"cpuuser": calculate_stats([1.0, 2.0, 4.0]), "nested": {"mem": {"avg": 2.0, "cnt": 1}}, "error": 2}
+        add_sample_fraction(results, 0.25)
+
+        self.assertEqual(0.25, results["cpuuser"]["sample_fraction"])
+        self.assertEqual({"avg": 2.0, "cnt": 1, "sample_fraction": 0.25}, results["nested"]["mem"])
+        self.assertEqual(2, results["error"])
+
+    def test_totals(self):
+        energy = calculate_stats([10.0, 20.0, 30.0, 40.0])
+        energy['total'] = 100.0
+        ipmi = mockplugin(IpmiPower, {"power": {"mean": calculate_stats([1.0, 2.0])}, "energy": energy})
+        gpu = mockplugin(GpuPower, {"gpu0": {"energy": {"avg": 5.0, "cnt": 2, "total": 10.0}}, "gpu1": {"energy": {"avg": 1.0, "cnt": 1, "total": 1.0}}})
+        error = mockplugin(GpuPower, {"error": 2})
+
+        s = MockSummarize([], [], self.job, None)
+        self.assertEqual(100.0, s.results(ipmi)['energy']['total'])
+
+        self.job.samplenodes(stratifiedsample(self.nodes, 25, "1234"))
+
+        result = s.results(ipmi)
+        # The total is an estimate for all of the nodes of the job
+        self.assertEqual(400.0, result['energy']['total'])
+        self.assertEqual(4, result['energy']['cnt'])
+        self.assertEqual(0.25, result['energy']['sample_fraction'])
+        self.assertEqual(0.25, result['power']['mean']['sample_fraction'])
+        self.assertEqual(0.25, result['sample_fraction'])
+
+        result = s.results(gpu)
+        self.assertEqual(40.0, result['gpu0']['energy']['total'])
+        self.assertEqual(4.0, result['gpu1']['energy']['total'])
+
+        # Every result of a sampled job is marked
+        self.assertEqual({"error": 2, "sample_fraction": 0.25}, s.results(error))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+""" tests for the bulk MongoDB writer """
+import unittest
+from unittest.mock import MagicMock, patch
+
+import bson
+import numpy
+
+from supremm.outputter import MongoOutput
+
+def bulkwrite(ops, ordered=True):
+    """ Encode the documents like the driver does so that bad ones raise InvalidDocument """
+    for op in ops:
+        bson.encode(op._doc)
+
+def summary(jobid, value):
+    return {"acct": {"id": jobid, "end_time": 1000}, "summarization": {}, "cpu": {"avg": value}}
+
+class TestMongoOutput(unittest.TestCase):
+    """ Check that errors in the writer thread do not hang the summarization """
+
+    def setUp(self):
+        patcher = patch("supremm.outputter.MongoClient")
+        client = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.collection = MagicMock()
+        self.collection.bulk_write.side_effect = bulkwrite
+        client.return_value.__getitem__.return_value.get_collection.return_value = self.collection
+
+        self.outconf = {"uri": "mongodb://localhost", "bulk_size": 2, "bulk_interval": 60, "bulk_queue": 1}
+        self.resconf = {"resource_id": 1}
+
+    def test_invaliddocument(self):
+        done = []
+        with MongoOutput(self.outconf, self.resconf) as output:
+            output.process(summary(1, 1.0), {}, lambda: done.append(1))
+            # numpy scalars cannot be encoded
+            output.process(summary(2, numpy.float32(2.0)), {}, lambda: done.append(2))
+            output.process(summary(3, 3.0), {}, lambda: done.append(3))
+            output.process(summary(4, 4.0), {}, lambda: done.append(4))
+
+        # All of the jobs in the batch with the bad document fail and the
+        # writer carries on with the next batch
+        self.assertEqual([3, 4], done)
+
+    def test_writerfailure(self):
+        output = MongoOutput(self.outconf, self.resconf)
+        with patch.object(output, "_flush", side_effect=ValueError("broken")):
+            with self.assertRaises(RuntimeError):
+                with output:
+                    for jobid in range(10):
+                        output.process(summary(jobid, 1.0), {})
+
+        self.assertIsNone(output._writer)
+
+if __name__ == '__main__':
+    unittest.main()
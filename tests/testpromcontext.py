@@ -0,0 +1,51 @@
+""" tests for reading the job data from Prometheus """
+import unittest
+from unittest.mock import MagicMock
+
+from supremm.datasource.prometheus.prominterface import Context, CHUNK_SIZE
+
+class TestContext(unittest.TestCase):
+    """ Check the queries that are made for the data of a node """
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.metrics = [MagicMock(query="metric_a"), MagicMock(query="metric_b")]
+        self.start = 1600000000
+        # Two and a half chunks
+        self.end = self.start + int(2.5 * CHUNK_SIZE * 3600)
+
+    def fetch(self, step):
+        ctx = Context(self.start, self.end, self.client, step)
+        ctx.mode = "timeseries"
+        ctx.init_internal_state = MagicMock()
+        ctx.reset_internal_state = MagicMock()
+        return list(ctx.fetch(self.metrics))
+
+    def test_chunks(self):
+        """ the raw samples are read in chunks that cover the job once """
+        self.assertEqual(3, len(self.fetch(None)))
+
+        self.client.query_range.assert_not_called()
+        chunks = [call[0][1] for call in self.client.query.call_args_list[::2]]
+        self.assertEqual([self.start + CHUNK_SIZE * 3600, self.start + 2 * CHUNK_SIZE * 3600, self.end], chunks)
+        for metric in self.metrics:
+            metric.apply_range.assert_any_call(self.start + 2 * CHUNK_SIZE * 3600, self.end)
+
+    def test_step(self):
+        """ with a step the data are evaluated at multiples of the step from the
+            job start and no evaluation time is in two chunks """
+        step = 7 * 60
+        self.assertEqual(3, len(self.fetch(step)))
+
+        self.client.query.assert_not_called()
+        times = []
+        for query, start, end, querystep in [call[0] for call in self.client.query_range.call_args_list[::2]]:
+            self.assertEqual("metric_a", query)
+            self.assertEqual(step, querystep)
+            self.assertEqual(0, (start - self.start) % step)
+            times.extend(range(int(start), int(end) + 1, step))
+
+        self.assertEqual(list(range(self.start, self.end + 1, step)), times)
+
+if __name__ == '__main__':
+    unittest.main()
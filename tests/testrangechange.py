@@ -66,6 +66,93 @@ class TestRangeChange(unittest.TestCase):
         self.assertTrue(numpy.all(data[0] == numpy.array([234,23423,234,23423,23423])))
         self.assertTrue(numpy.all(data[1] == numpy.array([856,5698,789,127,90780])))
 
+    def test_block(self):
+
+        config = MockConfig({"normalization": {"perfevent.hwcounters.CPU_CLK_UNHALTED.value": {"range": 32}}})
+
+        metrics = ["perfevent.hwcounters.CPU_CLK_UNHALTED.value", "kernel.percpu.cpu.user"]
+        description = [[numpy.arange(3), ["cpu0", "cpu1", "cpu2"]], [numpy.arange(3), ["cpu0", "cpu1", "cpu2"]]]
+
+        rng = numpy.random.RandomState(1)
+        counts = numpy.cumsum(rng.randint(0, 1 << 30, size=(20, 2, 3)), axis=0).astype(numpy.float64)
+        counts[:, 0, :] %= 1 << 32
+
+        r = RangeChange(config)
+        r.set_fetched_metrics(metrics)
+        expected = []
+        for datapoint in counts:
+            data = [numpy.array(x) for x in datapoint]
+            r.normalise_data(1.000, data)
+            expected.append(data)
+
+        # The state is carried between blocks
+        r = RangeChange(config)
+        r.set_fetched_metrics(metrics)
+        block = numpy.array(counts)
+        r.normalise_block(block[:7], description)
+        r.normalise_block(block[7:8], description)
+        r.normalise_block(block[8:], description)
+
+        self.assertTrue(numpy.array_equal(numpy.array(expected), block))
+        self.assertTrue(numpy.all(numpy.diff(block[:, 0, :], axis=0) >= 0))
+
+    def test_blocklarge(self):
+        """ counters above 2^53 are converted with integer arithmetic """
+
+        config = MockConfig({"normalization": {"perfevent.hwcounters.CPU_CLK_UNHALTED.value": {"range": 62}}})
+        description = [[numpy.arange(2), ["cpu0", "cpu1"]]]
+
+        # The raw values are multiples of 1024 so they are exact as doubles
+        raw = [[(1 << 62) - 4096, (1 << 61) + 1024], [1024, (1 << 61) + 9216], [5120, (1 << 61) + 17408]]
+        expected = [raw[0], [(1 << 62) + 1024, raw[1][1]], [(1 << 62) + 5120, raw[2][1]]]
+
+        r = RangeChange(config)
+        r.set_fetched_metrics(["perfevent.hwcounters.CPU_CLK_UNHALTED.value"])
+        block = numpy.array(raw, dtype=numpy.float64)[:, numpy.newaxis, :]
+        r.normalise_block(block[:2], description)
+        r.normalise_block(block[2:], description)
+
+        self.assertEqual(expected, [[int(x) for x in row] for row in block[:, 0, :]])
+        self.assertEqual([(1 << 62) + 5120, (1 << 61) + 17408], [int(x) for x in r.accumulator[0]])
+
+    def test_blockinstances(self):
+        """ the state follows the instances when they change between blocks """
+
+        config = MockConfig({"normalization": {"perfevent.hwcounters.CPU_CLK_UNHALTED.value": {"range": 8}}})
+        r = RangeChange(config)
+        r.set_fetched_metrics(["perfevent.hwcounters.CPU_CLK_UNHALTED.value"])
+
+        block = numpy.array([[[250.0, 100.0, 200.0]], [[10.0, 110.0, 210.0]]])
+        r.normalise_block(block, [[numpy.array([0, 1, 2]), ["cpu0", "cpu1", "cpu2"]]])
+        self.assertEqual([[250, 100, 200], [266, 110, 210]], block[:, 0, :].tolist())
+
+        # cpu1 went offline and cpu3 appeared
+        block = numpy.array([[[20.0, 5.0, 40.0]], [[30.0, 15.0, 50.0]]])
+        r.normalise_block(block, [[numpy.array([0, 2, 3]), ["cpu0", "cpu2", "cpu3"]]])
+        self.assertEqual([[276, 261, 40], [286, 271, 50]], block[:, 0, :].tolist())
+
+    def test_wrapperiod(self):
+
+        config = MockConfig({"normalization": {
+            "perfevent.hwcounters.CPU_CLK_UNHALTED.value": {"range": 48, "max_rate": 1 << 32},
+            "perfevent.hwcounters.INSTRUCTIONS_RETIRED.value": {"range": 40, "max_rate": 1 << 34},
+            "perfevent.hwcounters.L1D_REPLACEMENT.value": {"range": 48}}})
+
+        r = RangeChange(config)
+
+        r.set_fetched_metrics(["kernel.percpu.cpu.user"])
+        self.assertIsNone(r.wrapperiod())
+
+        r.set_fetched_metrics(["perfevent.hwcounters.CPU_CLK_UNHALTED.value", "kernel.percpu.cpu.user"])
+        self.assertEqual(65536.0, r.wrapperiod())
+
+        r.set_fetched_metrics(["perfevent.hwcounters.CPU_CLK_UNHALTED.value", "perfevent.hwcounters.INSTRUCTIONS_RETIRED.value"])
+        self.assertEqual(64.0, r.wrapperiod())
+
+        # No bound on the rate of one of the counters
+        r.set_fetched_metrics(["perfevent.hwcounters.CPU_CLK_UNHALTED.value", "perfevent.hwcounters.L1D_REPLACEMENT.value"])
+        self.assertIsNone(r.wrapperiod())
+
     def test_missingconfig(self):
 
         config = MockConfig({})
@@ -0,0 +1,93 @@
+""" tests for the scratch space allocation of job archive directories """
+import unittest
+import lzma
+import os
+import shutil
+import tempfile
+from unittest.mock import Mock, patch
+
+from supremm.datasource.pcp.scratchspace import ScratchSpace, estimatesize, xzuncompressedsize
+
+class TestScratchSpace(unittest.TestCase):
+    """ Check that the scratch space budget is shared between jobs """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_budget(self):
+        """ jobs that do not fit in the remaining budget are refused """
+        scratch = ScratchSpace(self.tmpdir, 100)
+
+        first = scratch.reserve(os.path.join(self.tmpdir, "job1"), 60)
+        self.assertIsNotNone(first)
+        self.assertIsNone(scratch.reserve(os.path.join(self.tmpdir, "job2"), 60))
+        self.assertIsNotNone(scratch.reserve(os.path.join(self.tmpdir, "job3"), 40))
+
+        # Another instance sees the same reservations
+        self.assertIsNone(ScratchSpace(self.tmpdir, 100).reserve(os.path.join(self.tmpdir, "job2"), 1))
+
+        scratch.release(first)
+        self.assertIsNotNone(scratch.reserve(os.path.join(self.tmpdir, "job2"), 60))
+
+    def test_stale(self):
+        """ reservations are held while the job directory exists, whichever
+            process made them """
+        scratch = ScratchSpace(self.tmpdir, 100)
+        jobdir = os.path.join(self.tmpdir, "job1")
+
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if scratch.reserve(jobdir, 100) is not None else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, os.WEXITSTATUS(status))
+
+        # Held before the job directory is created and while it exists
+        self.assertIsNone(scratch.reserve(os.path.join(self.tmpdir, "job2"), 100))
+        os.makedirs(os.path.join(jobdir, "shard0"))
+        with patch("supremm.datasource.pcp.scratchspace.RESERVE_GRACE", -1):
+            self.assertIsNone(scratch.reserve(os.path.join(self.tmpdir, "job2"), 100))
+
+            # Removed once the job directory has gone
+            shutil.rmtree(jobdir)
+            self.assertIsNotNone(scratch.reserve(os.path.join(self.tmpdir, "job2"), 100))
+
+    def test_freespace(self):
+        """ space reserved for archives that are not written yet is not free """
+        scratch = ScratchSpace(self.tmpdir, 1000)
+        statvfs = Mock(f_bavail=100, f_frsize=1)
+
+        with patch("supremm.datasource.pcp.scratchspace.os.statvfs", return_value=statvfs):
+            self.assertIsNotNone(scratch.reserve(os.path.join(self.tmpdir, "job1"), 60))
+            self.assertIsNone(scratch.reserve(os.path.join(self.tmpdir, "job2"), 60))
+            self.assertIsNotNone(scratch.reserve(os.path.join(self.tmpdir, "job3"), 40))
+
+    def test_estimate(self):
+        """ compressed archives are counted at their uncompressed size """
+        data = os.urandom(1000) * 200
+        archive = os.path.join(self.tmpdir, "20240101.00.10")
+        with open(archive + ".0.xz", "wb") as fp:
+            # Two streams with padding in between
+            fp.write(lzma.compress(data[:50000]) + b"\0" * 8 + lzma.compress(data[50000:]))
+        with open(archive + ".meta", "wb") as fp:
+            fp.write(b"x" * 100)
+
+        self.assertEqual(len(data), xzuncompressedsize(archive + ".0.xz"))
+
+        job = Mock()
+        job.rawarchives.return_value = [("node1", [archive])]
+        self.assertEqual(len(data) + 100, estimatesize(job))
+
+        # The uncompressed size of other formats is not known
+        with open(archive + ".index.gz", "wb") as fp:
+            fp.write(b"x")
+        self.assertIsNone(estimatesize(job))
+
+        with open(archive + ".0.xz", "wb") as fp:
+            fp.write(b"not xz data")
+        self.assertIsNone(xzuncompressedsize(archive + ".0.xz"))
+
+if __name__ == '__main__':
+    unittest.main()
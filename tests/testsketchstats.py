@@ -0,0 +1,134 @@
+""" tests for the bounded memory statistics accumulator """
+import unittest
+from unittest.mock import Mock, patch
+import numpy
+
+from supremm.plugins.CpuUsage import CpuUsage
+from supremm.plugins.Network import Network
+from supremm.statistics import SketchStats, calculate_stats
+
+class TestSketchStats(unittest.TestCase):
+    """ Check the sketch statistics against calculate_stats() """
+
+    def setUp(self):
+        self.rng = numpy.random.RandomState(1)
+
+    def accumulate(self, values, parts, k=1024):
+        """ add the values in pieces to several accumulators and merge them """
+        stats = [SketchStats(k) for _ in range(parts)]
+        for i, chunk in enumerate(numpy.array_split(values, 5 * parts)):
+            stats[i % parts].append(chunk)
+        for other in stats[1:]:
+            stats[0].merge(other)
+        self.approximate = stats[0].approximate()
+        return stats[0].get()
+
+    def test_exact(self):
+        for count in (1, 2, 3, 50, 1000):
+            values = self.rng.gamma(2.0, size=count)
+            expected = calculate_stats(values)
+            result = self.accumulate(values, 3)
+
+            self.assertEqual(count > 1024, self.approximate)
+            self.assertEqual(sorted(expected.keys()), sorted(result.keys()))
+            for key, value in expected.items():
+                self.assertAlmostEqual(value, result[key], delta=1e-9 * max(1.0, abs(value)))
+
+        self.assertEqual({'avg': 4.0, 'cnt': 10}, self.accumulate(numpy.full(10, 4.0), 2))
+        self.assertEqual({}, SketchStats().get())
+
+    def test_bounded(self):
+        values = self.rng.gamma(2.0, size=200000)
+        expected = calculate_stats(values)
+
+        stats = SketchStats(256)
+        for chunk in numpy.array_split(values, 100):
+            stats.append(chunk)
+        result = stats.get()
+
+        self.assertLess(sum(len(x) for x in stats._compactors), 3 * 256)
+        self.assertTrue(stats.approximate())
+        self.assertEqual(expected['cnt'], result['cnt'])
+        self.assertEqual(expected['min'], result['min'])
+        self.assertEqual(expected['max'], result['max'])
+        for key in ('avg', 'std', 'cov', 'skw', 'krt'):
+            self.assertAlmostEqual(expected[key], result[key], delta=1e-9 * abs(expected[key]))
+
+        # The estimated median is within 1% of the data of the true median
+        self.assertAlmostEqual(0.5, numpy.mean(values < result['med']), delta=0.01)
+        self.assertAlmostEqual(0.5, numpy.mean(values < self.accumulate(values, 8, 256)['med']), delta=0.01)
+
+class NodeMeta(object):
+    def __init__(self, nodename):
+        self.nodename = nodename
+
+class TestCpuUsage(unittest.TestCase):
+    """ Check that the cpu plugin only estimates the median for very large jobs """
+
+    def runplugin(self):
+        rng = numpy.random.RandomState(1)
+        cpusallowed = {"node{0}".format(node): list(range(0, 64, 2)) for node in range(40)}
+        plugin = CpuUsage(Mock(**{"getdata.return_value": {"cpusallowed": cpusallowed}}))
+        for node in range(40):
+            first = rng.rand(7, 64) * 1000
+            plugin.process(NodeMeta("node{0}".format(node)), 0.0, list(first), None)
+            plugin.process(NodeMeta("node{0}".format(node)), 600.0, list(first + rng.rand(7, 64) * 6000), None)
+        return plugin.results()
+
+    def test_exact(self):
+        exact = self.runplugin()
+
+        self.assertEqual(2560, exact['nodecpus']['all']['cnt'])
+        self.assertEqual(1280, exact['jobcpus']['all']['cnt'])
+        self.assertNotIn('med_approx', exact['nodecpus']['user'])
+
+        with patch.object(CpuUsage, "MAX_EXACT_CORES", 1000):
+            sketch = self.runplugin()
+
+        self.assertTrue(sketch['nodecpus']['user']['med_approx'])
+        self.assertTrue(sketch['jobcpus']['user']['med_approx'])
+        for name in ('nodecpus', 'jobcpus', 'effcpus'):
+            self.assertEqual(exact[name]['all'], sketch[name]['all'])
+            for key, value in exact[name]['user'].items():
+                if key != 'med':
+                    self.assertAlmostEqual(value, sketch[name]['user'][key], delta=1e-9 * max(1.0, abs(value)))
+
+class TestDeviceBasedPlugin(unittest.TestCase):
+    """ Check the per device statistics against calculate_stats() """
+
+    def runplugin(self, nodes):
+        rng = numpy.random.RandomState(1)
+        plugin = Network(Mock())
+        description = [(None, ["eth0", "ib0"])] * 2
+        expected = {}
+        for node in range(nodes):
+            first = rng.randint(0, 1 << 40, size=(2, 2)).astype(numpy.uint64)
+            delta = rng.randint(0, 1 << 30, size=(2, 2)).astype(numpy.uint64)
+            plugin.process(NodeMeta("node{0}".format(node)), 0.0, list(first), description)
+            plugin.process(NodeMeta("node{0}".format(node)), 600.0, list(first + delta), description)
+            expected.setdefault("eth0", []).append(delta[:, 0])
+            expected.setdefault("ib0", []).append(delta[:, 1])
+        return plugin.results(), expected
+
+    def test_exact(self):
+        results, expected = self.runplugin(40)
+        for device, deltas in expected.items():
+            deltas = numpy.array(deltas)
+            for mindex, metric in enumerate(("in-bytes", "out-bytes")):
+                stats = calculate_stats(deltas[:, mindex])
+                self.assertEqual(sorted(stats.keys()), sorted(results[device][metric].keys()))
+                for key, value in stats.items():
+                    self.assertAlmostEqual(value, results[device][metric][key], delta=1e-9 * max(1.0, abs(value)))
+
+    def test_bounded(self):
+        results, expected = self.runplugin(1500)
+        stats = calculate_stats(numpy.array(expected["ib0"])[:, 1])
+        result = results["ib0"]["out-bytes"]
+
+        self.assertTrue(result['med_approx'])
+        self.assertEqual(1500, result['cnt'])
+        for key in ('avg', 'min', 'max', 'std', 'cov'):
+            self.assertAlmostEqual(stats[key], result[key], delta=1e-9 * abs(stats[key]))
+
+if __name__ == '__main__':
+    unittest.main()
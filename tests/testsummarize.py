@@ -5,10 +5,20 @@ from supremm.datasource.pcp.pcpdatasource import PCPDatasource
 from supremm.config import Config
 from supremm.Job import Job
 from supremm.errors import ProcessingError
+from supremm.deadline import JobDeadline, NODE_SUBSAMPLED, TRUNCATED
+from supremm.datasource.pcp.pcpsummarize import PCPSummarize
+from supremm.datasource.pcp import pcparchive
+from supremm.datasource.pcp.pcparchive import checklibextract
+from pcp import pmapi
+import cpmapi as c_pmapi
+import numpy
 
 import logging
 import datetime
+import os
 import tempfile
+import threading
+import time
 
 class TestPCPSummarizeJob(unittest.TestCase):
 
@@ -24,12 +34,26 @@ class TestPCPSummarizeJob(unittest.TestCase):
 
         self.options = {
                 'fail_fast': False,
+                'fused_scan': False,
+                'direct_read': False,
+                'node_parallel': 0,
+                'time_parallel': 0,
+                'extract_threads': 0,
+                'extract_queue': 2,
+                'output_threads': 1,
+                'output_queue': 16,
+                'schedule_window': 0,
+                'short_reserve': 1,
+                'sample_interval': None,
+                'skip_in_db': False,
                 'dry_run': False,
                 'dodelete': True,
                 'extractonly': False,
                 'force_timeout': 172800,
                 'job_output_dir': None,
                 'libextract': False,
+                'extract_parallel': 1,
+                'extract_per_fs': 0,
                 'log': logging.INFO,
                 'max_nodes': 0,
                 'min_duration': None,
@@ -53,10 +77,12 @@ class TestPCPSummarizeJob(unittest.TestCase):
         confjob = {
             'job_id': '1',
             'nodecount': 1,
+            'shardnodecount': 1,
             'walltime': 600,
             'rawarchives.return_value': iter([('nodename', ['archive1', 'archive2'])]),
             'end_datetime': datetime.datetime(2016,1,1),
-            'jobdir': None
+            'jobdir': None,
+            'shardid': None
         }
 
         self.mockjob = Mock(spec=Job, **confjob)
@@ -191,6 +217,318 @@ class TestPCPSummarizeJob(unittest.TestCase):
 
         self.verify_errors(ProcessingError.PMLOGEXTRACT_ERROR, 'skipped_pmlogextract_error', error, mdata)
 
+    @patch('supremm.datasource.pcp.pcparchive.adjust_job_start_end')
+    @patch('supremm.datasource.pcp.pcparchive.loadlibextract')
+    def test_libextractinvalid(self, loadlibextract, adjustjobfn):
+
+        self.options['libextract'] = True
+        self.mockjob.getnodebegin.return_value = datetime.datetime(2015, 12, 31)
+        self.mockjob.getnodeend.return_value = datetime.datetime(2016, 1, 1)
+
+        configres = {'getsection.return_value': {'subdir_out_format': '%j', 'archive_out_dir': tempfile.mkdtemp()}}
+        self.mockconf.configure_mock(**configres)
+
+        jobmeta = self.datasource.presummarize(self.mockjob, self.mockconf, self.mockresconf, self.options)
+        _, mdata, _, error = self.datasource.summarizejob(self.mockjob, jobmeta, self.mockconf, self.options)
+
+        # The library would exit on the missing input archives
+        loadlibextract.return_value.pmlogextract.assert_not_called()
+        self.verify_errors(ProcessingError.PMLOGEXTRACT_ERROR, 'skipped_pmlogextract_error', error, mdata)
+
+    def test_checklibextract(self):
+        archivedir = tempfile.mkdtemp()
+        archive = os.path.join(archivedir, "20160101.00.10")
+        output = os.path.join(archivedir, "node1")
+        open(archive + ".meta.xz", "w").close()
+
+        start = datetime.datetime(2015, 12, 31)
+        end = datetime.datetime(2016, 1, 1)
+
+        self.assertIsNone(checklibextract(start, end, [archive], output))
+        self.assertIn("time window", checklibextract(end, start, [archive], output))
+        self.assertIn("input archive", checklibextract(start, end, [archive, archive + "x"], output))
+
+        open(output + ".index", "w").close()
+        self.assertIn("already exists", checklibextract(start, end, [archive], output))
+
+
+class FakeLibExtract(object):
+    """ Stands in for libpcp_pmlogextract. Like the real library it keeps state
+        between calls and exits the process for some inputs """
+
+    def __init__(self):
+        self.calls = 0
+
+    def pmlogextract(self, argc, argv):
+        output = argv[argc - 1].decode()
+        self.calls += 1
+        if self.calls > 1:
+            # State left over from an earlier extraction in the same process
+            return 3
+        if output.endswith("node3"):
+            os._exit(2)
+        open(output + ".index", "w").close()
+        return 0
+
+class FakePopen(object):
+    """ pmlogextract process that takes longer for the earlier nodes and fails
+        for node2. Records the largest number of processes running at once """
+    lock = threading.Lock()
+    running = 0
+    maxrunning = 0
+
+    def __init__(self, cmdline, stderr=None):
+        self.nodename = os.path.basename(cmdline[-1])
+        self.returncode = None
+
+    def communicate(self):
+        with self.lock:
+            FakePopen.running += 1
+            FakePopen.maxrunning = max(FakePopen.maxrunning, FakePopen.running)
+        time.sleep(0.2 - 0.05 * int(self.nodename[4:]))
+        with self.lock:
+            FakePopen.running -= 1
+        self.returncode = 1 if self.nodename == "node2" else 0
+        return None, "failed" if self.returncode else ""
+
+
+class TestPmlogextract(unittest.TestCase):
+    """ Check the extraction of the archives for each node of a job """
+
+    def setUp(self):
+        self.archivedir = tempfile.mkdtemp()
+        self.nodes = []
+        for nodename in ("node1", "node2", "node3"):
+            archive = os.path.join(self.archivedir, nodename + "-20160101")
+            open(archive + ".meta", "w").close()
+            self.nodes.append((nodename, [archive]))
+
+        self.job = Mock(spec=Job, job_id='1', shardnodecount=3, jobdir=os.path.join(self.archivedir, "job"))
+        self.job.rawarchives.return_value = iter(self.nodes)
+        self.job.getnodebegin.return_value = datetime.datetime(2015, 12, 31)
+        self.job.getnodeend.return_value = datetime.datetime(2016, 1, 1)
+
+        self.conf = Mock(spec=Config, **{'getsection.return_value': {}})
+        self.opts = {'libextract': True, 'direct_read': False, 'extract_parallel': 1, 'extract_per_fs': 0}
+
+    @patch('supremm.datasource.pcp.pcparchive.loadlibextract')
+    def test_libextract(self, loadlibextract):
+        lib = FakeLibExtract()
+        loadlibextract.return_value = lib
+
+        node_error = pcparchive.pmlogextract(self.job, self.conf, {'name': 'resource_name'}, self.opts)
+
+        # Every node is extracted in a new process, so the exit for node3 only
+        # fails that node and no state is carried over between the nodes
+        self.assertEqual(-1, node_error)
+        self.assertEqual(0, lib.calls)
+        self.assertEqual([(("node1", os.path.join(self.job.jobdir, "node1")), {}), (("node2", os.path.join(self.job.jobdir, "node2")), {})],
+                         self.job.addnodearchive.call_args_list)
+        self.assertTrue(os.path.exists(os.path.join(self.job.jobdir, "node2.index")))
+        self.assertIn("pmlogextract return code: 2", self.job.record_error.call_args[0][0])
+
+    @patch('supremm.datasource.pcp.pcparchive.subprocess.Popen', FakePopen)
+    def test_parallel(self):
+        FakePopen.maxrunning = 0
+        self.opts.update({'libextract': False, 'extract_parallel': 3, 'extract_per_fs': 2})
+
+        node_error = pcparchive.pmlogextract(self.job, self.conf, {'name': 'resource_name'}, self.opts)
+
+        # All of the archives are on one filesystem so only two run at once and
+        # the results are recorded in node order whatever order they finish in
+        self.assertEqual(2, FakePopen.maxrunning)
+        self.assertEqual(-1, node_error)
+        self.assertEqual([(("node1", os.path.join(self.job.jobdir, "node1")), {}), (("node3", os.path.join(self.job.jobdir, "node3")), {})],
+                         self.job.addnodearchive.call_args_list)
+        self.assertEqual("failed", self.job.record_error.call_args_list[0][0][0])
+        self.assertIn("node2", self.job.record_error.call_args_list[1][0][0])
+
+    @patch('supremm.datasource.pcp.pcparchive.subprocess.Popen')
+    @patch('supremm.datasource.pcp.pcparchive.pmapi.pmContext')
+    def test_directread(self, pmcontext, popen):
+        def opencontext(ctxtype, archive):
+            if "node2" in archive:
+                raise pmapi.pmErr("overlapping archives")
+            return Mock()
+        pmcontext.side_effect = opencontext
+        popen.return_value = Mock(**{'communicate.return_value': (None, ""), 'returncode': 0})
+        self.opts.update({'libextract': False, 'direct_read': True})
+
+        node_error = pcparchive.pmlogextract(self.job, self.conf, {'name': 'resource_name'}, self.opts)
+
+        # The raw archives are read directly unless they cannot be opened together,
+        # then they are extracted as usual
+        self.assertEqual(0, node_error)
+        self.assertEqual([(("node1", self.nodes[0][1][0]), {}), (("node3", self.nodes[2][1][0]), {}), (("node2", os.path.join(self.job.jobdir, "node2")), {})],
+                         self.job.addnodearchive.call_args_list)
+        self.assertEqual(1, popen.call_count)
+        self.assertEqual(os.path.join(self.job.jobdir, "node2"), popen.call_args[0][0][-1])
+
+
+class TestPCPDeadline(unittest.TestCase):
+    """ Check how the PCP summarization is degraded when a job is over its time budget """
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = patch("supremm.deadline.time.time", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.job = Mock(job_id="1", nodecount=4)
+        config = Mock(spec=Config, **{'getsection.return_value': {}})
+        self.summary = PCPSummarize([], [], self.job, config, deadline=JobDeadline(100, sampleinterval=60, nodestride=2))
+
+    def test_overbudget(self):
+        ctx = Mock()
+        self.assertFalse(self.summary.overbudget(ctx, 5000.5))
+        ctx.pmSetMode.assert_not_called()
+
+        # The rest of the archive is read at the degraded interval
+        self.now += 100
+        self.assertFalse(self.summary.overbudget(ctx, 5000.5))
+        mode, start, interval = ctx.pmSetMode.call_args[0]
+        self.assertEqual(c_pmapi.PM_MODE_INTERP, mode)
+        self.assertEqual((5060, 500000), (start.tv_sec, start.tv_usec))
+        self.assertEqual(60000, interval)
+        self.assertEqual(60.0, self.summary.sampleinterval)
+
+        self.assertFalse(self.summary.overbudget(ctx, 5060.5))
+        self.assertEqual(1, ctx.pmSetMode.call_count)
+
+        self.now += 100
+        self.assertTrue(self.summary.overbudget(ctx, 5120.5))
+
+    def test_good_enough(self):
+        self.summary.archives_processed = 2
+        self.summary.degradations = [NODE_SUBSAMPLED]
+        self.summary.skippednode()
+        self.summary.skippednode()
+        self.assertTrue(self.summary.good_enough())
+
+        # A job that was truncated after a few nodes is not good enough
+        self.summary.nodes_subsampled = 0
+        self.summary.nodes_skipped = 0
+        self.summary.degradations = [TRUNCATED]
+        self.summary.skippednode()
+        self.summary.skippednode()
+        self.assertFalse(self.summary.good_enough())
+
+
+class FakeTimeval(object):
+    def __init__(self, seconds):
+        self.tv_sec = int(seconds)
+        self.tv_usec = int(round((seconds - self.tv_sec) * 1000000))
+
+    def __float__(self):
+        return self.tv_sec + self.tv_usec / 1000000.0
+
+class FakeResult(object):
+    def __init__(self, timestamp, value):
+        self.contents = Mock(timestamp=FakeTimeval(timestamp))
+        self.value = value
+
+class FakeArchive(object):
+    """ An archive context with one counter that is logged every 10 seconds """
+
+    def __init__(self, times, values):
+        self.times = times
+        self.values = values
+        self.modes = []
+        self.fetches = 0
+        self.position = times[0]
+        self.interval = None
+
+    def pmSetMode(self, mode, when, interval):
+        self.modes.append(mode)
+        self.position = when.tv_sec + when.tv_usec / 1000000.0
+        self.interval = interval / 1000.0 if mode == c_pmapi.PM_MODE_INTERP else None
+        self.backwards = mode == c_pmapi.PM_MODE_BACK
+
+    def pmFetch(self, metric_id_array):
+        self.fetches += 1
+        if self.interval is not None:
+            # The counter is read at the sample interval
+            if self.position > self.times[-1]:
+                raise pmapi.pmErr(c_pmapi.PM_ERR_EOL)
+            timestamp = self.position
+            self.position += self.interval
+            return FakeResult(timestamp, int(numpy.interp(timestamp, self.times, self.values)) % 256)
+
+        if self.backwards:
+            idx = numpy.searchsorted(self.times, self.position, side="right") - 1
+            self.position = self.times[idx] - 0.001
+        else:
+            idx = numpy.searchsorted(self.times, self.position)
+            if idx == len(self.times):
+                raise pmapi.pmErr(c_pmapi.PM_ERR_EOL)
+            self.position = self.times[idx] + 0.001
+        return FakeResult(self.times[idx], self.values[idx] % 256)
+
+    def pmFreeResult(self, result):
+        pass
+
+def extractvalues(ctx, result, metric_id_array, mtypes, logerr, indices, buffers, indomcache):
+    return [numpy.array([result.value], dtype=numpy.uint64)], [[numpy.array([0]), ["cpu0"]]]
+
+class TestFetchStrided(unittest.TestCase):
+    """ Check the strided reads of the archive for a counter that wraps """
+
+    def setUp(self):
+        # An 8 bit counter that goes up by at most 1 per second so it wraps at most
+        # once every 256 seconds
+        normalization = {"counter": {"range": 8, "max_rate": 1.0}}
+        config = Mock(spec=Config, **{'getsection.side_effect': lambda name: normalization if name == 'normalization' else {}})
+        self.summary = PCPSummarize([], [], Mock(job_id="1", nodecount=1), config)
+
+        rng = numpy.random.RandomState(3)
+        self.times = 10000.5 + numpy.arange(400) * 10.0
+        self.values = numpy.concatenate(([5], 5 + numpy.cumsum(rng.randint(0, 10, 399))))
+        self.ctx = FakeArchive(self.times, self.values)
+
+        self.analytic = Mock(zerocopy=False)
+        self.analytic.name = "counter"
+
+        patcher = patch('supremm.datasource.pcp.pcpsummarize.pcpcinterface')
+        patcher.start().extractValues.side_effect = extractvalues
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(self.summary, "getmetricstofetch", return_value=([1], ["counter"], [0]))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def process(self):
+        self.summary.setmode(self.ctx, FakeTimeval(self.times[0]))
+        self.summary.processfirstlast(self.ctx, Mock(nodename="node1"), self.analytic)
+        self.assertEqual("complete", self.analytic.status)
+        return [(args[1], args[2][0][0]) for args, _ in self.analytic.process.call_args_list]
+
+    def test_strided(self):
+        calls = self.process()
+
+        # The plugin sees the first record and the total increase at the last record
+        self.assertEqual([(self.times[0], 5), (self.times[-1], self.values[-1])], calls)
+        self.assertLess(self.ctx.fetches, len(self.times) / 4)
+        self.assertNotIn(c_pmapi.PM_MODE_INTERP, self.ctx.modes)
+
+    def test_interpolated(self):
+        self.summary.sampleinterval = 30
+
+        calls = self.process()
+
+        # The sample interval mode is kept for the jumps through the archive
+        self.assertEqual(set([c_pmapi.PM_MODE_INTERP]), set(self.ctx.modes))
+        self.assertEqual(self.times[0], calls[0][0])
+        last, value = calls[-1]
+        self.assertEqual(int(numpy.interp(last, self.times, self.values)), value)
+        self.assertGreater(last, self.times[-1] - 30)
+
+    def test_windowend(self):
+        self.summary.windowend = self.times[100] + 0.25
+        self.summary.rangechange.set_fetched_metrics([])
+
+        result = self.summary.fetchlast(self.ctx, [1])
+
+        # The first record at or after the window end, not the one just before it
+        self.assertEqual(self.times[101], float(result.contents.timestamp))
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,226 @@
+""" tests for the job processing loop """
+import threading
+import time
+import unittest
+from multiprocessing.dummy import Pool
+from unittest.mock import MagicMock, patch
+
+from supremm import summarize_jobs
+from supremm.Job import Job
+from supremm.datasource.datasource import Datasource
+
+class TestProcessResource(unittest.TestCase):
+    """ Check that the buffered process status is written when processing stops """
+
+    def setUp(self):
+        self.dbif = MagicMock()
+        for name, value in (("XDMoDAcct", MagicMock(return_value=self.dbif)), ("outputter", MagicMock())):
+            patcher = patch.object(summarize_jobs, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.resconf = {"batch_system": "XDMoD", "resource_id": 1, "hostname_mode": "hostname"}
+        self.opts = {"mode": "all", "fail_fast": True, "dry_run": False}
+
+    def test_failfast(self):
+        datasource = MagicMock()
+        datasource.presummarize.side_effect = ValueError("broken")
+        self.dbif.get.return_value = iter([MagicMock()])
+
+        with self.assertRaises(ValueError):
+            summarize_jobs.process_resource(self.resconf, MagicMock(), self.opts, datasource)
+
+        self.dbif.flush.assert_called_once_with()
+
+    def test_outputfailure(self):
+        summarize_jobs.outputter.factory.return_value.__exit__.side_effect = IOError("output failed")
+        self.dbif.get.return_value = iter([])
+
+        with self.assertRaises(IOError):
+            summarize_jobs.process_resource(self.resconf, MagicMock(), self.opts, MagicMock())
+
+        self.dbif.flush.assert_called_once_with()
+
+    def test_pipelined(self):
+        """ every job goes through the extract, summarize and output stages and
+            no more than threads + extract_queue jobs are in flight """
+        lock = threading.Lock()
+        inflight = [0, 0]
+
+        def presummarize(job, config, resconf, opts):
+            with lock:
+                inflight[0] += 1
+                inflight[1] = max(inflight)
+            time.sleep(0.01)
+            return "jobmeta{0}".format(job.job_pk_id)
+
+        def summarizejob(job, jobmeta, config, opts):
+            time.sleep(0.02)
+            with lock:
+                inflight[0] -= 1
+            return MagicMock(**{"get.return_value": jobmeta}), {}, True, None
+
+        datasource = MagicMock(**{"shardjob.return_value": []})
+        datasource.presummarize.side_effect = presummarize
+        datasource.summarizejob.side_effect = summarizejob
+        jobs = [MagicMock(job_pk_id=i, shardid=None) for i in range(10)]
+        self.dbif.get.return_value = iter(jobs)
+
+        self.opts.update({"threads": 2, "extract_queue": 1, "output_queue": 1, "output_threads": 2})
+        worker = {"config": MagicMock(), "opts": self.opts, "resources": {"res": (self.resconf, datasource)}}
+
+        with patch.dict(summarize_jobs._worker, worker), Pool(3) as extract_pool, Pool(2) as pool:
+            summarize_jobs.process_resource_pipelined("res", self.resconf, worker["config"], self.opts, datasource, pool, extract_pool)
+
+        output = summarize_jobs.outputter.factory.return_value.__enter__.return_value
+        self.assertEqual(sorted("jobmeta{0}".format(i) for i in range(10)), sorted(x[0][0] for x in output.process.call_args_list))
+        self.assertEqual(sorted(range(10)), sorted(x[0][1].job_pk_id for x in datasource.cleanup.call_args_list))
+        self.assertLessEqual(inflight[1], 3)
+        self.assertEqual(2, self.dbif.flush.call_count)
+
+class TestWorker(unittest.TestCase):
+    """ Check the state that is set up once in each worker process """
+
+    @patch.object(summarize_jobs, "DatasourceFactory")
+    @patch.object(summarize_jobs, "filter_plugins", return_value=(["preproc"], ["plugin"]))
+    @patch.object(summarize_jobs, "override_defaults", side_effect=lambda resconf, opts: dict(resconf, overridden=True))
+    @patch.object(summarize_jobs, "loadplugins", return_value=["plugin", "other"])
+    @patch.object(summarize_jobs, "loadpreprocessors", return_value=["preproc"])
+    def test_resource(self, loadpreprocessors, loadplugins, override_defaults, filter_plugins, factory):
+        config = MagicMock(**{"resourceconfigs.return_value": [("res1", {"resource_id": 1}), ("res2", {"resource_id": 2})]})
+        opts = {"threads": 2}
+
+        with patch.dict(summarize_jobs._worker, clear=True):
+            summarize_jobs.init_worker(config, opts)
+
+            # The plugins are loaded once and the datasource is created on first use
+            factory.assert_not_called()
+            first = summarize_jobs.worker_resource("res1")
+            self.assertIs(first, summarize_jobs.worker_resource("res1"))
+            second = summarize_jobs.worker_resource("res2")
+
+            self.assertEqual(({"resource_id": 1, "overridden": True}, factory.return_value), first)
+            self.assertEqual({"resource_id": 2, "overridden": True}, second[0])
+            self.assertEqual(2, factory.call_count)
+            factory.assert_called_with(["preproc"], ["plugin"], {"resource_id": 2, "overridden": True})
+            filter_plugins.assert_called_with({"resource_id": 2, "overridden": True}, ["preproc"], ["plugin", "other"])
+            loadplugins.assert_called_once_with()
+            loadpreprocessors.assert_called_once_with()
+
+class SerialDatasource(Datasource):
+    """ datasource that does not summarize the shards of a job separately """
+
+    def presummarize(self, job, config, resconf, opts):
+        return super().presummarize(job, config, resconf, opts)
+
+    def summarizejob(self, job, jobmeta, config, opts):
+        summary = MagicMock()
+        summary.get.return_value = {"nodes": list(job.nodenames())}
+        return summary, jobmeta.mdata, True, jobmeta.error
+
+    def cleanup(self, opts, job):
+        pass
+
+class TestMergeShardResult(unittest.TestCase):
+    """ Check that the shard results are combined once all have been received """
+
+    def setUp(self):
+        self.nodes = ["node{0}".format(i) for i in range(4)]
+        self.job = Job(1, "1", {'nodes': len(self.nodes), 'start_time': 1000, 'end_time': 2000})
+        self.job.set_nodes(self.nodes)
+        self.shards = [self.job.getshard(i, self.nodes[2 * i:2 * i + 2]) for i in range(2)]
+        for shard in self.shards:
+            shard.setjobdir("/jobs/1/shard{0}".format(shard.shardid))
+        self.shardedjobs = {self.job.job_pk_id: (self.job, len(self.shards), [])}
+
+    def merge(self, results, datasource):
+        merged = None
+        for shard, result in zip(self.shards, results):
+            merged = summarize_jobs.merge_shard_result(self.shardedjobs, shard, result, 1.0, {}, {"fail_fast": True}, datasource)
+        return merged
+
+    def test_serial(self):
+        """ the default datasource summarizes the whole job when the shards are merged """
+        datasource = SerialDatasource([], [])
+        results = [datasource.summarizeshard(shard, {}, {}, {}) for shard in self.shards]
+
+        job, (summary, _, success, _), _ = self.merge(results, datasource)
+        self.assertIs(self.job, job)
+        self.assertTrue(success)
+        self.assertEqual({"nodes": self.nodes}, summary)
+        self.assertEqual({}, self.shardedjobs)
+
+    def test_failedshard(self):
+        """ the shard archive directories are cleaned up with the job if a shard fails """
+        job, result, _ = self.merge([{}, None], MagicMock())
+        self.assertIsNone(result)
+        self.assertEqual("/jobs/1", job.jobdir)
+        self.assertEqual(["/jobs/1/shard0", "/jobs/1/shard1"], [x for x, _ in job.shardjobdirs])
+
+def mockjob(jobid, walltime):
+    job = MagicMock(job_pk_id=jobid, shardid=None, shardnodecount=1, walltime=walltime)
+    job.rawarchives.return_value = [("node1", ["archive"])]
+    return job
+
+class TestJobScheduler(unittest.TestCase):
+    """ Check the order the jobs are handed out in and the limit on running jobs """
+
+    def run_all(self, scheduler):
+        order = []
+        for job in scheduler:
+            order.append(job.job_pk_id)
+            scheduler.done(job)
+        return order
+
+    def test_order(self):
+        jobs = [mockjob(i, walltime) for i, walltime in enumerate([10, 50, 20, 90, 50, 30])]
+
+        # Most expensive first, jobs with the same cost in accounting order
+        self.assertEqual([3, 1, 4, 5, 2, 0], self.run_all(summarize_jobs.JobScheduler(jobs, 10, 2, 0)))
+
+    def test_window(self):
+        jobs = [mockjob(i, walltime) for i, walltime in enumerate([1, 5, 2, 9, 3])]
+
+        # Only three jobs are read ahead so the last jobs can only be reordered
+        # among themselves
+        self.assertEqual([1, 3, 4, 2, 0], self.run_all(summarize_jobs.JobScheduler(jobs, 3, 1, 0)))
+
+    def test_reserve(self):
+        jobs = [mockjob(i, walltime) for i, walltime in enumerate([100, 90, 80, 70, 1, 2])]
+        scheduler = summarize_jobs.JobScheduler(jobs, 10, 3, 1)
+        it = iter(scheduler)
+
+        # One of the three workers is kept for the short jobs
+        running = [next(it) for _ in range(3)]
+        self.assertEqual([0, 1, 4], [job.job_pk_id for job in running])
+
+        # A short job that finishes is replaced by another short job while the
+        # long jobs are still queued
+        scheduler.done(running[2])
+        running[2] = next(it)
+        self.assertEqual(5, running[2].job_pk_id)
+
+        scheduler.done(running[0])
+        self.assertEqual(2, next(it).job_pk_id)
+
+    def test_slots(self):
+        jobs = [mockjob(i, 10) for i in range(3)]
+        scheduler = summarize_jobs.JobScheduler(jobs, 10, 2, 0)
+        it = iter(scheduler)
+        running = [next(it), next(it)]
+
+        # No more jobs are handed out until one of the running jobs is done
+        result = []
+        thread = threading.Thread(target=lambda: result.append(next(it)))
+        thread.start()
+        thread.join(0.2)
+        self.assertTrue(thread.is_alive())
+        self.assertEqual([], result)
+
+        scheduler.done(running[0])
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([2], [job.job_pk_id for job in result])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+""" tests for the queries of the XDMoD datawarehouse account reader """
+import unittest
+from unittest.mock import MagicMock, Mock, patch
+
+from supremm.config import Config
+from supremm.errors import ProcessingError
+from supremm.xdmodaccount import XDMoDAcct
+
+WALLTIME = "(t.`end_time` - t.`start_time`)"
+
+class TestXDMoDAcct(unittest.TestCase):
+    """ Check the host lookup for a batch of jobs and the job skip checks """
+
+    def setUp(self):
+        with patch.object(XDMoDAcct, "detectXdmodSchema", return_value=9):
+            self.acct = XDMoDAcct(1, "hostname", Mock(spec=Config, **{'getsection.return_value': {}}))
+
+        self.opts = {
+            'skip_in_db': True,
+            'dry_run': False,
+            'min_parallel_duration': None,
+            'min_duration': None,
+            'max_nodes': 0,
+            'max_nodetime': None,
+            'max_duration': 0
+        }
+
+    def cursor(self, rows):
+        cur = MagicMock()
+        cur.__iter__.return_value = iter(rows)
+        con = Mock()
+        con.cursor.return_value = cur
+        return con, cur
+
+    def test_gethosts(self):
+        self.acct.nodenamecon, nodenamecur = self.cursor([
+            ("c002.cluster", 10), ("c001.cluster", 10), ("c005.cluster", 11)
+        ])
+        self.acct.hostcon, hostcur = self.cursor([
+            ("c001", "/pcp/c001/a", 10), ("c001", "/pcp/c001/b", 10), ("c002", "/pcp/c002/a", 10), ("c005", "/pcp/c005/a", 11)
+        ])
+
+        hostlists, archives = self.acct.gethosts([10, 11, 12])
+
+        # The hosts keep the allocation order from the query so the head node is first
+        self.assertEqual({10: ["c002", "c001"], 11: ["c005"]}, hostlists)
+        self.assertEqual({10: {"c001": ["/pcp/c001/a", "/pcp/c001/b"], "c002": ["/pcp/c002/a"]}, 11: {"c005": ["/pcp/c005/a"]}}, archives)
+
+        query, data = nodenamecur.execute.call_args[0]
+        self.assertIn("jh.job_id IN (%s, %s, %s)", query)
+        self.assertIn("ORDER BY jh.job_id ASC, jh.order_id ASC", query)
+        self.assertEqual([10, 11, 12], data)
+
+        query, data = hostcur.execute.call_args[0]
+        self.assertEqual([10, 11, 12, 10, 11, 12], data)
+
+    def test_skipcode(self):
+        self.assertEqual(("(CASE WHEN t.`nodes` < 1 THEN {0} END)".format(ProcessingError.INVALID_NODECOUNT), ()), XDMoDAcct.skipcode(self.opts))
+
+        self.opts.update({'min_parallel_duration': 300, 'min_duration': 120, 'max_nodes': 64, 'max_nodetime': 3600000, 'max_duration': 176400})
+        code, data = XDMoDAcct.skipcode(self.opts)
+
+        # The checks are in the same order as in Datasource.presummarize()
+        self.assertEqual("(CASE " + " ".join([
+            "WHEN t.`nodes` > 1 AND {0} < %s THEN {1}".format(WALLTIME, ProcessingError.PARALLEL_TOO_SHORT),
+            "WHEN {0} < %s THEN {1}".format(WALLTIME, ProcessingError.TIME_TOO_SHORT),
+            "WHEN t.`nodes` < 1 THEN {0}".format(ProcessingError.INVALID_NODECOUNT),
+            "WHEN t.`nodes` > %s THEN {0}".format(ProcessingError.JOB_TOO_BIG),
+            "WHEN t.`nodes` * {0} > %s THEN {1}".format(WALLTIME, ProcessingError.JOB_TOO_MANY_NODEHOURS),
+            "WHEN {0} >= %s THEN {1}".format(WALLTIME, ProcessingError.TIME_TOO_LONG)
+        ]) + " END)", code)
+        self.assertEqual((300, 120, 64, 3600000, 176400), data)
+
+        self.opts.update({'min_parallel_duration': None, 'max_nodes': 0, 'max_duration': 0})
+        code, data = XDMoDAcct.skipcode(self.opts)
+        self.assertNotIn(str(ProcessingError.PARALLEL_TOO_SHORT), code)
+        self.assertNotIn(str(ProcessingError.JOB_TOO_BIG), code)
+        self.assertNotIn(str(ProcessingError.TIME_TOO_LONG), code)
+        self.assertEqual(2, code.count("%s"))
+        self.assertEqual((120, 3600000), data)
+
+    def test_noskipcheck(self):
+        self.acct.madcon, cur = self.cursor([])
+
+        for opts in (None, dict(self.opts, skip_in_db=False)):
+            query, data = self.acct.applyskipchecks("SELECT jobs", (1, ), opts)
+            self.assertEqual("SELECT jobs ORDER BY jf.end_time_ts ASC", query)
+            self.assertEqual((1, ), data)
+
+        cur.execute.assert_not_called()
+
+    def test_skipcheck(self):
+        self.acct.madcon, cur = self.cursor([])
+        self.opts.update({'min_duration': 120, 'max_nodes': 64})
+        code, skipdata = XDMoDAcct.skipcode(self.opts)
+
+        query, data = self.acct.applyskipchecks("SELECT jobs WHERE r = %s", (1, ), self.opts)
+
+        self.assertEqual("SELECT * FROM (SELECT jobs WHERE r = %s) t WHERE {0} IS NULL ORDER BY t.`end_time` ASC".format(code), query)
+        self.assertEqual((1, 120, 64), data)
+
+        # The skipped jobs are marked with their error code in one statement. The
+        # parameters follow the placeholders in the SELECT, the job query and the WHERE
+        markquery, markdata = cur.execute.call_args[0]
+        self.assertIn("INSERT INTO modw_supremm.`process`", markquery)
+        self.assertIn("SELECT t.`job_id`, -1000 - {0}, NOW(), 0 FROM (SELECT jobs WHERE r = %s) t WHERE {0} IS NOT NULL".format(code), markquery)
+        self.assertIn("ON DUPLICATE KEY UPDATE", markquery)
+        self.assertEqual(skipdata + (1, ) + skipdata, markdata)
+        self.assertEqual(markquery.count("%s"), len(markdata))
+
+    def test_skipcheckdryrun(self):
+        self.acct.madcon, cur = self.cursor([])
+        self.opts.update({'dry_run': True, 'max_duration': 176400})
+
+        query, data = self.acct.applyskipchecks("SELECT jobs WHERE r = %s", (1, ), self.opts)
+
+        self.assertIn("IS NULL ORDER BY t.`end_time` ASC", query)
+        self.assertEqual((1, 176400), data)
+        self.assertEqual(query.count("%s"), len(data))
+        cur.execute.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()